@@ -1,28 +1,71 @@
 import os
+import re
+import json
 import uuid
+import asyncio
+import hashlib
 import logging
 import uvicorn
-import shutil
-from dotenv import load_dotenv
-from fastapi import (FastAPI, File, UploadFile, 
+import threading
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import (FastAPI, File, Form, Query, UploadFile, BackgroundTasks,
                      HTTPException, Request, Response)
-from pydantic_models_format import (QueryInput, QueryResponse, 
-                                    DocumentInfo, DeleteFileRequest)
-from langchain_utils import get_rag_chain
-from db_utils import  (insert_application_logs, get_chat_history,
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from pydantic_models_format import (QueryInput, QueryResponse, ModelName,
+                                    BatchQueryInput, BatchItemResult,
+                                    DocumentInfo, DeleteFileRequest,
+                                    UploadResponse, IngestionJobStatus,
+                                    BulkDeleteRequest, BulkDeleteResponse, BulkReplaceResponse)
+from langchain_utils import (get_rag_chain, warm_rag_chains, built_models, update_session_summary,
+                             acontextualize_question)
+from db_utils import  (init_db, db_initialized, insert_application_logs,
                        get_all_documents, insert_document_record, 
-                       delete_document_record)
-from chroma_utils import index_document_to_chroma, delete_documents_from_chroma
+                       delete_document_record, get_ingestion_job,
+                       find_document_by_hash, get_document_record,
+                       get_documents_page, count_documents, get_document_ids,
+                       get_unfinished_ingestion_jobs)
+from log_writer import ApplicationLogWriter
+from ingestion_utils import IngestionQueue, save_upload
+from chroma_utils import (delete_documents_from_chroma, ensure_lexical_index, get_vector_store,
+                          vector_store_loaded, get_embedding_model, get_corpus_version, on_corpus_change,
+                          batch_similarity_search, bulk_delete_documents)
+from index_maintenance import index_report, consistency_check
+from retrieval_utils import RetrievalMode, vector_search_plan
+from tracing_utils import start_trace, finish_trace, set_trace_model, defer_trace, span
+from semantic_cache import SemanticAnswerCache, SEMANTIC_CACHE_ENABLED
+from singleflight import AsyncSingleFlight
 
-from prometheus_client import (Histogram, Counter, Gauge, 
-                               Summary, generate_latest, 
-                               CONTENT_TYPE_LATEST)
-import psutil
-import threading
+from prometheus_client import Histogram, Counter
+from metrics_utils import sampled_gauge, route_label, metrics_payload, ProcessMonitor
+from logging_utils import configure_logging, stop_logging, chat_logger
 import time 
 
-logging.basicConfig(filename='application.log', level=logging.INFO)
-app = FastAPI()
+# Run the warm-up pass (see warm_up) before accepting traffic; with "false"
+# the server starts at once and warms up in the background, and /ready
+# reports when it is done
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "warm-up")
+
+# /chat/batch: LLM calls in flight for all batches of this process together,
+# and seconds of LLM time (rewrite and answer) one question may take
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+BATCH_ITEM_TIMEOUT = float(os.getenv("BATCH_ITEM_TIMEOUT", "60"))
+
+# Largest page /list-docs returns when a limit is given
+LIST_DOCS_MAX_LIMIT = int(os.getenv("LIST_DOCS_MAX_LIMIT", "1000"))
+ALLOWED_EXTENSIONS = ['.pdf', '.docx', '.html']
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services (see startup) and stop them on shutdown"""
+    await startup()
+    yield
+    await shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 ## ------- Prometheus Metrics --------------
 REQUEST_COUNT = Counter("http_requests_total", 
@@ -39,18 +82,64 @@ UPLOAD_SUCCESS = Counter("upload_success_total",
 UPLOAD_FAIL = Counter("upload_fail_total", 
                       "Failed document uploads", 
                       ["file_type"])
+UPLOAD_DUPLICATES = Counter("upload_duplicate_total", 
+                            "Uploads skipped because identical content was already indexed", 
+                            ["file_type"])
 NEW_SESSIONS = Counter("new_sessions_total", 
                        "New chat sessions created")
 
-# System monitoring
-CPU_USAGE = Gauge("cpu_usage_percent", "CPU usage percentage")
-MEMORY_USAGE = Gauge("memory_usage_percent", "Memory usage percentage")
-DISK_USAGE = Gauge("disk_usage_percent", "Disk usage percentage")
-
 # Model response tracking
 MODEL_ERRORS = Counter("model_errors_total", 
                       "Total model errors", 
                       ["model", "error_type"])
+# Write-behind conversation logging
+LOG_FLUSH_LATENCY = Histogram("log_writer_flush_seconds",
+                              "Time to commit one batch of application log rows")
+LOG_FLUSH_ROWS = Histogram("log_writer_flush_rows",
+                           "Application log rows committed per batch",
+                           buckets=(1, 5, 10, 25, 50, 100, 250, 500))
+LOG_QUEUE_FULL = Counter("log_writer_queue_full_total",
+                         "Log rows written inline because the queue was full")
+
+# Semantic answer cache
+ANSWER_CACHE_HITS = Counter("answer_cache_hits_total",
+                            "Chat answers served from the semantic cache", ["model"])
+ANSWER_CACHE_MISSES = Counter("answer_cache_misses_total",
+                              "Chat questions not found in the semantic cache", ["model"])
+ANSWER_CACHE_SAVED_SECONDS = Counter("answer_cache_saved_seconds_total",
+                                     "Original latency of answers served from the cache", ["model"])
+
+# Batch questions
+BATCH_ITEMS = Counter("chat_batch_items_total",
+                      "Questions answered through /chat/batch", ["model", "status"])
+BATCH_VECTOR_SEARCHES = Counter("chat_batch_vector_searches_total",
+                                "Collection queries run for /chat/batch, each for a group of questions")
+
+TIME_TO_FIRST_TOKEN = Histogram("chat_time_to_first_token_seconds",
+                                "Time from request to first streamed answer token",
+                                ["model"])
+
+def _observe_log_flush(rows, seconds):
+    LOG_FLUSH_ROWS.observe(rows)
+    LOG_FLUSH_LATENCY.observe(seconds)
+
+log_writer = ApplicationLogWriter(on_flush=_observe_log_flush)
+LOG_QUEUE_DEPTH = sampled_gauge("log_writer_queue_depth",
+                                "Application log rows waiting to be flushed", log_writer.qsize)
+
+def _record_ingestion_result(job, success):
+    file_extension = os.path.splitext(job['filename'])[1].lower()
+    if success:
+        UPLOAD_SUCCESS.labels(file_type=file_extension).inc()
+    else:
+        UPLOAD_FAIL.labels(file_type=file_extension).inc()
+
+ingestion_queue = IngestionQueue(on_finish=_record_ingestion_result)
+
+answer_cache = SemanticAnswerCache(lambda question: get_embedding_model().embed_query(question))
+on_corpus_change(answer_cache.invalidate)
+ANSWER_CACHE_ENTRIES = sampled_gauge("answer_cache_entries",
+                                     "Answers held in the semantic cache", lambda: len(answer_cache))
 
 # -------------------------------------
 # Middleware for automatic request tracking
@@ -61,42 +150,182 @@ async def prometheus_middleware(request: Request, call_next):
     response = await call_next(request)
     duration = time.time() - start_time
     
-    # Log request count and latency
-    REQUEST_COUNT.labels(method=request.method, endpoint=request.url.path).inc()
-    REQUEST_LATENCY.labels(endpoint=request.url.path).observe(duration)
+    # Log request count and latency, labelled by route template so ids in
+    # paths do not create a label value each
+    endpoint = route_label(request)
+    REQUEST_COUNT.labels(method=request.method, endpoint=endpoint).inc()
+    REQUEST_LATENCY.labels(endpoint=endpoint).observe(duration)
     
     return response
 
+@app.middleware("http")
+async def request_tracing(request: Request, call_next):
+    """Give every request an id and log its per-stage trace when it ends"""
+    trace = start_trace(request.headers.get("X-Request-ID"), request.method, request.url.path)
+    try:
+        response = await call_next(request)
+    except Exception:
+        finish_trace(trace, 500)
+        raise
+    response.headers["X-Request-ID"] = trace.request_id
+    # Streaming endpoints finish their own trace once the stream ends
+    if not trace.deferred:
+        finish_trace(trace, response.status_code)
+    return response
+
 # ─────────────────────────────
-# System Metrics Background Task
+# Process monitoring
 # ─────────────────────────────
-def track_system_metrics():
-    """Background task to continuously monitor system metrics"""
-    while True:
-        try:
-            CPU_USAGE.set(psutil.cpu_percent(interval=None))
-            MEMORY_USAGE.set(psutil.virtual_memory().percent)
-            DISK_USAGE.set(psutil.disk_usage("/").percent)
-        except Exception as e:
-            logging.error(f"Error tracking system metrics: {e}")
-        time.sleep(5)
+# System gauges are sampled at scrape time (see metrics_utils); this task
+# only probes event-loop lag and thread pool pressure
+process_monitor = ProcessMonitor()
+
+# ─────────────────────────────
+# Lifecycle
+# ─────────────────────────────
+warm_up_done = threading.Event()
+
+def warm_up():
+    """Open the vector store, index existing chunks for keyword search if the
+    lexical index is new, prime the embedding client and the vector index
+    with a probe search and build the RAG chain for every model"""
+    start_time = time.perf_counter()
+    ensure_lexical_index()
+    try:
+        get_vector_store().similarity_search(WARMUP_QUERY, k=1)
+    except Exception as e:
+        # The embedding API may be unreachable; requests will retry it
+        logging.warning(f"Warm-up search failed: {e}")
+    warm_rag_chains([model.value for model in ModelName])
+    warm_up_done.set()
+    logging.info(f"Warm-up finished in {time.perf_counter() - start_time:.2f}s")
+
+def _background_warm_up():
+    try:
+        warm_up()
+    except Exception as e:
+        logging.error(f"Warm-up failed: {e}")
 
-@app.on_event("startup")
-def start_system_monitoring():
-    """Start background system monitoring thread"""
-    threading.Thread(target=track_system_metrics, daemon=True).start()
-    logging.info("System monitoring started")
+async def startup():
+    """Start logging, prepare the database, start the log writer, ingestion
+    workers and process monitor, then warm up (or start warming up in the
+    background)"""
+    # Records are queued here and written as JSON by a background thread
+    configure_logging()
+    await run_in_threadpool(init_db)
+    log_writer.start()
+    ingestion_queue.start()
+    process_monitor.start()
+    if STARTUP_WARMUP:
+        await run_in_threadpool(warm_up)
+    else:
+        threading.Thread(target=_background_warm_up, name="warm-up", daemon=True).start()
+
+async def shutdown():
+    """Stop taking ingestion jobs and flush queued application logs"""
+    # Waits for running jobs to reach the end of their current batch
+    await run_in_threadpool(ingestion_queue.stop)
+    await process_monitor.stop()
+    log_writer.stop()
+    logging.info("Application log writer flushed")
+    stop_logging()
+
+async def log_chat_turn(session_id, question, answer, model):
+    """Hand a chat turn to the log writer, writing inline if its queue is full"""
+    with span("log.submit"):
+        if log_writer.submit(session_id, question, answer, model):
+            return
+    LOG_QUEUE_FULL.inc()
+    await run_in_threadpool(insert_application_logs, session_id, question, answer, model)
 
 @app.get("/metrics")
 def metrics():
     """Prometheus metrics endpoint"""
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    body, content_type = metrics_payload()
+    return Response(body, media_type=content_type)
+
+def _cache_scope(model, query_input):
+    """Answers are only shared between requests using the same model and retrieval settings"""
+    options = json.dumps(query_input.retrieval.model_dump(mode="json"), sort_keys=True)
+    return f"{model}:{query_input.retrieval_mode.value}:{options}"
+
+def _chain_inputs(query_input, chat_history, standalone_question):
+    return {
+        "input": query_input.question,
+        "chat_history": chat_history,
+        "standalone_question": standalone_question,
+        "retrieval_mode": query_input.retrieval_mode.value,
+        "retrieval_options": query_input.retrieval.model_dump(mode="json")
+    }
+
+async def lookup_cached_answer(model, standalone_question, query_input):
+    """Look the standalone question up in the semantic answer cache.
+
+    Returns (hit, embedding); the embedding is reused to store the answer on a miss.
+    Lexical requests skip the cache, since a lookup needs an embedding call.
+    """
+    if not SEMANTIC_CACHE_ENABLED or query_input.retrieval_mode == RetrievalMode.LEXICAL:
+        return None, None
+    try:
+        vector = await run_in_threadpool(answer_cache.embed, standalone_question)
+    except Exception as e:
+        logging.error(f"Error embedding question for answer cache: {e}")
+        return None, None
+    with span("cache.lookup"):
+        hit = answer_cache.lookup(_cache_scope(model, query_input), get_corpus_version(),
+                                  standalone_question, vector)
+    if hit:
+        ANSWER_CACHE_HITS.labels(model=model).inc()
+        ANSWER_CACHE_SAVED_SECONDS.labels(model=model).inc(hit.latency)
+    else:
+        ANSWER_CACHE_MISSES.labels(model=model).inc()
+    return hit, vector
+
+# Concurrent /chat requests asking the same question over the same history
+# wait for one rewrite, retrieval and answer instead of each running them
+chat_flight = AsyncSingleFlight("chat")
+
+def _coalesce_key(model, query_input, chat_history):
+    """(model and retrieval settings, normalized question, history fingerprint)"""
+    question = re.sub(r"\s+", " ", query_input.question).strip().casefold()
+    history = hashlib.sha256(json.dumps(chat_history, sort_keys=True).encode("utf-8")).hexdigest()
+    return (_cache_scope(model, query_input), question, history)
+
+async def answer_question(query_input, chat_history, model, session_id):
+    """Rewrite, consult the answer cache and run the RAG chain; returns the answer"""
+    start_time = time.perf_counter()
+    corpus_version = get_corpus_version()
+    
+    # Resolve follow-ups into a standalone question and try the answer cache
+    standalone_question = await acontextualize_question(query_input.question, chat_history,
+                                                        model, session_id)
+    hit, question_vector = await lookup_cached_answer(model, standalone_question, query_input)
+    if hit:
+        return hit.answer
+    
+    # Get RAG chain
+    rag_chain = get_rag_chain(model)
+    
+    # Track model call
+    MODEL_CALLS.labels(model=model).inc()
+    
+    # Invoke RAG chain
+    result = await rag_chain.ainvoke(_chain_inputs(query_input, chat_history, standalone_question))
+    answer = result['answer']
+    if question_vector is not None:
+        answer_cache.store(_cache_scope(model, query_input), corpus_version,
+                           standalone_question, answer,
+                           time.perf_counter() - start_time, question_vector)
+    return answer
 
 @app.post("/chat", response_model=QueryResponse)
-def chat(query_input: QueryInput):
+async def chat(query_input: QueryInput, background_tasks: BackgroundTasks):
     """Handle chat queries with RAG chain"""
     session_id = query_input.session_id
-    logging.info(f"Session ID: {session_id}, User Query: {query_input.question}, Model: {query_input.model.value}")
+    model = query_input.model.value
+    chat_logger.info("Chat request", extra={"fields": {"session_id": session_id, "model": model,
+                                                       "question": query_input.question}})
+    set_trace_model(model)
     
     # Generate new session ID if not provided
     if not session_id:
@@ -104,89 +333,369 @@ def chat(query_input: QueryInput):
         NEW_SESSIONS.inc()
     
     try:
-        # Get chat history
-        chat_history = get_chat_history(session_id)
-        
-        # Get RAG chain
-        rag_chain = get_rag_chain(query_input.model.value)
+        # Get chat history without blocking the event loop
+        chat_history = await run_in_threadpool(log_writer.get_chat_history, session_id)
         
-        # Track model call
-        MODEL_CALLS.labels(model=query_input.model.value).inc()
+        answer = await chat_flight.run(_coalesce_key(model, query_input, chat_history),
+                                       lambda: answer_question(query_input, chat_history, model, session_id))
         
-        # Invoke RAG chain
-        result = rag_chain.invoke({
-            "input": query_input.question,
-            "chat_history": chat_history
-        })
+        # Queue the turn for the background log writer
+        await log_chat_turn(session_id, query_input.question, answer, model)
+        chat_logger.info("Chat response", extra={"fields": {"session_id": session_id, "answer": answer}})
         
-        answer = result['answer']
-        print("Answer:", answer)
-        
-        # Log to database
-        insert_application_logs(session_id, query_input.question, answer, query_input.model.value)
-        logging.info(f"Session ID: {session_id}, AI Response: {answer}")
+        # Fold turns that left the history window into the session summary
+        background_tasks.add_task(update_session_summary, session_id, model)
         
         return QueryResponse(answer=answer, session_id=session_id, model=query_input.model)
         
     except Exception as e:
         # Track model errors
-        MODEL_ERRORS.labels(model=query_input.model.value, error_type=type(e).__name__).inc()
+        MODEL_ERRORS.labels(model=model, error_type=type(e).__name__).inc()
         logging.error(f"Error in chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
-@app.post("/upload-document")
-def upload_document(file: UploadFile = File(...)):
-    """Upload and index document"""
-    allowed_extensions = ['.pdf', '.docx', '.html']
-    file_extension = os.path.splitext(file.filename)[1].lower()
+def _sse_event(data, event=None):
+    """Format a payload as a Server-Sent Event"""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+@app.post("/chat/stream")
+async def chat_stream(query_input: QueryInput):
+    """Stream answer tokens as Server-Sent Events while the LLM produces them"""
+    session_id = query_input.session_id
+    model = query_input.model.value
+    chat_logger.info("Chat request", extra={"fields": {"session_id": session_id, "model": model,
+                                                       "question": query_input.question}})
+    set_trace_model(model)
+    trace = defer_trace()
     
-    if file_extension not in allowed_extensions:
+    # Generate new session ID if not provided
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        NEW_SESSIONS.inc()
+
+    chat_history = await run_in_threadpool(log_writer.get_chat_history, session_id)
+    rag_chain = get_rag_chain(model)
+
+    async def event_stream():
+        start_time = time.perf_counter()
+        corpus_version = get_corpus_version()
+        first_token = True
+        answer_parts = []
+        try:
+            standalone_question = await acontextualize_question(query_input.question, chat_history,
+                                                                model, session_id)
+            hit, question_vector = await lookup_cached_answer(model, standalone_question, query_input)
+            if hit:
+                TIME_TO_FIRST_TOKEN.labels(model=model).observe(time.perf_counter() - start_time)
+                answer_parts.append(hit.answer)
+                yield _sse_event({"token": hit.answer})
+            else:
+                MODEL_CALLS.labels(model=model).inc()
+                async for chunk in rag_chain.astream(_chain_inputs(query_input, chat_history,
+                                                                   standalone_question)):
+                    token = chunk.get("answer")
+                    if not token:
+                        continue
+                    if first_token:
+                        TIME_TO_FIRST_TOKEN.labels(model=model).observe(time.perf_counter() - start_time)
+                        first_token = False
+                    answer_parts.append(token)
+                    yield _sse_event({"token": token})
+        except Exception as e:
+            MODEL_ERRORS.labels(model=model, error_type=type(e).__name__).inc()
+            logging.error(f"Error in chat stream endpoint: {e}")
+            yield _sse_event({"detail": f"Error processing query: {str(e)}"}, event="error")
+            return
+
+        answer = "".join(answer_parts)
+        if not hit and question_vector is not None:
+            answer_cache.store(_cache_scope(model, query_input), corpus_version,
+                               standalone_question, answer,
+                               time.perf_counter() - start_time, question_vector)
+        await log_chat_turn(session_id, query_input.question, answer, model)
+        chat_logger.info("Chat response", extra={"fields": {"session_id": session_id, "answer": answer}})
+        yield _sse_event({"session_id": session_id, "model": model, "cached": bool(hit)}, event="done")
+
+    async def traced_event_stream():
+        # Errors are reported in-band, the HTTP status is always 200
+        try:
+            async for event in event_stream():
+                yield event
+        finally:
+            finish_trace(trace, 200)
+
+    return StreamingResponse(traced_event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"},
+                             background=BackgroundTask(update_session_summary, session_id, model))
+
+# ─────────────────────────────
+# Batch questions
+# ─────────────────────────────
+# Shared by every batch, so batches queue for LLM calls among themselves
+# while /chat and /chat/stream never wait for these slots
+batch_llm_slots = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+async def _finish_batch_item(index, query_input, session_id, start_time, status,
+                             answer=None, cached=False, error=None):
+    """Log an answered item and format its NDJSON result line"""
+    model = query_input.model.value
+    BATCH_ITEMS.labels(model=model, status=status).inc()
+    if status == "ok":
+        await log_chat_turn(session_id, query_input.question, answer, model)
+        chat_logger.info("Chat response", extra={"fields": {"session_id": session_id, "answer": answer}})
+    result = BatchItemResult(index=index, status=status, answer=answer, session_id=session_id,
+                             model=query_input.model, cached=cached, error=error,
+                             seconds=time.perf_counter() - start_time)
+    return result.model_dump_json() + "\n"
+
+async def answer_batch(batch, session_ids, histories):
+    """Answer every item of a batch, yielding NDJSON lines as items finish.
+
+    The questions are embedded in one call and vector searches with the same
+    parameters run as one collection query; the RAG chain then runs per item
+    with its retrieved candidates passed in (see vector_search_plan).
+    """
+    start_time = time.perf_counter()
+    corpus_version = get_corpus_version()
+    items = batch.items
+    timeout = min(batch.item_timeout or BATCH_ITEM_TIMEOUT, BATCH_ITEM_TIMEOUT)
+    request_slots = asyncio.Semaphore(min(batch.max_concurrency or BATCH_MAX_CONCURRENCY,
+                                          BATCH_MAX_CONCURRENCY))
+    # LLM seconds used by each item so far, counted against its timeout
+    spent = [0.0] * len(items)
+
+    async def limited(index, coro_fn):
+        async with request_slots, batch_llm_slots:
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(coro_fn(), timeout - spent[index])
+            finally:
+                spent[index] += time.perf_counter() - started
+
+    async def failed(index, e):
+        model = items[index].model.value
+        MODEL_ERRORS.labels(model=model, error_type=type(e).__name__).inc()
+        if isinstance(e, asyncio.TimeoutError):
+            return await _finish_batch_item(index, items[index], session_ids[index], start_time, "timeout",
+                                            error=f"No answer within {timeout:g}s")
+        logging.error(f"Error in chat batch item {index}: {e}")
+        return await _finish_batch_item(index, items[index], session_ids[index], start_time, "error",
+                                        error=f"Error processing query: {str(e)}")
+
+    # Standalone questions; only follow-ups in a session call the LLM
+    rewritten = await asyncio.gather(
+        *(limited(index, lambda index=index: acontextualize_question(
+            items[index].question, histories[index], items[index].model.value, session_ids[index]))
+          for index in range(len(items))),
+        return_exceptions=True)
+    questions = {}
+    for index, result in enumerate(rewritten):
+        if isinstance(result, Exception):
+            yield await failed(index, result)
+        else:
+            questions[index] = result
+
+    # One embedding call for every question the cache or a vector search needs
+    vectors = {}
+    to_embed = list(dict.fromkeys(question for index, question in questions.items()
+                                  if items[index].retrieval_mode != RetrievalMode.LEXICAL))
+    if to_embed:
+        try:
+            embeddings = await run_in_threadpool(get_embedding_model().embed_queries, to_embed)
+            vectors = dict(zip(to_embed, embeddings))
+        except Exception as e:
+            # Items embed their own question when they get to it
+            logging.error(f"Error embedding batch questions: {e}")
+
+    # Answer cache (served from the embeddings just made)
+    cache_vectors = {}
+    for index, question in list(questions.items()):
+        hit, cache_vectors[index] = await lookup_cached_answer(items[index].model.value, question, items[index])
+        if hit:
+            del questions[index]
+            yield await _finish_batch_item(index, items[index], session_ids[index], start_time, "ok",
+                                           answer=hit.answer, cached=True)
+
+    # Vector searches with the same k and filter run as one query
+    groups = {}
+    for index, question in questions.items():
+        plan = vector_search_plan(items[index].retrieval_mode, items[index].retrieval.model_dump(mode="json"))
+        if plan and question in vectors:
+            k, where = plan
+            groups.setdefault((k, json.dumps(where, sort_keys=True)), []).append(index)
+    vector_documents = {}
+    for (k, where), group in groups.items():
+        try:
+            BATCH_VECTOR_SEARCHES.inc()
+            results = await run_in_threadpool(batch_similarity_search,
+                                              [vectors[questions[index]] for index in group], k, json.loads(where))
+            vector_documents.update(zip(group, results))
+        except Exception as e:
+            # Those items search on their own in the chain
+            logging.error(f"Error in batched vector search: {e}")
+
+    async def answer(index):
+        query_input = items[index]
+        model = query_input.model.value
+        inputs = _chain_inputs(query_input, histories[index], questions[index])
+        if index in vector_documents:
+            inputs["vector_documents"] = vector_documents[index]
+        MODEL_CALLS.labels(model=model).inc()
+        try:
+            result = await limited(index, lambda: get_rag_chain(model).ainvoke(inputs))
+        except Exception as e:
+            return await failed(index, e)
+        if cache_vectors.get(index) is not None:
+            answer_cache.store(_cache_scope(model, query_input), corpus_version, questions[index],
+                               result['answer'], spent[index], cache_vectors[index])
+        return await _finish_batch_item(index, query_input, session_ids[index], start_time, "ok",
+                                        answer=result['answer'])
+
+    tasks = [asyncio.ensure_future(answer(index)) for index in questions]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client went away: stop the calls it will not read
+        for task in tasks:
+            task.cancel()
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchQueryInput):
+    """Answer many questions with shared retrieval and a bounded number of
+    concurrent LLM calls; one NDJSON line per question, in completion order"""
+    trace = defer_trace()
+    chat_logger.info("Chat batch request", extra={"fields": {"items": len(batch.items)}})
+    session_ids = []
+    for query_input in batch.items:
+        if query_input.session_id:
+            session_ids.append(query_input.session_id)
+        else:
+            session_ids.append(str(uuid.uuid4()))
+            NEW_SESSIONS.inc()
+
+    # New sessions have no history to read
+    histories = await run_in_threadpool(
+        lambda: [log_writer.get_chat_history(session_id) if query_input.session_id else []
+                 for query_input, session_id in zip(batch.items, session_ids)])
+    continued = {(query_input.session_id, query_input.model.value)
+                 for query_input in batch.items if query_input.session_id}
+
+    async def traced_lines():
+        # Errors are reported per item, the HTTP status is always 200
+        try:
+            async for line in answer_batch(batch, session_ids, histories):
+                yield line
+        finally:
+            finish_trace(trace, 200)
+
+    def summarize_sessions():
+        for session_id, model in continued:
+            update_session_summary(session_id, model)
+
+    return StreamingResponse(traced_lines(), media_type="application/x-ndjson",
+                             background=BackgroundTask(summarize_sessions))
+
+def _check_file_type(file: UploadFile):
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
         UPLOAD_FAIL.labels(file_type=file_extension).inc()
         raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_extension}")
-    
-    temp_file_path = f"temp_{file.filename}"
-    file_id = None
+    return file_extension
+
+def _check_replace_target(file_id: Optional[int]):
+    if file_id is not None and get_document_record(file_id) is None:
+        raise HTTPException(status_code=404, detail=f"Document with file ID {file_id} not found")
+
+def _save_upload(file: UploadFile):
+    """Write an upload to disk, kept until its ingestion job has finished
+    with it; returns (path, content hash)"""
+    upload_path = ingestion_queue.upload_path(file.filename)
+    try:
+        return upload_path, save_upload(file.file, upload_path)
+    except Exception as e:
+        UPLOAD_FAIL.labels(file_type=os.path.splitext(file.filename)[1].lower()).inc()
+        logging.error(f"Error saving upload {file.filename}: {e}")
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
+
+def _queue_saved_upload(filename: str, upload_path: str, content_hash: str,
+                        replace_file_id: Optional[int] = None):
+    """Queue a saved upload for indexing, as a new document or, with
+    ``replace_file_id``, as the new version of that document"""
+    file_extension = os.path.splitext(filename)[1].lower()
+    new_file_id = None
     
     try:
-        # Save the uploaded file to temp files
-        with open(temp_file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        # Identical content is already indexed (or being indexed)
+        duplicate = find_document_by_hash(content_hash)
+        if duplicate:
+            os.remove(upload_path)
+            UPLOAD_DUPLICATES.labels(file_type=file_extension).inc()
+            return UploadResponse(message=f"File {filename} is already indexed as {duplicate['filename']}",
+                                  file_id=duplicate['id'], duplicate=True)
         
-        # Insert document record
-        file_id = insert_document_record(file.filename)
-        
-        # Index document to Chroma
-        success = index_document_to_chroma(temp_file_path, file_id)
-        
-        if success:
-            UPLOAD_SUCCESS.labels(file_type=file_extension).inc()
-            logging.info(f"Successfully uploaded and indexed: {file.filename}")
-            return {"message": f"File {file.filename} has been added successfully"}
+        # A new version of a document is re-indexed incrementally under its file id
+        if replace_file_id is not None:
+            file_id = replace_file_id
         else:
-            UPLOAD_FAIL.labels(file_type=file_extension).inc()
-            if file_id:
-                delete_document_record(file_id)
-            raise HTTPException(status_code=500, detail=f"Failed to index {file.filename}")
+            file_id = new_file_id = insert_document_record(filename, content_hash)
+        
+        # Queue indexing to Chroma
+        job_id = ingestion_queue.submit(file_id, filename, upload_path, content_hash)
+        logging.info(f"Queued ingestion job {job_id} for {filename}")
+        return UploadResponse(message=f"File {filename} has been queued for indexing",
+                              job_id=job_id, file_id=file_id)
             
-    except HTTPException:
-        # Re-raise HTTP exceptions
-        raise
     except Exception as e:
         UPLOAD_FAIL.labels(file_type=file_extension).inc()
-        logging.error(f"Error uploading document {file.filename}: {e}")
-        if file_id:
-            delete_document_record(file_id)
+        logging.error(f"Error uploading document {filename}: {e}")
+        if new_file_id:
+            delete_document_record(new_file_id)
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
         raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
-    finally:
-        # Clean up temp file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+
+@app.post("/upload-document", status_code=202, response_model=UploadResponse)
+def upload_document(response: Response, file: UploadFile = File(...),
+                    replace_file_id: Optional[int] = Form(None)):
+    """Save an uploaded document and queue it for background indexing.
+    With ``replace_file_id`` the file is a new version of that document"""
+    _check_file_type(file)
+    _check_replace_target(replace_file_id)
+    upload = _queue_saved_upload(file.filename, *_save_upload(file), replace_file_id)
+    if upload.duplicate:
+        response.status_code = 200
+    return upload
+
+@app.get("/jobs/{job_id}", response_model=IngestionJobStatus)
+def get_job(job_id: str):
+    """Report the status and progress of an ingestion job"""
+    job = get_ingestion_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return IngestionJobStatus(job_id=job['id'], **{key: job[key] for key in IngestionJobStatus.model_fields
+                                                   if key in job})
 
 @app.get("/list-docs", response_model=list[DocumentInfo])
-def list_documents():
-    """Get list of all documents"""
+def list_documents(response: Response,
+                   limit: Optional[int] = Query(None, ge=1, le=LIST_DOCS_MAX_LIMIT),
+                   before_id: Optional[int] = Query(None, ge=1)):
+    """Get list of all documents, newest first. With ``limit`` one page is
+    returned; X-Next-Before-Id holds the ``before_id`` of the next page"""
     try:
-        return get_all_documents()
+        if limit is None:
+            return get_all_documents()
+        documents = get_documents_page(limit + 1, before_id)
+        if len(documents) > limit:
+            documents = documents[:limit]
+            response.headers["X-Next-Before-Id"] = str(documents[-1]['id'])
+        response.headers["X-Total-Count"] = str(count_documents())
+        return documents
     except Exception as e:
         logging.error(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving documents")
@@ -194,6 +703,10 @@ def list_documents():
 @app.post("/delete-doc")
 def delete_document(request: DeleteFileRequest):
     """Delete document from both Chroma and database"""
+    # A running job would keep writing chunks for the deleted document
+    if _ingesting_file_ids([request.file_id]):
+        raise HTTPException(status_code=409,
+                            detail=f"Document {request.file_id} is being ingested; retry when its job finishes")
     try:
         # Delete from Chroma
         chroma_delete_success = delete_documents_from_chroma(request.file_id)
@@ -216,10 +729,110 @@ def delete_document(request: DeleteFileRequest):
         logging.error(f"Error deleting document {request.file_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
 
+def _ingesting_file_ids(file_ids):
+    """The given file ids that have a queued or running ingestion job"""
+    return {job['file_id'] for job in get_unfinished_ingestion_jobs()} & set(file_ids)
+
+def _bulk_delete(file_ids):
+    """Delete documents that exist and are not being indexed"""
+    requested = set(file_ids)
+    known = requested & get_document_ids()
+    ingesting = _ingesting_file_ids(known)
+    deleted = bulk_delete_documents(sorted(known - ingesting)) if known - ingesting else []
+    return BulkDeleteResponse(deleted=deleted, not_found=sorted(requested - known),
+                              in_progress=sorted(ingesting))
+
+@app.post("/documents/delete", response_model=BulkDeleteResponse)
+def delete_documents_bulk(request: BulkDeleteRequest):
+    """Delete many documents from Chroma, the lexical index and the database
+    in one pass"""
+    try:
+        return _bulk_delete(request.file_ids)
+    except Exception as e:
+        logging.error(f"Error deleting {len(request.file_ids)} documents: {e}")
+        raise HTTPException(status_code=500, detail=f"Error deleting documents: {str(e)}")
+
+@app.post("/documents/replace", status_code=202, response_model=BulkReplaceResponse)
+def replace_documents(files: List[UploadFile] = File(...),
+                      file_ids: List[int] = Form(...),
+                      delete_file_ids: List[int] = Form([])):
+    """Upload new versions of documents and remove others in one request.
+    ``files[i]`` becomes the new version of document ``file_ids[i]``;
+    ``delete_file_ids`` are removed after the uploads are queued. Every
+    target and file type is checked before anything is queued"""
+    if len(files) != len(file_ids):
+        raise HTTPException(status_code=400,
+                            detail=f"Got {len(files)} files for {len(file_ids)} file IDs")
+    if len(set(file_ids)) != len(file_ids):
+        raise HTTPException(status_code=400, detail="A file ID is listed more than once")
+    for file in files:
+        _check_file_type(file)
+    missing = sorted(set(file_ids) - get_document_ids())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Documents not found: {missing}")
+    conflicting = sorted(set(file_ids) & set(delete_file_ids))
+    if conflicting:
+        raise HTTPException(status_code=400,
+                            detail=f"File IDs {conflicting} are both replaced and listed for deletion")
+
+    saved, uploads = [], []
+    try:
+        for file in files:
+            saved.append(_save_upload(file))
+        for file, file_id, (upload_path, content_hash) in zip(files, file_ids, saved):
+            uploads.append(_queue_saved_upload(file.filename, upload_path, content_hash, file_id))
+    except HTTPException:
+        # Uploads not queued yet are dropped; queued ones are reported by their jobs
+        for upload_path, _ in saved[len(uploads):]:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+        raise
+    removed = BulkDeleteResponse()
+    if delete_file_ids:
+        try:
+            removed = _bulk_delete(delete_file_ids)
+        except Exception as e:
+            logging.error(f"Error deleting {len(delete_file_ids)} documents: {e}")
+            raise HTTPException(status_code=500, detail=f"Error deleting documents: {str(e)}")
+    return BulkReplaceResponse(uploads=uploads, removed=removed)
+
+@app.get("/index/report")
+def get_index_report():
+    """Sizes of the vector store and the database, and how much of them is
+    taken by deleted entries (see index_maintenance.py)"""
+    return index_report()
+
+@app.get("/index/check")
+def check_index():
+    """Compare documents, vector store chunks and lexical index rows; read
+    only, repair with ``python index_maintenance.py check --repair``"""
+    return consistency_check(repair=False)
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": time.time()}
 
+@app.get("/ready")
+def readiness_check(response: Response):
+    """Readiness: the database is set up, the vector store is open and the
+    chains are built (i.e. warm-up has finished)"""
+    checks = {
+        "database": db_initialized(),
+        "vector_store": vector_store_loaded(),
+        "chains": {model.value for model in ModelName} <= built_models(),
+        "warm_up": warm_up_done.is_set(),
+    }
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "starting", "checks": checks}
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    # Several workers need CHROMA_SERVER_HOST (shared vector store) and
+    # PROMETHEUS_MULTIPROC_DIR (metrics from every worker), see README
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        uvicorn.run("app2:app", host="127.0.0.1", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""Offline question sets: /chat one at a time, /chat concurrently, /chat/batch.
+
+Serves app2 with the local fakes (fake_app.py) under uvicorn, indexes a
+synthetic corpus and answers --questions distinct questions three ways:
+one /chat request at a time (what evaluation scripts do today), --concurrency
+concurrent /chat requests, and one /chat/batch request. Every phase asks new
+questions, so none is served from the answer cache. Then it measures
+interactive /chat latency alone and while a batch is running, to show what
+a batch costs other users.
+
+--embed-latency-ms models the round trip of one embedding API call, which
+the batch pays once for all its questions.
+
+    python benchmarks/bench_batch.py --questions 200 --llm-latency-ms 200
+    python benchmarks/bench_batch.py --batch-concurrency 8 --embed-latency-ms 80
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [REPO_ROOT, BENCH_DIR]
+
+from bench_suite import _free_port, percentiles  # noqa: E402
+from bench_workers import _wait_until_up, _stop  # noqa: E402
+
+
+def _questions(phase, count):
+    return [f"{phase}: what does the runbook say about the retry budget in case {index}?"
+            for index in range(count)]
+
+
+async def _upload_corpus(client, pages):
+    from synthetic_docs import write_pdf
+    path = os.path.abspath("batch_corpus.pdf")
+    write_pdf(path, pages)
+    with open(path, "rb") as f:
+        response = await client.post("/upload-document", files={"file": ("batch_corpus.pdf", f, "application/pdf")})
+    job_id = response.json()["job_id"]
+    while job_id and (await client.get(f"/jobs/{job_id}")).json()["status"] not in ("completed", "failed"):
+        await asyncio.sleep(0.2)
+
+
+async def _chat_all(client, questions, concurrency):
+    pending = list(questions)
+    samples, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while pending:
+            question = pending.pop()
+            start = time.perf_counter()
+            response = await client.post("/chat", json={"question": question})
+            if response.status_code == 200:
+                samples.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "questions_per_second": len(samples) / elapsed, "errors": errors}
+
+
+async def _batch(client, questions):
+    start = time.perf_counter()
+    statuses, first_line = {}, None
+    async with client.stream("POST", "/chat/batch", json={"items": [{"question": q} for q in questions]}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            if first_line is None:
+                first_line = time.perf_counter() - start
+            status = json.loads(line)["status"]
+            statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "questions_per_second": statuses.get("ok", 0) / elapsed,
+            "first_result_seconds": first_line, "statuses": statuses}
+
+
+async def _interactive(client, questions):
+    samples = []
+    for question in questions:
+        start = time.perf_counter()
+        (await client.post("/chat", json={"question": question})).raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+
+async def run(base_url, args):
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        await _upload_corpus(client, args.corpus_pages)
+        results = {
+            "chat_sequential": await _chat_all(client, _questions("sequential", args.questions), 1),
+            "chat_concurrent": await _chat_all(client, _questions("concurrent", args.questions),
+                                               args.concurrency),
+            "batch": await _batch(client, _questions("batch", args.questions)),
+            "interactive_idle": await _interactive(client, _questions("idle", args.interactive_requests)),
+        }
+        batch = asyncio.ensure_future(_batch(client, _questions("background", args.questions)))
+        await asyncio.sleep(0.5)
+        results["interactive_during_batch"] = await _interactive(
+            client, _questions("busy", args.interactive_requests))
+        await batch
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent /chat requests")
+    parser.add_argument("--batch-concurrency", type=int, default=4, help="server BATCH_MAX_CONCURRENCY")
+    parser.add_argument("--interactive-requests", type=int, default=20)
+    parser.add_argument("--corpus-pages", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_batch_")
+    # The repo pins its interpreter with .python-version
+    if os.path.exists(os.path.join(REPO_ROOT, ".python-version")):
+        shutil.copy(os.path.join(REPO_ROOT, ".python-version"), workdir)
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    port = _free_port()
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([REPO_ROOT, BENCH_DIR]),
+           "BENCH_LLM_LATENCY_MS": str(args.llm_latency_ms),
+           "BENCH_EMBED_LATENCY_MS": str(args.embed_latency_ms),
+           "BATCH_MAX_CONCURRENCY": str(args.batch_concurrency)}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "fake_app:app", "--port", str(port),
+                               "--log-level", "warning"],
+                              env=env, stdout=subprocess.DEVNULL, stderr=open("uvicorn.log", "w"))
+    try:
+        _wait_until_up(f"http://127.0.0.1:{port}/health", server, "uvicorn")
+        results = asyncio.run(run(f"http://127.0.0.1:{port}", args))
+    finally:
+        _stop(server)
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"config": vars(args), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
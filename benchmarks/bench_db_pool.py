@@ -0,0 +1,102 @@
+"""Microbenchmark: per-call sqlite3 connect vs the pooled WAL connections in db_utils.
+
+Runs a mixed read/write chat workload (one log insert followed by a history
+read per "turn") from several threads against a throwaway database.
+
+    python benchmarks/bench_db_pool.py --threads 8 --turns 500
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# db_utils creates its tables on first use, keep that out of the working tree
+os.chdir(tempfile.mkdtemp(prefix="bench_db_"))
+import db_utils
+
+
+def per_call_insert(db_name, session_id, user_query, gpt_response, model):
+    # Mirrors the original db_utils: fresh connection, rollback journal
+    conn = sqlite3.connect(db_name)
+    conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
+                 (session_id, user_query, gpt_response, model))
+    conn.commit()
+    conn.close()
+
+
+def per_call_history(db_name, session_id):
+    conn = sqlite3.connect(db_name)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at',
+                        (session_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+def run(workload, threads, turns):
+    errors = []
+
+    def worker(idx):
+        session_id = f"bench-{idx}"
+        try:
+            for turn in range(turns):
+                workload(session_id, turn)
+        except Exception as e:
+            errors.append(e)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=300)
+    args = parser.parse_args()
+    ops = args.threads * args.turns * 2
+
+    # Baseline: default rollback journal, new connection for every call
+    baseline_db = os.path.abspath("per_call.db")
+    conn = sqlite3.connect(baseline_db)
+    conn.execute("""CREATE TABLE application_logs
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     session_id TEXT,
+                     user_query TEXT,
+                     gpt_response TEXT,
+                     model TEXT,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    conn.close()
+
+    def per_call_turn(session_id, turn):
+        per_call_insert(baseline_db, session_id, f"question {turn}", "answer " * 50, "bench")
+        per_call_history(baseline_db, session_id)
+
+    elapsed, errors = run(per_call_turn, args.threads, args.turns)
+    print(f"per-call connect : {elapsed:.3f}s  {ops / elapsed:,.0f} ops/s  errors={len(errors)}")
+
+    # Pooled: thread-local WAL connections from db_utils
+    db_utils.DB_NAME = os.path.abspath("pooled.db")
+    db_utils.create_application_logs()
+
+    def pooled_turn(session_id, turn):
+        db_utils.insert_application_logs(session_id, f"question {turn}", "answer " * 50, "bench")
+        db_utils.get_chat_history(session_id)
+
+    elapsed, errors = run(pooled_turn, args.threads, args.turns)
+    print(f"pooled WAL       : {elapsed:.3f}s  {ops / elapsed:,.0f} ops/s  errors={len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Peak RSS of eager vs streaming document loading on a synthetic large PDF.
+
+Each mode runs in a fresh interpreter so their peaks do not mix. Chunks are
+consumed in batches and dropped, standing in for the embedding/indexing
+stage downstream.
+
+    python benchmarks/bench_ingest_memory.py --pages 500
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode, pdf_path, batch_size):
+    from document_utils import _get_loader, iter_split_batches, text_splitter
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    chunks = 0
+    if mode == "eager":
+        # The pre-streaming implementation: load every page, then split them all
+        documents = _get_loader(pdf_path).load()
+        splits = text_splitter.split_documents(documents)
+        for i in range(0, len(splits), batch_size):
+            chunks += len(splits[i:i + batch_size])
+    else:
+        for batch in iter_split_batches(pdf_path, batch_size):
+            chunks += len(batch)
+    return {"mode": mode, "chunks": chunks, "seconds": round(time.perf_counter() - start, 3),
+            "baseline_rss_mb": round(baseline, 1), "peak_rss_mb": round(peak_rss_mb(), 1),
+            "growth_mb": round(peak_rss_mb() - baseline, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--mode", choices=["eager", "streaming"])
+    parser.add_argument("--pdf")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.pdf, args.batch_size)))
+        return
+
+    from synthetic_docs import write_pdf
+    pdf_path = os.path.join(tempfile.mkdtemp(prefix="bench_ingest_"), "large.pdf")
+    write_pdf(pdf_path, args.pages)
+    print(f"synthetic PDF: {args.pages} pages, {os.path.getsize(pdf_path) / 1e6:.1f} MB")
+    for mode in ("eager", "streaming"):
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--pdf", pdf_path,
+                                 "--batch-size", str(args.batch_size)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:9s}: {result['chunks']} chunks in {result['seconds']}s, "
+              f"peak RSS {result['peak_rss_mb']} MB (+{result['growth_mb']} MB over imports)")
+
+
+if __name__ == "__main__":
+    main()
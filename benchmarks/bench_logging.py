@@ -0,0 +1,150 @@
+"""Per-request logging overhead: basicConfig file logging vs the queued pipeline.
+
+Each request logs what /chat logs for one turn: the question and a
+multi-paragraph answer. ``before`` is the previous setup, a FileHandler
+installed by logging.basicConfig writing f-string messages from the request
+thread; ``after`` is logging_utils.configure_logging with structured
+fields. Each mode runs in its own interpreter and scratch directory, with
+--threads request threads logging concurrently, and reports the time the
+request threads spend in logging calls and how many records reached the
+file (the queue drops records rather than block when it is full).
+
+A local disk absorbs writes in the page cache, so the synchronous handler
+is cheap here; --write-delay-ms adds a delay to every handler flush to model
+slower storage (a network or bind-mounted volume), in both modes alike.
+
+    python benchmarks/bench_logging.py --requests 20000 --threads 8
+    python benchmarks/bench_logging.py --write-delay-ms 0.5
+    python benchmarks/bench_logging.py --interval-ms 0      # unpaced burst: shows queue drops
+    python benchmarks/bench_logging.py --answer-chars 8000 --sample-rate 0.1
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+QUESTION = "What does the runbook say about the retry budget when the upstream times out?"
+PARAGRAPH = ("The retry budget caps retries at ten percent of requests over a rolling minute; "
+             "once it is spent, callers fail fast and the circuit breaker opens for thirty seconds. ")
+
+
+def log_turn_before(logging, session_id, model, answer):
+    logging.info(f"Session ID: {session_id}, User Query: {QUESTION}, Model: {model}")
+    logging.info(f"Session ID: {session_id}, AI Response: {answer}")
+
+
+def log_turn_after(chat_logger, session_id, model, answer):
+    chat_logger.info("Chat request", extra={"fields": {"session_id": session_id, "model": model,
+                                                       "question": QUESTION}})
+    chat_logger.info("Chat response", extra={"fields": {"session_id": session_id, "answer": answer}})
+
+
+def run_mode(args):
+    import logging
+    if args.write_delay_ms:
+        flush = logging.StreamHandler.flush
+
+        def slow_flush(handler):
+            time.sleep(args.write_delay_ms / 1000)
+            flush(handler)
+        logging.StreamHandler.flush = slow_flush
+    if args.mode == "before":
+        logging.basicConfig(filename="application.log", level=logging.INFO)
+        log_turn = lambda *turn: log_turn_before(logging, *turn)  # noqa: E731
+        stop = logging.shutdown
+    else:
+        os.environ["LOG_PAYLOAD_SAMPLE_RATE"] = str(args.sample_rate)
+        os.environ["LOG_FIELD_MAX_CHARS"] = str(args.max_chars)
+        sys.path.insert(0, REPO_ROOT)
+        from logging_utils import configure_logging, stop_logging, chat_logger
+        configure_logging()
+        log_turn = lambda *turn: log_turn_after(chat_logger, *turn)  # noqa: E731
+        stop = stop_logging
+
+    answer = (PARAGRAPH * (args.answer_chars // len(PARAGRAPH) + 1))[:args.answer_chars]
+    per_thread = args.requests // args.threads
+    samples = [[] for _ in range(args.threads)]
+
+    def worker(index):
+        for request in range(per_thread):
+            start = time.perf_counter()
+            log_turn(f"session-{index}-{request % 50}", "llama-3.1-8b-instant", answer)
+            samples[index].append((time.perf_counter() - start) * 1e6)
+            if args.interval_ms:
+                time.sleep(args.interval_ms / 1000)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop_start = time.perf_counter()
+    stop()
+    flush_seconds = time.perf_counter() - stop_start
+
+    latencies = sorted(sample for thread_samples in samples for sample in thread_samples)
+    log_bytes = records = 0
+    for name in os.listdir("."):
+        if name.startswith("application.log"):
+            log_bytes += os.path.getsize(name)
+            with open(name, "rb") as f:
+                records += sum(1 for _ in f)
+    return {"requests": len(latencies), "seconds": elapsed, "flush_seconds": flush_seconds,
+            "records_logged": 2 * len(latencies), "records_written": records,
+            "mean_us": statistics.fmean(latencies),
+            "p50_us": latencies[len(latencies) // 2],
+            "p99_us": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+            "log_bytes": log_bytes}
+
+
+def run_isolated(mode, args):
+    workdir = tempfile.mkdtemp(prefix=f"bench_logging_{mode}_")
+    # The repo pins its interpreter with .python-version
+    if os.path.exists(os.path.join(REPO_ROOT, ".python-version")):
+        shutil.copy(os.path.join(REPO_ROOT, ".python-version"), workdir)
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode,
+                               f"--requests={args.requests}", f"--threads={args.threads}",
+                               f"--answer-chars={args.answer_chars}", f"--sample-rate={args.sample_rate}",
+                               f"--max-chars={args.max_chars}", f"--write-delay-ms={args.write_delay_ms}",
+                               f"--interval-ms={args.interval_ms}"],
+                              cwd=workdir, capture_output=True, text=True, check=True)
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--answer-chars", type=int, default=3000)
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    parser.add_argument("--max-chars", type=int, default=1000)
+    parser.add_argument("--write-delay-ms", type=float, default=0)
+    parser.add_argument("--interval-ms", type=float, default=5,
+                        help="pause between requests of one thread")
+    parser.add_argument("--mode", choices=("before", "after"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args)))
+        return
+    results = {mode: run_isolated(mode, args) for mode in ("before", "after")}
+    print(json.dumps({"config": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
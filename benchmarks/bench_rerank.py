@@ -0,0 +1,141 @@
+"""Recall@k and added latency of reranking over-fetched vector search results.
+
+Builds a synthetic corpus where every query has exactly one relevant chunk
+among distractors that share some of its terms, indexes it in an in-memory
+Chroma collection and compares plain top-k vector search with over-fetching
+k * overfetch candidates and reranking them down to k.
+
+No embedding API is called: vectors are hashed bag-of-words with gaussian
+noise, a stand-in for an imperfect dense model (raise --noise to make
+vector search worse).
+
+    python benchmarks/bench_rerank.py --queries 200 --k 4 --overfetch 4
+    python benchmarks/bench_rerank.py --scorer cross-encoder   # needs sentence-transformers
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from rerank_utils import get_scorer, rerank
+
+
+class NoisyHashEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors plus per-text gaussian noise."""
+
+    def __init__(self, dim=256, noise=0.15):
+        self.dim = dim
+        self.noise = noise
+
+    def _embed(self, text):
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).normal(0, self.noise, self.dim)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % self.dim] += 1.0
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def build_corpus(queries, distractors, seed):
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(queries * 6)]
+    filler = [f"word{i}" for i in range(400)]
+    documents, questions = [], []
+    for q in range(queries):
+        keys = vocabulary[q * 6:(q + 1) * 6]
+        relevant = f"rel-{q}"
+        text = " ".join(rng.sample(filler, 12) + keys[:4])
+        documents.append(Document(id=relevant, page_content=text, metadata={"query": q}))
+        # Distractors share one or two key terms but are not about the question
+        for d in range(distractors):
+            shared = rng.sample(keys, rng.choice((1, 2)))
+            text = " ".join(rng.sample(filler, 12) + shared)
+            documents.append(Document(id=f"dis-{q}-{d}", page_content=text, metadata={"query": q}))
+        questions.append((f"how do {' '.join(keys[:4])} work together", relevant))
+    return documents, questions
+
+
+def recall_at_k(results, questions):
+    return sum(1 for docs, (_, relevant) in zip(results, questions)
+               if relevant in {doc.id for doc in docs}) / len(questions)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--distractors", type=int, default=8)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--overfetch", type=int, default=4)
+    parser.add_argument("--noise", type=float, default=0.15)
+    parser.add_argument("--scorer", default="lexical")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    documents, questions = build_corpus(args.queries, args.distractors, args.seed)
+    store = Chroma(collection_name="bench_rerank",
+                   embedding_function=NoisyHashEmbeddings(noise=args.noise))
+    store.add_documents(documents)
+    scorer = get_scorer(args.scorer)
+
+    baseline, fetched_candidates, reranked = [], [], []
+    search_ms, overfetch_ms, rerank_ms = [], [], []
+    for question, _ in questions:
+        start = time.perf_counter()
+        baseline.append(store.similarity_search(question, k=args.k))
+        search_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        candidates = store.similarity_search(question, k=args.k * args.overfetch)
+        fetched = time.perf_counter()
+        fetched_candidates.append(candidates)
+        reranked.append(rerank(question, candidates, args.k, scorer))
+        overfetch_ms.append((fetched - start) * 1000)
+        rerank_ms.append((time.perf_counter() - fetched) * 1000)
+
+    added = [o + r - s for s, o, r in zip(search_ms, overfetch_ms, rerank_ms)]
+    report = {
+        "corpus_chunks": len(documents),
+        "queries": len(questions),
+        "k": args.k,
+        "overfetch": args.overfetch,
+        "scorer": scorer.name,
+        "recall_at_k": {"vector": recall_at_k(baseline, questions),
+                        "vector_reranked": recall_at_k(reranked, questions)},
+        # Upper bound for reranking: the relevant chunk must be among the candidates
+        "candidate_recall": recall_at_k(fetched_candidates, questions),
+        "latency_ms": {
+            "vector_search_p50": statistics.median(search_ms),
+            "rerank_p50": statistics.median(rerank_ms),
+            "rerank_p95": percentile(rerank_ms, 95),
+            "added_p50": statistics.median(added),
+            "added_p95": percentile(added, 95),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Cold start: import cost of the modules and time until uvicorn serves.
+
+Each measurement runs in a fresh interpreter in a scratch directory.
+``imports`` times ``import <module>`` for db_utils, chroma_utils,
+langchain_utils and app2 (each in its own interpreter, so each includes
+what it pulls in). ``serve`` starts app2 with the local fakes (fake_app.py)
+under uvicorn and reports when /health (liveness) and /ready (vector store
+open, chains built) first answer 200, with STARTUP_WARMUP on and off; with
+warm-up on the server only binds once warm-up is done, so /health and
+/ready arrive together.
+
+    python benchmarks/bench_startup.py --repeat 5
+    python benchmarks/bench_startup.py --chunks 20000     # bigger persisted store
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [REPO_ROOT, BENCH_DIR]
+
+from bench_suite import _free_port  # noqa: E402
+
+MODULES = ("db_utils", "chroma_utils", "langchain_utils", "app2")
+IMPORT_SNIPPET = ("import time; start = time.perf_counter(); import {module}; "
+                  "print(time.perf_counter() - start)")
+SEED_SNIPPET = """
+import numpy as np
+from fake_services import install_fakes, EMBEDDING_SIZE
+install_fakes()
+from chroma_utils import _write_batch
+from synthetic_docs import paragraphs
+from langchain_core.documents import Document
+
+texts = paragraphs({chunks}, seed=7)
+rng = np.random.default_rng(7)
+for start in range(0, len(texts), 500):
+    batch = [Document(id=f"seed-{{index}}", page_content=text, metadata={{"file_id": 1, "source": "bench"}})
+             for index, text in enumerate(texts[start:start + 500], start)]
+    vectors = rng.normal(size=(len(batch), EMBEDDING_SIZE)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    _write_batch(batch, vectors.tolist())
+"""
+
+
+def _env(**extra):
+    return {**os.environ, "PYTHONPATH": os.pathsep.join([REPO_ROOT, BENCH_DIR]),
+            "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "bench"),
+            "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "bench"), **extra}
+
+
+def time_import(module):
+    proc = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+                          env=_env(), capture_output=True, text=True, check=True)
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def time_serve(warmup, args):
+    port = _free_port()
+    env = _env(BENCH_LLM_LATENCY_MS="0", STARTUP_WARMUP=str(warmup).lower())
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "fake_app:app", "--port", str(port),
+                               "--log-level", "warning"],
+                              env=env, stdout=subprocess.DEVNULL, stderr=open("uvicorn.log", "w"))
+    seen = {}
+    try:
+        deadline = time.monotonic() + 120
+        while len(seen) < 2:
+            for path in ("/health", "/ready"):
+                if path in seen:
+                    continue
+                try:
+                    if httpx.get(f"http://127.0.0.1:{port}{path}", timeout=1).status_code == 200:
+                        seen[path] = time.perf_counter() - start
+                except httpx.TransportError:
+                    pass
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("uvicorn did not become ready, see uvicorn.log")
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return seen
+
+
+def _summary(samples):
+    return {"median": statistics.median(samples), "min": min(samples), "max": max(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chunks", type=int, default=2000,
+                        help="chunks in the persisted vector store the server opens")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    # The repo pins its interpreter with .python-version
+    if os.path.exists(os.path.join(REPO_ROOT, ".python-version")):
+        shutil.copy(os.path.join(REPO_ROOT, ".python-version"), workdir)
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        print(f"seeding {args.chunks} chunks ...", file=sys.stderr)
+        subprocess.run([sys.executable, "-c", SEED_SNIPPET.format(chunks=args.chunks)],
+                       env=_env(), check=True, stdout=subprocess.DEVNULL)
+        imports = {module: _summary([time_import(module) for _ in range(args.repeat)])
+                   for module in MODULES}
+        serve = {}
+        for warmup in (True, False):
+            runs = [time_serve(warmup, args) for _ in range(args.repeat)]
+            serve[f"warmup_{str(warmup).lower()}"] = {
+                f"{path}_seconds": _summary([run[path] for run in runs]) for path in ("/health", "/ready")}
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"config": vars(args), "import_seconds": imports, "serve": serve}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""Offline benchmark suite: ingestion, retrieval, /chat latency and log writes.
+
+Every scenario runs the application's own code with local stand-ins for the
+Google embedding API and Groq (see fake_services.py), in a fresh interpreter
+and a scratch directory, and the results are written as one JSON document
+tagged with the current commit so runs can be diffed between commits.
+
+    python benchmarks/bench_suite.py --output bench.json
+    python benchmarks/bench_suite.py --scenarios retrieval --corpus-sizes 1000,10000,100000,1000000
+    python benchmarks/bench_suite.py --scenarios chat --concurrency 32 --baseline bench.json
+
+Scenarios:
+  ingest     parse + index throughput for PDF, DOCX and HTML
+  retrieval  vector / lexical / hybrid latency as the corpus grows
+  chat       /chat p50/p95/p99 under concurrent load against uvicorn + app2
+  logs       SQLite chat log write throughput (single, batched, write-behind)
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+SCENARIOS = ("ingest", "retrieval", "chat", "logs")
+
+
+def percentiles(samples_ms):
+    samples = sorted(samples_ms)
+    if not samples:
+        return {}
+
+    def pct(p):
+        return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+    return {"count": len(samples), "mean_ms": statistics.fmean(samples),
+            "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99), "max_ms": samples[-1]}
+
+
+# ─────────────────────────────
+# Scenarios (each runs in its own interpreter)
+# ─────────────────────────────
+def scenario_ingest(args):
+    from fake_services import install_fakes
+    install_fakes()
+    from synthetic_docs import write_pdf, write_docx, write_html
+    from document_utils import iter_document_splits
+    from chroma_utils import index_splits_to_chroma
+
+    writers = {
+        "pdf": lambda path: write_pdf(path, args.ingest_pages),
+        "docx": lambda path: write_docx(path, args.ingest_paragraphs),
+        "html": lambda path: write_html(path, args.ingest_paragraphs),
+    }
+    results = {}
+    for file_id, (fmt, write) in enumerate(writers.items(), start=1):
+        path = os.path.abspath(f"bench.{fmt}")
+        write(path)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        try:
+            start = time.perf_counter()
+            parsed = sum(1 for _ in iter_document_splits(path))
+            parse_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            chunks = index_splits_to_chroma(iter_document_splits(path), file_id)
+            index_seconds = time.perf_counter() - start
+        except Exception as e:
+            # e.g. the HTML loader needs the optional `unstructured` package
+            results[fmt] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        results[fmt] = {"size_mb": size_mb, "chunks": chunks, "parsed_chunks": parsed,
+                        "parse_seconds": parse_seconds, "index_seconds": index_seconds,
+                        "chunks_per_second": chunks / index_seconds if index_seconds else None,
+                        "mb_per_second": size_mb / index_seconds if index_seconds else None}
+    return results
+
+
+def scenario_retrieval(args):
+    import numpy as np
+    from fake_services import install_fakes, EMBEDDING_SIZE
+    lu = install_fakes()
+    from langchain_core.documents import Document
+    from chroma_utils import _write_batch, get_vector_store
+    from synthetic_docs import paragraphs
+    from retrieval_utils import RetrievalMode
+
+    rng = np.random.default_rng(args.seed)
+    texts = paragraphs(2000, seed=args.seed)
+    questions = [" ".join(random.Random(i).sample(text.split(), 8)) for i, text in enumerate(texts[:args.queries])]
+    results = {}
+    stored = 0
+    for target in args.corpus_sizes:
+        # Grow the corpus through the same write path indexing uses, with
+        # random unit vectors in place of document embeddings
+        start = time.perf_counter()
+        while stored < target:
+            count = min(args.insert_batch, target - stored)
+            batch = [Document(id=f"bench-{stored + i}", page_content=texts[(stored + i) % len(texts)],
+                              metadata={"file_id": 1 + (stored + i) // 10000, "source": "bench"})
+                     for i in range(count)]
+            vectors = rng.normal(size=(count, EMBEDDING_SIZE)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            _write_batch(batch, vectors.tolist())
+            stored += count
+        insert_seconds = time.perf_counter() - start
+
+        size_results = {"chunks": get_vector_store()._collection.count(), "insert_seconds": insert_seconds}
+        for mode in RetrievalMode:
+            retriever = lu.retrievers[mode]
+            retriever.invoke(questions[0])  # warm caches and indexes
+            samples = []
+            for question in questions:
+                start = time.perf_counter()
+                retriever.invoke(question)
+                samples.append((time.perf_counter() - start) * 1000)
+            size_results[mode.value] = percentiles(samples)
+        results[str(target)] = size_results
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _chat_load(base_url, args):
+    import httpx
+    from synthetic_docs import write_pdf
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        path = os.path.abspath("chat_corpus.pdf")
+        write_pdf(path, args.chat_corpus_pages)
+        with open(path, "rb") as f:
+            response = await client.post("/upload-document", files={"file": ("chat_corpus.pdf", f, "application/pdf")})
+        # No job when the corpus is already indexed (a reused database)
+        job_id = response.json()["job_id"]
+        while job_id and (await client.get(f"/jobs/{job_id}")).json()["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.2)
+
+        pending = list(range(args.chat_requests))
+        samples, errors = [], []
+
+        async def user(worker):
+            # Each simulated user keeps one session, so later turns carry history
+            session_id = None
+            while pending:
+                index = pending.pop()
+                payload = {"question": f"What does the runbook say about retry budget case {index}?"}
+                if session_id:
+                    payload["session_id"] = session_id
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/chat", json=payload)
+                    response.raise_for_status()
+                    session_id = response.json()["session_id"]
+                    samples.append((time.perf_counter() - start) * 1000)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(worker) for worker in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"requests": args.chat_requests, "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms, "seconds": elapsed,
+            "requests_per_second": len(samples) / elapsed, "errors": len(errors),
+            "first_errors": errors[:3], "latency": percentiles(samples)}
+
+
+def scenario_chat(args):
+    port = _free_port()
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([REPO_ROOT, BENCH_DIR]),
+           "BENCH_LLM_LATENCY_MS": str(args.llm_latency_ms)}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "fake_app:app", "--port", str(port),
+                               "--log-level", "warning"],
+                              env=env, stdout=subprocess.DEVNULL, stderr=open("uvicorn.log", "w"))
+    try:
+        import httpx
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).raise_for_status()
+                break
+            except Exception:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not start, see uvicorn.log")
+                time.sleep(0.5)
+        return asyncio.run(_chat_load(f"http://127.0.0.1:{port}", args))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def scenario_logs(args):
+    import db_utils
+    from log_writer import ApplicationLogWriter
+
+    rows = [(f"session-{i % 50}", f"question {i}", "answer " * 60, "bench") for i in range(args.log_rows)]
+    results = {}
+
+    start = time.perf_counter()
+    for row in rows:
+        db_utils.insert_application_logs(*row)
+    results["single_insert_rows_per_second"] = len(rows) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(rows), 100):
+        db_utils.insert_application_logs_batch(rows[i:i + 100])
+    results["batch_100_rows_per_second"] = len(rows) / (time.perf_counter() - start)
+
+    writer = ApplicationLogWriter()
+    writer.start()
+    start = time.perf_counter()
+    submitted = sum(1 for row in rows if writer.submit(*row))
+    submit_seconds = time.perf_counter() - start
+    writer.stop()
+    total_seconds = time.perf_counter() - start
+    results["write_behind"] = {"submitted": submitted,
+                               "submit_rows_per_second": submitted / submit_seconds,
+                               "flushed_rows_per_second": submitted / total_seconds}
+    return results
+
+
+SCENARIO_FUNCTIONS = {"ingest": scenario_ingest, "retrieval": scenario_retrieval,
+                      "chat": scenario_chat, "logs": scenario_logs}
+
+
+# ─────────────────────────────
+# Driver
+# ─────────────────────────────
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_scenario_isolated(name, argv):
+    """Run one scenario in a new interpreter inside its own scratch directory."""
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    # The repo pins its interpreter with .python-version
+    if os.path.exists(os.path.join(REPO_ROOT, ".python-version")):
+        shutil.copy(os.path.join(REPO_ROOT, ".python-version"), workdir)
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scenario", name, *argv],
+                              cwd=workdir, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(baseline_path, results, threshold):
+    """Print metrics that moved by more than threshold (a fraction) vs a baseline run."""
+    with open(baseline_path) as f:
+        baseline = dict(_flatten(json.load(f)["results"]))
+    print(f"Changes > {threshold:.0%} vs {baseline_path}:", file=sys.stderr)
+    for key, value in _flatten(results):
+        before = baseline.get(key)
+        if before and abs(value - before) / abs(before) > threshold:
+            print(f"  {key}: {before:.4g} -> {value:.4g} ({(value - before) / before:+.1%})", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--ingest-pages", type=int, default=200)
+    parser.add_argument("--ingest-paragraphs", type=int, default=2000)
+    parser.add_argument("--corpus-sizes", default="1000,10000,100000")
+    parser.add_argument("--insert-batch", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--chat-requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--chat-corpus-pages", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--log-rows", type=int, default=5000)
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # Options handed on to scenario processes unchanged
+    scenario_argv = [f"--{key.replace('_', '-')}={value}" for key, value in vars(args).items()
+                     if key not in ("scenarios", "output", "baseline", "threshold", "run_scenario")]
+    args.corpus_sizes = sorted(int(size) for size in args.corpus_sizes.split(","))
+
+    if args.run_scenario:
+        sys.path[:0] = [REPO_ROOT, BENCH_DIR]
+        print(json.dumps(SCENARIO_FUNCTIONS[args.run_scenario](args)))
+        return
+
+    results = {}
+    for name in args.scenarios.split(","):
+        print(f"running {name} ...", file=sys.stderr)
+        started = time.perf_counter()
+        results[name] = run_scenario_isolated(name, scenario_argv)
+        print(f"  done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {"commit": _commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "python": platform.python_version(), "platform": platform.platform(),
+              "config": {key: value for key, value in vars(args).items()
+                         if key not in ("output", "baseline", "run_scenario")},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        compare(args.baseline, results, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""/chat throughput with 1, 2, 4, ... uvicorn workers sharing a Chroma server.
+
+Starts a local Chroma server (``chroma run``), then for each worker count
+serves app2 with the local fakes (fake_app.py) under ``uvicorn --workers N``
+with CHROMA_SERVER_HOST pointing at it, and drives /chat with the same
+concurrent load as the chat scenario of bench_suite.py. All runs share one
+scratch directory, so the SQLite database and the Chroma collection carry
+over and later runs skip the corpus upload as a duplicate.
+
+    python benchmarks/bench_workers.py --workers 1,2,4 --concurrency 32
+
+Throughput can only grow with workers while there are idle cores; the
+report includes the CPU count. A low --llm-latency-ms makes the run CPU
+bound, which is where extra workers help.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [REPO_ROOT, BENCH_DIR]
+
+from bench_suite import _chat_load, _free_port  # noqa: E402
+
+
+def _wait_until_up(url, process, name, deadline_seconds=120):
+    deadline = time.monotonic() + deadline_seconds
+    while True:
+        try:
+            httpx.get(url, timeout=1).raise_for_status()
+            return
+        except Exception:
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"{name} did not start, see {name}.log")
+            time.sleep(0.5)
+
+
+def _stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_workers(workers, chroma_port, args):
+    port = _free_port()
+    metrics_dir = os.path.abspath("prometheus")
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([REPO_ROOT, BENCH_DIR]),
+           "BENCH_LLM_LATENCY_MS": str(args.llm_latency_ms),
+           "CHROMA_SERVER_HOST": "127.0.0.1", "CHROMA_SERVER_PORT": str(chroma_port),
+           "PROMETHEUS_MULTIPROC_DIR": metrics_dir, "WEB_CONCURRENCY": str(workers)}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "fake_app:app", "--port", str(port),
+                               "--workers", str(workers), "--log-level", "warning"],
+                              env=env, stdout=subprocess.DEVNULL, stderr=open("uvicorn.log", "w"))
+    try:
+        _wait_until_up(f"http://127.0.0.1:{port}/health", server, "uvicorn")
+        return asyncio.run(_chat_load(f"http://127.0.0.1:{port}", args))
+    finally:
+        _stop(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--chat-requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--chat-corpus-pages", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=20)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_workers_")
+    # The repo pins its interpreter with .python-version
+    if os.path.exists(os.path.join(REPO_ROOT, ".python-version")):
+        shutil.copy(os.path.join(REPO_ROOT, ".python-version"), workdir)
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    chroma_port = _free_port()
+    chroma = subprocess.Popen([shutil.which("chroma") or "chroma", "run", "--path", "chroma_server",
+                               "--port", str(chroma_port)],
+                              stdout=subprocess.DEVNULL, stderr=open("chroma.log", "w"))
+    results = {}
+    try:
+        _wait_until_up(f"http://127.0.0.1:{chroma_port}/api/v2/heartbeat", chroma, "chroma")
+        for workers in (int(count) for count in args.workers.split(",")):
+            print(f"running with {workers} worker(s) ...", file=sys.stderr)
+            results[str(workers)] = run_workers(workers, chroma_port, args)
+            print(f"  {results[str(workers)]['requests_per_second']:.1f} req/s", file=sys.stderr)
+    finally:
+        _stop(chroma)
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"cpu_count": os.cpu_count(), "config": vars(args), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""app2.app wired to the local fakes, for serving under uvicorn in benchmarks.
+
+    cd <scratch dir> && PYTHONPATH=<repo>:<repo>/benchmarks uvicorn fake_app:app
+"""
+from fake_services import install_fakes
+
+install_fakes()
+
+from app2 import app  # noqa: E402
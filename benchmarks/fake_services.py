@@ -0,0 +1,90 @@
+"""Local stand-ins for the Google embedding API and Groq, for benchmarks.
+
+install_fakes() must run before chroma_utils / app2 are imported: it
+replaces GoogleGenerativeAIEmbeddings with deterministic hash-seeded
+vectors and points langchain_utils at a fake chat model with a fixed,
+configurable latency.
+"""
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+EMBEDDING_SIZE = int(os.getenv("BENCH_EMBEDDING_SIZE", "768"))
+LLM_LATENCY_MS = float(os.getenv("BENCH_LLM_LATENCY_MS", "200"))
+# Round trip of one embedding API call, whatever the number of texts
+EMBED_LATENCY_MS = float(os.getenv("BENCH_EMBED_LATENCY_MS", "0"))
+LLM_ANSWER = ("The indexed documents describe the retry budget, the cache "
+              "eviction policy and the alert thresholds for the service.")
+
+
+class FakeGoogleEmbeddings(DeterministicFakeEmbedding):
+    """Accepts GoogleGenerativeAIEmbeddings' arguments and ignores them;
+    every call takes EMBED_LATENCY_MS."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(size=EMBEDDING_SIZE)
+
+    def embed_documents(self, texts: List[str], task_type: Optional[str] = None) -> List[List[float]]:
+        time.sleep(EMBED_LATENCY_MS / 1000)
+        return [self._get_embedding(seed=self._get_seed(text)) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(EMBED_LATENCY_MS / 1000)
+        return self._get_embedding(seed=self._get_seed(text))
+
+
+class FakeGroqChatModel(BaseChatModel):
+    """Answers every prompt with the same text after ``latency_ms``, spreading
+    the delay over the streamed tokens."""
+
+    latency_ms: float = LLM_LATENCY_MS
+    answer: str = LLM_ANSWER
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-groq"
+
+    def _tokens(self):
+        return [word + " " for word in self.answer.split()]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        tokens = self._tokens()
+        for token in tokens:
+            time.sleep(self.latency_ms / 1000 / len(tokens))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = self._tokens()
+        for token in tokens:
+            await asyncio.sleep(self.latency_ms / 1000 / len(tokens))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def install_fakes(llm_latency_ms=None):
+    """Patch the embedding and chat model factories; returns langchain_utils."""
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    import langchain_google_genai
+    langchain_google_genai.GoogleGenerativeAIEmbeddings = FakeGoogleEmbeddings
+
+    import langchain_utils
+    latency = LLM_LATENCY_MS if llm_latency_ms is None else llm_latency_ms
+    langchain_utils._build_llm = lambda model: FakeGroqChatModel(latency_ms=latency)
+    langchain_utils.invalidate_rag_chains()
+    return langchain_utils
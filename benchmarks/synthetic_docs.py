@@ -0,0 +1,75 @@
+"""Synthetic documents for benchmarks, written without extra dependencies."""
+import random
+import zipfile
+
+WORDS = ("latency throughput replica index shard token cache vector query "
+         "embedding chunk retriever prompt model cluster node service error "
+         "timeout retry budget deploy rollback incident alert metric trace").split()
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraphs(count, seed=0, sentences=5):
+    rng = random.Random(seed)
+    return [" ".join(sentence(rng) for _ in range(sentences)) for _ in range(count)]
+
+
+def write_pdf(path, pages, lines_per_page=60, seed=0):
+    """Write a text PDF with ``pages`` pages of ~80 character lines."""
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               None,  # page tree, filled in once page object numbers are known
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = [f"Page {page} line {i}: " + sentence(rng, 10) for i in range(lines_per_page)]
+        text = " ".join("(" + line.replace("(", "").replace(")", "") + ") Tj T*" for line in lines)
+        content = f"BT /F1 9 Tf 30 810 Td 12 TL {text} ET"
+        kids.append(len(objects) + 1)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects) + 2} 0 R >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {pages} >>"
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def write_docx(path, paragraph_count, seed=0):
+    """Write a minimal .docx that docx2txt can read."""
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs(paragraph_count, seed))
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>')
+    content_types = ('<?xml version="1.0" encoding="UTF-8"?>'
+                     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                     '<Default Extension="xml" ContentType="application/xml"/>'
+                     '<Override PartName="/word/document.xml" '
+                     'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                     '</Types>')
+    rels = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", content_types)
+        archive.writestr("_rels/.rels", rels)
+        archive.writestr("word/document.xml", document)
+
+
+def write_html(path, paragraph_count, seed=0):
+    body = "".join(f"<p>{text}</p>" for text in paragraphs(paragraph_count, seed))
+    with open(path, "w") as f:
+        f.write(f"<html><head><title>Synthetic</title></head><body>{body}</body></html>")
@@ -1,56 +1,414 @@
-from langchain_chroma import Chroma
+# Vector store access and document indexing.
+# The embedding client and the Chroma store are created on first use
+# (get_embedding_model / get_vector_store), not on import, so importing this
+# module stays cheap for tools, tests and the ingestion parser processes.
+
 import os
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from typing import List
+import logging
+import threading
+from typing import Iterable, List
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from prometheus_client import Counter, Histogram
+import hashlib
+import json
+import random
+import time
 from langchain_core.documents import Document
 from dotenv import load_dotenv
+from embedding_cache import CachedEmbeddings
+from tracing_utils import traced
+from singleflight import SingleFlight
+from document_utils import load_and_split_document, iter_document_splits, text_splitter
+from db_utils import (upsert_lexical_chunks, delete_lexical_chunks, count_lexical_chunks,
+                      read_corpus_version, increment_corpus_version, delete_documents)
 
 # load_dotenv()
 
 GOOGLE_API_KEY= os.getenv("GOOGLE_API_KEY")
-print(GOOGLE_API_KEY)
 
-# Initialize text splitter with specific chunk size and overlap
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, 
-                                               chunk_overlap=200, length_function=len)
+# Indexing pipeline: chunks per embedding call, embedding calls in flight,
+# and retry policy for failed calls
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+INDEX_CONCURRENCY = int(os.getenv("INDEX_CONCURRENCY", "4"))
+INDEX_MAX_RETRIES = int(os.getenv("INDEX_MAX_RETRIES", "5"))
+INDEX_RETRY_BACKOFF = float(os.getenv("INDEX_RETRY_BACKOFF", "1.0"))
 
-# Initialize embedding model
-embedding_model = GoogleGenerativeAIEmbeddings(model='models/text-embedding-004',
-                                               google_api_key= GOOGLE_API_KEY
-                                               )
+INDEX_CHUNKS = Counter("index_chunks_total", "Chunks embedded and written to the vector store")
+INDEX_THROUGHPUT = Histogram("index_throughput_chunks_per_second",
+                             "Indexing throughput per document in chunks/sec",
+                             buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+INDEX_EMBED_RETRIES = Counter("index_embed_retries_total", "Retried embedding batch calls")
+INDEX_CHUNKS_SKIPPED = Counter("index_chunks_skipped_total",
+                               "Chunks left in place because an identical chunk was already indexed")
+INDEX_CHUNKS_DELETED = Counter("index_chunks_deleted_total",
+                               "Outdated chunks removed when a document was re-indexed")
 
-# Initialize vector store with embedding model and persistence directory
-vectore_store = Chroma(persist_directory="./chroma_db", 
-                      embedding_function=embedding_model)
+# Metadata that places a chunk within its document and so is part of its hash
+CHUNK_HASH_METADATA_KEYS = ('page', 'page_label')
 
-# Function to load and split document based on file type
-def load_and_split_document(file_path: str) -> List[Document]:
-    # Determine the loader to use based on file extension
-    if file_path.endswith('.pdf'):
-        loader = PyPDFLoader(file_path)
-    elif file_path.endswith('.docx'):
-        loader = Docx2txtLoader(file_path)
-    elif file_path.endswith('.html'):
-        loader = UnstructuredHTMLLoader(file_path)
-    else:
-        raise ValueError(f"Unsupported file type: {file_path}")
-    documents: List[Document]= loader.load()
+# Ids per Chroma delete call, and file ids per delete-by-filter call
+CHROMA_DELETE_BATCH = 5000
+CHROMA_DELETE_FILES_BATCH = 500
 
-    return text_splitter.split_documents(documents)
+# Vector store location. Embedded (files under CHROMA_PERSIST_DIR) suits a
+# single process; with several API workers set CHROMA_SERVER_HOST so every
+# worker talks to one Chroma server instead of writing the same files.
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8000"))
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "langchain")
 
+EMBEDDING_MODEL_NAME = 'models/text-embedding-004'
 
+# Concurrent identical searches (same query text and parameters) share one
+# query embedding and one collection query
+vector_search_flight = SingleFlight("vector_search")
 
-def index_document_to_chroma(file_path:str, file_id:int) -> bool:
-    try:
-        splits= load_and_split_document(file_path)
+def _search_key(method, query, **params):
+    return (method, query, json.dumps(params, sort_keys=True, default=str))
+
+_embedding_model = None
+_vector_store = None
+# Reentrant: building the store builds the embedding model under the same lock
+_init_lock = threading.RLock()
+
+def get_embedding_model():
+    """Return the embedding model, creating it on first use.
+
+    It sits behind a local cache so re-indexed chunks and repeated queries
+    are not embedded twice.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _init_lock:
+            if _embedding_model is None:
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                _embedding_model = CachedEmbeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME,
+                                                                                 google_api_key=GOOGLE_API_KEY),
+                                                    namespace=EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
+def get_vector_store():
+    """Return the vector store, opening it on first use.
+
+    It lives on a Chroma server if one is configured and in the
+    persistence directory otherwise.
+    """
+    global _vector_store
+    if _vector_store is None:
+        with _init_lock:
+            if _vector_store is None:
+                _vector_store = _open_vector_store(get_embedding_model())
+    return _vector_store
+
+def vector_store_loaded() -> bool:
+    return _vector_store is not None
+
+def reset_vector_store():
+    """Forget the open store so the next get_vector_store() opens the
+    collection again, e.g. after a rebuild replaced it."""
+    global _vector_store
+    with _init_lock:
+        _vector_store = None
+
+def _open_vector_store(embeddings):
+    chroma_class = _coalescing_chroma_class()
+    if CHROMA_SERVER_HOST:
+        import chromadb
+        return chroma_class(client=chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT),
+                            collection_name=CHROMA_COLLECTION,
+                            embedding_function=embeddings)
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        logging.warning("Several workers share the embedded Chroma store in %s; "
+                        "set CHROMA_SERVER_HOST to use a Chroma server instead", CHROMA_PERSIST_DIR)
+    return chroma_class(persist_directory=CHROMA_PERSIST_DIR,
+                        collection_name=CHROMA_COLLECTION,
+                        embedding_function=embeddings)
+
+_chroma_class = None
+
+def _coalescing_chroma_class():
+    """Chroma subclass whose query-text searches are coalesced (see singleflight).
+
+    Defined on first use since importing langchain_chroma loads chromadb.
+    """
+    global _chroma_class
+    if _chroma_class is not None:
+        return _chroma_class
+    from langchain_chroma import Chroma
+
+    class CoalescingChroma(Chroma):
+        def similarity_search_with_score(self, query, k=4, filter=None, where_document=None, **kwargs):
+            search = super().similarity_search_with_score
+            key = _search_key("similarity", query, k=k, filter=filter, where_document=where_document, **kwargs)
+            return list(vector_search_flight.run(
+                key, lambda: search(query, k, filter=filter, where_document=where_document, **kwargs)))
+
+        def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5,
+                                          filter=None, where_document=None, **kwargs):
+            search = super().max_marginal_relevance_search
+            key = _search_key("mmr", query, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult,
+                              filter=filter, where_document=where_document, **kwargs)
+            return list(vector_search_flight.run(
+                key, lambda: search(query, k, fetch_k, lambda_mult, filter=filter,
+                                    where_document=where_document, **kwargs)))
+
+    _chroma_class = CoalescingChroma
+    return _chroma_class
+
+def __getattr__(name):
+    # The module-level names used before initialization became lazy
+    if name == "vectore_store":
+        return get_vector_store()
+    if name == "embedding_model":
+        return get_embedding_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@traced("chroma.batch_search")
+def batch_similarity_search(vectors: List[List[float]], k: int, filter: dict = None) -> List[List[Document]]:
+    """Similarity search for several query vectors in one collection query.
+
+    Returns one ranked list per vector, the same documents a similarity
+    search for each query would return.
+    """
+    results = get_vector_store()._collection.query(query_embeddings=vectors, n_results=k, where=filter,
+                                                   include=["documents", "metadatas"])
+    return [[Document(id=chunk_id, page_content=text, metadata=metadata or {})
+             for chunk_id, text, metadata in zip(ids, texts, metadatas)]
+            for ids, texts, metadatas in zip(results["ids"], results["documents"], results["metadatas"])]
+
+# Corpus version, bumped whenever documents are added to or removed from the
+# store so that anything derived from the corpus (e.g. cached answers) can
+# tell it is stale. It is kept in SQLite so that every worker process sees
+# a change made by any of them; listeners run in each process the first
+# time it sees a new version.
+_seen_corpus_version = None
+_corpus_version_lock = threading.Lock()
+_corpus_listeners = []
+
+def get_corpus_version() -> int:
+    version = read_corpus_version()
+    _notify_corpus_version(version)
+    return version
+
+def on_corpus_change(callback):
+    """Register callback(version) to run after the corpus changes."""
+    _corpus_listeners.append(callback)
+
+def _notify_corpus_version(version):
+    global _seen_corpus_version
+    with _corpus_version_lock:
+        if version == _seen_corpus_version:
+            return
+        first_read = _seen_corpus_version is None
+        _seen_corpus_version = version
+    if first_read:
+        return
+    for callback in _corpus_listeners:
+        try:
+            callback(version)
+        except Exception as e:
+            print(f"Error in corpus change listener: {e}")
+
+def _bump_corpus_version():
+    _notify_corpus_version(increment_corpus_version())
+
+def _embed_with_retry(texts: List[str]) -> List[List[float]]:
+    """Embed one batch, retrying with exponential backoff and jitter."""
+    for attempt in range(INDEX_MAX_RETRIES + 1):
+        try:
+            return get_embedding_model().embed_documents(texts)
+        except Exception as e:
+            if attempt == INDEX_MAX_RETRIES:
+                raise
+            delay = INDEX_RETRY_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+            INDEX_EMBED_RETRIES.inc()
+            print(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+@traced("chroma.write")
+def _write_batch(batch: List[Document], embeddings: List[List[float]]):
+    # langchain_chroma has no public call that takes precomputed embeddings
+    get_vector_store()._collection.upsert(
+        ids=[split.id for split in batch],
+        embeddings=embeddings,
+        documents=[split.page_content for split in batch],
+        metadatas=[split.metadata for split in batch])
+    # The lexical index holds the same chunks under the same ids
+    upsert_lexical_chunks([_lexical_row(split.id, split.metadata['file_id'], split.page_content, split.metadata)
+                           for split in batch])
 
+def _lexical_row(chunk_id, file_id, text, metadata):
+    return (chunk_id, file_id, text, json.dumps(metadata, default=str))
+
+class IngestionInterrupted(Exception):
+    """Raised by a split stream when the ingestion queue is stopping.
+
+    index_splits_to_chroma keeps the chunks already written, so the resumed
+    job only embeds what is left.
+    """
+
+def _batched(splits: Iterable[Document], batch_size: int):
+    batch = []
+    for split in splits:
+        batch.append(split)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def chunk_hash(split: Document) -> str:
+    """Hash of a chunk's text and its position in the document.
+
+    File-level metadata (source path, modification dates, page count) is left
+    out so that an edit elsewhere in the file does not change every chunk.
+    """
+    position = {key: split.metadata[key] for key in CHUNK_HASH_METADATA_KEYS if key in split.metadata}
+    payload = split.page_content + "\0" + json.dumps(position, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_chunk_ids(file_id: int) -> List[str]:
+    return get_vector_store().get(where={"file_id": file_id}, include=[])['ids']
+
+def _changed_splits(splits: Iterable[Document], file_id: int, existing_ids: set, state: dict):
+    """Tag splits with content-derived ids and yield only those not already stored.
+
+    Ids are "<file_id>-<chunk hash>-<occurrence>", so an unchanged chunk of a
+    re-uploaded document maps to the id it already has.
+    """
+    occurrences = {}
+    for split in splits:
         #Add metadata to each split
-        for split in splits:
-            split.metadata['file_id']= file_id
-        
-        vectore_store.add_documents(splits)
+        digest = chunk_hash(split)
+        occurrence = occurrences.get(digest, 0)
+        occurrences[digest] = occurrence + 1
+        split.metadata['file_id']= file_id
+        split.metadata['chunk_hash']= digest
+        split.id = f"{file_id}-{digest[:32]}-{occurrence}"
+        state['seen'].add(split.id)
+        if split.id in existing_ids:
+            state['skipped'] += 1
+            continue
+        yield split
+
+def _delete_chunk_ids(ids: List[str]):
+    for start in range(0, len(ids), CHROMA_DELETE_BATCH):
+        get_vector_store().delete(ids=ids[start:start + CHROMA_DELETE_BATCH])
+    delete_lexical_chunks(chunk_ids=ids)
+
+@traced("chroma.index")
+def index_splits_to_chroma(splits: Iterable[Document], file_id: int,
+                           batch_size: int = INDEX_BATCH_SIZE,
+                           concurrency: int = INDEX_CONCURRENCY, on_batch=None) -> int:
+    """Embed splits in batches with bounded concurrency and write each batch
+    to the vector store as soon as its embeddings arrive.
+
+    Indexing is incremental per file_id: chunks already stored for the file
+    are skipped, and stored chunks that no longer appear are deleted once
+    the stream has been fully written. On failure the chunks written by this
+    call are removed again, unless the stream raised IngestionInterrupted.
+
+    At most ``concurrency`` batches are in flight, so memory stays flat for any
+    number of splits. ``on_batch(indexed_so_far)`` is called after every
+    write. Returns the number of chunks the document now has. Raises on failure.
+    """
+    written = 0
+    deleted = 0
+    start_time = time.perf_counter()
+    existing_ids = set(get_chunk_ids(file_id))
+    state = {'seen': set(), 'skipped': 0, 'written_ids': []}
+    batches = _batched(_changed_splits(splits, file_id, existing_ids, state), batch_size)
+    in_flight = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as pool:
+            def submit_next():
+                batch = next(batches, None)
+                if batch is None:
+                    return False
+                future = pool.submit(_embed_with_retry, [split.page_content for split in batch])
+                in_flight[future] = batch
+                return True
+
+            while len(in_flight) < concurrency and submit_next():
+                pass
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    # Writes stay on this thread: Chroma gets a single writer
+                    _write_batch(batch, future.result())
+                    state['written_ids'].extend(split.id for split in batch)
+                    written += len(batch)
+                    INDEX_CHUNKS.inc(len(batch))
+                    if on_batch:
+                        on_batch(written + state['skipped'])
+                    submit_next()
+
+        # Only after every current chunk is stored, drop the outdated ones
+        stale_ids = sorted(existing_ids - state['seen'])
+        if stale_ids:
+            _delete_chunk_ids(stale_ids)
+            deleted = len(stale_ids)
+            INDEX_CHUNKS_DELETED.inc(deleted)
+    except IngestionInterrupted:
+        # Written chunks stay for the resumed run to skip; stale ones too,
+        # as the document has not been read to the end
+        raise
+    except Exception:
+        # Roll the document back to the chunks it had before this run
+        new_ids = [chunk_id for chunk_id in state['written_ids'] if chunk_id not in existing_ids]
+        if new_ids:
+            _delete_chunk_ids(new_ids)
+        raise
+    finally:
+        if written or deleted:
+            _bump_corpus_version()
+    INDEX_CHUNKS_SKIPPED.inc(state['skipped'])
+    indexed = written + state['skipped']
+    if on_batch and state['skipped']:
+        on_batch(indexed)
+    elapsed = time.perf_counter() - start_time
+    if written and elapsed > 0:
+        INDEX_THROUGHPUT.observe(written / elapsed)
+    return indexed
+
+def rebuild_lexical_index(batch_size: int = CHROMA_DELETE_BATCH) -> int:
+    """Fill the lexical index from the chunks already in the vector store.
+
+    Needed once for stores indexed before the lexical index existed.
+    Returns the number of chunks indexed.
+    """
+    indexed = 0
+    for page in iter_chunk_pages(["documents", "metadatas"], batch_size):
+        upsert_lexical_chunks([_lexical_row(chunk_id, (metadata or {}).get('file_id'), text, metadata or {})
+                               for chunk_id, text, metadata in zip(page['ids'], page['documents'], page['metadatas'])])
+        indexed += len(page['ids'])
+    return indexed
+
+def iter_chunk_pages(include, batch_size: int = CHROMA_DELETE_BATCH, collection=None):
+    """Yield every chunk of the collection as Chroma get() pages of batch_size."""
+    collection = collection or get_vector_store()._collection
+    offset = 0
+    while True:
+        page = collection.get(include=include, limit=batch_size, offset=offset)
+        if not page['ids']:
+            return
+        yield page
+        offset += len(page['ids'])
+
+def ensure_lexical_index() -> int:
+    """Backfill the lexical index if it is empty but the vector store is not."""
+    if count_lexical_chunks() == 0 and get_vector_store()._collection.count() > 0:
+        indexed = rebuild_lexical_index()
+        print(f"Backfilled lexical index with {indexed} chunks")
+        return indexed
+    return 0
+
+def index_document_to_chroma(file_path:str, file_id:int) -> bool:
+    try:
+        # Pages are loaded, split and indexed as a stream
+        index_splits_to_chroma(iter_document_splits(file_path), file_id)
         return True
     except Exception as e:
         print(f"Error indexing document: {e}")
@@ -58,18 +416,37 @@ def index_document_to_chroma(file_path:str, file_id:int) -> bool:
 
 
 
+
+@traced("chroma.delete")
 def delete_documents_from_chroma(file_id:int):
     try:
-        docs = vectore_store.get(where={"file_id": file_id})
-        print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
-
-        vectore_store._collection.delete(where={"file_id": file_id})
+        # Chroma deletes by filter itself; no need to fetch the chunks first
+        get_vector_store().delete(where={"file_id": file_id})
+        delete_lexical_chunks(file_id=file_id)
         print(f"Deleted all documents with file_id {file_id}")
+        _bump_corpus_version()
         return True
     except Exception as e:
         print(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
         return False
 
+@traced("chroma.bulk_delete")
+def bulk_delete_documents(file_ids: List[int]) -> List[int]:
+    """Delete many documents: their chunks from Chroma, then their catalog
+    rows and lexical chunks in one SQLite transaction.
+
+    Chroma goes first and has no transactions: if it fails, the catalog is
+    untouched and the call can simply be repeated. Returns the ids that
+    were in the catalog.
+    """
+    file_ids = sorted(set(file_ids))
+    for start in range(0, len(file_ids), CHROMA_DELETE_FILES_BATCH):
+        get_vector_store().delete(where={"file_id": {"$in": file_ids[start:start + CHROMA_DELETE_FILES_BATCH]}})
+    deleted, version = delete_documents(file_ids)
+    _notify_corpus_version(version)
+    print(f"Deleted {len(deleted)} documents")
+    return deleted
+
 
 
 
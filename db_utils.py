@@ -1,76 +1,528 @@
+import os
 import sqlite3
+import threading
 from datetime import datetime
+from tracing_utils import traced
 
 DB_NAME = "rag_app.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Connection tuning, see https://www.sqlite.org/pragma.html
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+# Chat history window sent to the LLM; 0 disables a limit
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "10"))
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "0"))
+
+# SQLite caps the number of bound parameters per statement
+_SQL_BATCH = 500
+
+# Each thread keeps one open connection and reuses it for every call.
+# sqlite3 connections are not safe to share between threads, so a
+# thread-local pool gives reuse without any locking on our side.
+_local = threading.local()
+
+def _connect(db_name):
+    conn = sqlite3.connect(db_name,
+                           timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=DB_STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run alongside a single writer instead of blocking on it
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
     return conn
 
+def get_db_connection():
+    """Return this thread's pooled connection, opening it on first use.
+
+    Callers must not close the returned connection; use ``with conn:`` to
+    scope a write transaction.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.db_name != DB_NAME:
+        if conn is not None:
+            conn.close()
+        conn = _connect(DB_NAME)
+        _local.conn = conn
+        _local.db_name = DB_NAME
+        if _initialized_db != DB_NAME:
+            init_db()
+    return conn
+
+def close_db_connection():
+    """Close the calling thread's pooled connection, if it has one."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
 def create_application_logs():
     conn = get_db_connection()
-    conn.execute('''CREATE TABLE IF NOT EXISTS application_logs
-                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     session_id TEXT,
-                     user_query TEXT,
-                     gpt_response TEXT,
-                     model TEXT,
-                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    conn.close()
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS application_logs
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         session_id TEXT,
+                         user_query TEXT,
+                         gpt_response TEXT,
+                         model TEXT,
+                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
+@traced("db.log_write")
 def insert_application_logs(session_id, user_query, gpt_response, model):
     conn = get_db_connection()
-    conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
-                 (session_id, user_query, gpt_response, model))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
+                     (session_id, user_query, gpt_response, model))
+
+@traced("db.log_write_batch")
+def insert_application_logs_batch(rows, before_commit=None):
+    """Insert many (session_id, user_query, gpt_response, model) rows in one
+    transaction and return their ids.
 
-def get_chat_history(session_id):
+    ``before_commit(ids)`` is called once the rows are inserted, before they
+    become visible to other connections.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at', (session_id,))
+    with conn:
+        ids = [conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) '
+                            'VALUES (?, ?, ?, ?) RETURNING id', row).fetchone()[0]
+               for row in rows]
+        if before_commit:
+            before_commit(ids)
+    return ids
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for budgeting."""
+    return len(text or "") // 4 + 1
+
+def get_recent_turns(session_id, max_turns=None, max_tokens=None):
+    """Return the newest turns of a session, oldest first, within the window.
+
+    The (session_id, created_at) index serves the newest-first scan, so only
+    the rows inside the window are read.
+    """
+    max_turns = CHAT_HISTORY_MAX_TURNS if max_turns is None else max_turns
+    max_tokens = CHAT_HISTORY_MAX_TOKENS if max_tokens is None else max_tokens
+    conn = get_db_connection()
+    query = ('SELECT id, user_query, gpt_response FROM application_logs '
+             'WHERE session_id = ? ORDER BY created_at DESC, id DESC')
+    params = [session_id]
+    if max_turns:
+        query += ' LIMIT ?'
+        params.append(max_turns)
+
+    turns = []
+    used_tokens = 0
+    for row in conn.execute(query, params):
+        if max_tokens:
+            used_tokens += estimate_tokens(row['user_query']) + estimate_tokens(row['gpt_response'])
+            # Always keep the latest turn so follow-ups still have a referent
+            if used_tokens > max_tokens and turns:
+                break
+        turns.append(dict(row))
+    turns.reverse()
+    return turns
+
+@traced("db.chat_history")
+def get_chat_history(session_id, max_turns=None, max_tokens=None, pending_turns=()):
+    """Return the windowed chat history of a session as prompt messages.
+
+    ``pending_turns`` are turns accepted but not yet written (see
+    log_writer); they count towards the turn window. When a rolling summary
+    of older turns exists it is prepended as a system message.
+    """
+    turns = get_recent_turns(session_id, max_turns, max_tokens) + list(pending_turns)
+    return build_chat_history(session_id, turns, max_turns)
+
+def build_chat_history(session_id, turns, max_turns=None):
+    """Prompt messages for the given turns (oldest first), cut to the turn
+    window, after the session's rolling summary if it has one."""
+    max_turns = CHAT_HISTORY_MAX_TURNS if max_turns is None else max_turns
+    if max_turns:
+        turns = turns[-max_turns:]
+
     messages = []
-    for row in cursor.fetchall():
+    summary = get_session_summary(session_id)
+    if summary:
+        messages.append({"role": "system",
+                         "content": f"Summary of the earlier conversation: {summary['summary']}"})
+    for row in turns:
         messages.extend([
             {"role": "human", "content": row['user_query']},
             {"role": "ai", "content": row['gpt_response']}
         ])
-    conn.close()
     return messages
 
+def get_session_summary(session_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT summary, summarized_until FROM session_summaries WHERE session_id = ?',
+                       (session_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_turns_to_summarize(session_id, keep_turns=None, max_tokens=None):
+    """Return turns that fell out of the history window and are not yet summarized.
+
+    The window is the one get_chat_history uses, so turns dropped for the
+    token budget are summarized as well as those past the turn count.
+    """
+    recent = get_recent_turns(session_id, max_turns=keep_turns, max_tokens=max_tokens)
+    if not recent:
+        return []
+    summary = get_session_summary(session_id)
+    summarized_until = summary['summarized_until'] if summary else 0
+    conn = get_db_connection()
+    cursor = conn.execute('SELECT id, user_query, gpt_response FROM application_logs '
+                          'WHERE session_id = ? AND id > ? AND id < ? ORDER BY created_at, id',
+                          (session_id, summarized_until, recent[0]['id']))
+    return [dict(row) for row in cursor.fetchall()]
+
+def upsert_session_summary(session_id, summary, summarized_until):
+    conn = get_db_connection()
+    with conn:
+        conn.execute('INSERT INTO session_summaries (session_id, summary, summarized_until) VALUES (?, ?, ?) '
+                     'ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, '
+                     'summarized_until = excluded.summarized_until, updated_at = CURRENT_TIMESTAMP',
+                     (session_id, summary, summarized_until))
+
 def create_document_store():
     conn = get_db_connection()
-    conn.execute('''CREATE TABLE IF NOT EXISTS document_store
-                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     filename TEXT,
-                     upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    conn.close()
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS document_store
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         filename TEXT,
+                         upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+def insert_document_record(filename, content_hash=None):
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute('INSERT INTO document_store (filename, content_hash) VALUES (?, ?)',
+                              (filename, content_hash))
+    return cursor.lastrowid
+
+def get_document_record(file_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT id, filename, content_hash, upload_timestamp FROM document_store WHERE id = ?',
+                       (file_id,)).fetchone()
+    return dict(row) if row else None
 
-def insert_document_record(filename):
+def update_document_record(file_id, filename, content_hash):
+    """Record the file a document was (re-)indexed from."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
-    file_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return file_id
+    with conn:
+        conn.execute('UPDATE document_store SET filename = ?, content_hash = ? WHERE id = ?',
+                     (filename, content_hash, file_id))
+
+def find_document_by_hash(content_hash):
+    """Return the document whose indexed or in-flight content has this hash, if any."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT id, filename, content_hash FROM document_store WHERE content_hash = ?',
+                       (content_hash,)).fetchone()
+    if row is None:
+        # An update of an existing document that is still being indexed
+        row = conn.execute("SELECT d.id, d.filename, j.content_hash FROM ingestion_jobs j "
+                           "JOIN document_store d ON d.id = j.file_id "
+                           "WHERE j.content_hash = ? AND j.status IN ('queued', 'running')",
+                           (content_hash,)).fetchone()
+    return dict(row) if row else None
 
 def delete_document_record(file_id):
     conn = get_db_connection()
-    conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
     return True
 
 def get_all_documents():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, filename, upload_timestamp FROM document_store ORDER BY upload_timestamp DESC')
+    cursor = conn.execute('SELECT id, filename, upload_timestamp FROM document_store ORDER BY upload_timestamp DESC')
     documents = cursor.fetchall()
-    conn.close()
     return [dict(doc) for doc in documents]
 
-# Initialize the database tables
-create_application_logs()
-create_document_store()
\ No newline at end of file
+def get_documents_page(limit, before_id=None):
+    """Newest documents first, at most ``limit`` of them with ids below
+    ``before_id``; pass the last id of a page to get the next one."""
+    conn = get_db_connection()
+    query = 'SELECT id, filename, upload_timestamp FROM document_store'
+    params = []
+    if before_id is not None:
+        query += ' WHERE id < ?'
+        params.append(before_id)
+    cursor = conn.execute(query + ' ORDER BY id DESC LIMIT ?', (*params, limit))
+    return [dict(doc) for doc in cursor.fetchall()]
+
+def count_documents():
+    conn = get_db_connection()
+    return conn.execute('SELECT count(*) FROM document_store').fetchone()[0]
+
+def get_document_ids():
+    conn = get_db_connection()
+    return {row[0] for row in conn.execute('SELECT id FROM document_store')}
+
+def delete_documents(file_ids):
+    """Remove documents from the catalog and the lexical index and bump the
+    corpus version, all in one transaction.
+
+    Returns (ids that were in the catalog, new corpus version).
+    """
+    file_ids = list(file_ids)
+    conn = get_db_connection()
+    with conn:
+        deleted = []
+        for start in range(0, len(file_ids), _SQL_BATCH):
+            chunk = file_ids[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            deleted += [row[0] for row in conn.execute(
+                f'DELETE FROM document_store WHERE id IN ({placeholders}) RETURNING id', chunk)]
+            _delete_lexical_rows(conn, 'file_id', chunk)
+        version = conn.execute('UPDATE corpus_state SET version = version + 1 WHERE id = 1 '
+                               'RETURNING version').fetchone()[0]
+    return sorted(deleted), version
+
+# ─────────────────────────────
+# Ingestion jobs
+# ─────────────────────────────
+INGESTION_JOB_FIELDS = ('file_id', 'filename', 'file_path', 'status',
+                        'total_chunks', 'indexed_chunks', 'error', 'content_hash')
+
+def create_ingestion_job(job_id, file_id, filename, file_path, content_hash=None):
+    conn = get_db_connection()
+    with conn:
+        conn.execute("INSERT INTO ingestion_jobs (id, file_id, filename, file_path, status, content_hash) "
+                     "VALUES (?, ?, ?, ?, 'queued', ?)",
+                     (job_id, file_id, filename, file_path, content_hash))
+
+def update_ingestion_job(job_id, **fields):
+    unknown = set(fields) - set(INGESTION_JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown ingestion job fields: {sorted(unknown)}")
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn = get_db_connection()
+    with conn:
+        conn.execute(f'UPDATE ingestion_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                     (*fields.values(), job_id))
+
+def claim_ingestion_job(job_id):
+    """Move a queued job to running; False if another worker already took
+    it, or another job of the same document is running."""
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute("UPDATE ingestion_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP "
+                              "WHERE id = ? AND status = 'queued' AND NOT EXISTS "
+                              "(SELECT 1 FROM ingestion_jobs other WHERE other.file_id = ingestion_jobs.file_id "
+                              "AND other.status = 'running')", (job_id,))
+    return cursor.rowcount == 1
+
+def cancel_queued_ingestion_jobs(file_id, replaced_by):
+    """Cancel the queued jobs of a document that a newer job replaces;
+    returns their upload paths."""
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute("UPDATE ingestion_jobs SET status = 'cancelled', error = ?, "
+                              "updated_at = CURRENT_TIMESTAMP "
+                              "WHERE file_id = ? AND status = 'queued' AND id != ? RETURNING file_path",
+                              (f"Replaced by job {replaced_by}", file_id, replaced_by))
+        return [row[0] for row in cursor.fetchall()]
+
+def get_ingestion_job(job_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM ingestion_jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_unfinished_ingestion_jobs():
+    conn = get_db_connection()
+    cursor = conn.execute("SELECT * FROM ingestion_jobs WHERE status IN ('queued', 'running') ORDER BY created_at")
+    return [dict(row) for row in cursor.fetchall()]
+
+# ─────────────────────────────
+# Lexical chunk index
+# ─────────────────────────────
+# lexical_chunks is an FTS5 table, which can only look rows up by rowid;
+# lexical_chunk_rows maps chunk ids and file ids to those rowids.
+def upsert_lexical_chunks(rows):
+    """Index (chunk_id, file_id, content, metadata_json) rows, replacing same ids."""
+    conn = get_db_connection()
+    with conn:
+        for chunk_id, file_id, content, metadata in rows:
+            rowid = conn.execute('INSERT INTO lexical_chunk_rows (chunk_id, file_id) VALUES (?, ?) '
+                                 'ON CONFLICT (chunk_id) DO UPDATE SET file_id = excluded.file_id '
+                                 'RETURNING rowid', (chunk_id, file_id)).fetchone()[0]
+            conn.execute('DELETE FROM lexical_chunks WHERE rowid = ?', (rowid,))
+            conn.execute('INSERT INTO lexical_chunks (rowid, chunk_id, file_id, content, metadata) '
+                         'VALUES (?, ?, ?, ?, ?)', (rowid, chunk_id, file_id, content, metadata))
+
+def _delete_lexical_rows(conn, column, values):
+    for start in range(0, len(values), _SQL_BATCH):
+        chunk = values[start:start + _SQL_BATCH]
+        rowids = conn.execute(f'DELETE FROM lexical_chunk_rows WHERE {column} IN ({",".join("?" * len(chunk))}) '
+                              'RETURNING rowid', chunk).fetchall()
+        conn.executemany('DELETE FROM lexical_chunks WHERE rowid = ?', rowids)
+
+def delete_lexical_chunks(chunk_ids=None, file_id=None):
+    conn = get_db_connection()
+    with conn:
+        if chunk_ids is not None:
+            _delete_lexical_rows(conn, 'chunk_id', list(chunk_ids))
+        if file_id is not None:
+            _delete_lexical_rows(conn, 'file_id', [file_id])
+
+def count_lexical_chunks():
+    conn = get_db_connection()
+    return conn.execute('SELECT count(*) FROM lexical_chunk_rows').fetchone()[0]
+
+def get_lexical_chunk_ids():
+    conn = get_db_connection()
+    return {row[0] for row in conn.execute('SELECT chunk_id FROM lexical_chunk_rows')}
+
+def lexical_document_frequencies(terms):
+    """Number of chunks containing each of the given (indexed form) terms."""
+    conn = get_db_connection()
+    frequencies = dict.fromkeys(terms, 0)
+    frequencies.update(conn.execute(f'SELECT term, doc FROM lexical_vocab WHERE term IN '
+                                    f'({",".join("?" * len(terms))})', list(terms)).fetchall())
+    return frequencies
+
+def search_lexical_chunks(match_query, k=4, file_ids=None):
+    """Return the k best BM25 matches for an FTS5 MATCH expression,
+    optionally limited to the given file ids."""
+    conn = get_db_connection()
+    query = ('SELECT chunk_id, file_id, content, metadata, bm25(lexical_chunks) AS score '
+             'FROM lexical_chunks WHERE lexical_chunks MATCH ?')
+    params = [match_query]
+    if file_ids:
+        query += f' AND file_id IN ({",".join("?" * len(file_ids))})'
+        params.extend(file_ids)
+    cursor = conn.execute(query + ' ORDER BY score LIMIT ?', (*params, k))
+    return [dict(row) for row in cursor.fetchall()]
+
+def compact_database():
+    """Merge the lexical index's segments and rewrite the database file
+    without free pages. Takes an exclusive lock while it runs."""
+    conn = get_db_connection()
+    with conn:
+        conn.execute("INSERT INTO lexical_chunks (lexical_chunks) VALUES ('optimize')")
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+def database_stats():
+    """File size and free (reusable) pages of the database."""
+    conn = get_db_connection()
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return {"bytes": page_size * pages, "free_bytes": page_size * free_pages,
+            "free_ratio": free_pages / pages if pages else 0.0}
+
+# ─────────────────────────────
+# Corpus version
+# ─────────────────────────────
+def read_corpus_version():
+    conn = get_db_connection()
+    row = conn.execute('SELECT version FROM corpus_state WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+def increment_corpus_version():
+    """Bump the shared corpus version and return the new value."""
+    conn = get_db_connection()
+    with conn:
+        return conn.execute('UPDATE corpus_state SET version = version + 1 WHERE id = 1 '
+                            'RETURNING version').fetchone()[0]
+
+# ─────────────────────────────
+# Schema migrations
+# ─────────────────────────────
+# Applied in order on top of the base tables; PRAGMA user_version records
+# how many have run. Only ever append to this list.
+MIGRATIONS = [
+    # 1: serve per-session history lookups from an index instead of a scan
+    'CREATE INDEX IF NOT EXISTS idx_application_logs_session_created '
+    'ON application_logs (session_id, created_at)',
+    # 2: rolling summaries of turns that fell out of the history window
+    '''CREATE TABLE IF NOT EXISTS session_summaries
+       (session_id TEXT PRIMARY KEY,
+        summary TEXT,
+        summarized_until INTEGER,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    # 3: background document ingestion jobs
+    '''CREATE TABLE IF NOT EXISTS ingestion_jobs
+       (id TEXT PRIMARY KEY,
+        file_id INTEGER,
+        filename TEXT,
+        file_path TEXT,
+        status TEXT,
+        total_chunks INTEGER,
+        indexed_chunks INTEGER DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    # 4-6: content hashes for skipping identical uploads
+    'ALTER TABLE document_store ADD COLUMN content_hash TEXT',
+    'CREATE INDEX IF NOT EXISTS idx_document_store_content_hash ON document_store (content_hash)',
+    'ALTER TABLE ingestion_jobs ADD COLUMN content_hash TEXT',
+    # 7: local full-text index over chunk text for lexical (BM25) retrieval.
+    # '_' is a token character so identifiers like ERR_CONN_RESET stay whole.
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS lexical_chunks USING fts5
+       (chunk_id UNINDEXED,
+        file_id UNINDEXED,
+        content,
+        metadata UNINDEXED,
+        tokenize = "unicode61 tokenchars '_'")''',
+    # 8-9: corpus version shared by all worker processes
+    'CREATE TABLE IF NOT EXISTS corpus_state (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO corpus_state (id, version) VALUES (1, 0)',
+    # 10-12: chunk id -> FTS rowid, so lexical rows are replaced and deleted
+    # by rowid instead of scanning the FTS table
+    '''CREATE TABLE IF NOT EXISTS lexical_chunk_rows
+       (rowid INTEGER PRIMARY KEY,
+        chunk_id TEXT NOT NULL UNIQUE,
+        file_id INTEGER)''',
+    'CREATE INDEX IF NOT EXISTS idx_lexical_chunk_rows_file_id ON lexical_chunk_rows (file_id)',
+    'INSERT OR IGNORE INTO lexical_chunk_rows (rowid, chunk_id, file_id) '
+    'SELECT rowid, chunk_id, file_id FROM lexical_chunks',
+    # 13: number of chunks containing each term, for picking query terms
+    'CREATE VIRTUAL TABLE IF NOT EXISTS lexical_vocab USING fts5vocab(lexical_chunks, row)',
+    # 14: one running job per document (see claim_ingestion_job)
+    'CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_file_status ON ingestion_jobs (file_id, status)',
+]
+
+def run_migrations():
+    conn = get_db_connection()
+    # Several workers may start at once: take the write lock before reading
+    # the version so each migration runs exactly once
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statement in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.execute(statement)
+            conn.execute(f'PRAGMA user_version={number}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# DB_NAME whose tables are known to exist in this process
+_initialized_db = None
+_init_lock = threading.RLock()
+
+def init_db():
+    """Create the tables and apply pending migrations, once per process.
+
+    The application calls this from its startup rather than on import; a
+    thread's first connection also calls it, so scripts that use the
+    database directly need no setup.
+    """
+    global _initialized_db
+    with _init_lock:
+        if _initialized_db == DB_NAME:
+            return
+        # Opening this thread's connection may have run the setup already
+        get_db_connection()
+        if _initialized_db == DB_NAME:
+            return
+        create_application_logs()
+        create_document_store()
+        run_migrations()
+        _initialized_db = DB_NAME
+
+def db_initialized():
+    return _initialized_db == DB_NAME
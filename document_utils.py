@@ -0,0 +1,49 @@
+# Document loading and splitting.
+# Kept free of vector store and API client setup so that parser worker
+# processes can import it cheaply. The loaders (langchain_community) are
+# imported on first use; the API process only needs them once files arrive.
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from typing import Iterator, List
+from langchain_core.documents import Document
+
+# Initialize text splitter with specific chunk size and overlap
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, 
+                                               chunk_overlap=200, length_function=len)
+
+def _get_loader(file_path: str):
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
+    # Determine the loader to use based on file extension
+    if file_path.endswith('.pdf'):
+        return PyPDFLoader(file_path)
+    elif file_path.endswith('.docx'):
+        return Docx2txtLoader(file_path)
+    elif file_path.endswith('.html'):
+        return UnstructuredHTMLLoader(file_path)
+    else:
+        raise ValueError(f"Unsupported file type: {file_path}")
+
+def iter_document_splits(file_path: str) -> Iterator[Document]:
+    """Yield splits one loaded page (or document) at a time.
+
+    Loaders split PDFs into one Document per page and the splitter never
+    merges across Documents, so this yields the same chunks as splitting
+    the fully loaded document while holding only one page in memory.
+    """
+    for document in _get_loader(file_path).lazy_load():
+        yield from text_splitter.split_documents([document])
+
+def iter_split_batches(file_path: str, batch_size: int) -> Iterator[List[Document]]:
+    """Group iter_document_splits into lists of at most batch_size splits."""
+    batch = []
+    for split in iter_document_splits(file_path):
+        batch.append(split)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Function to load and split document based on file type
+def load_and_split_document(file_path: str) -> List[Document]:
+    return list(iter_document_splits(file_path))
@@ -0,0 +1,192 @@
+# Content-hash keyed cache for embedding calls.
+# Wraps any LangChain Embeddings: vectors are looked up in an in-memory LRU
+# first, then in a local SQLite file, and only texts missing from both are
+# sent to the embedding API. Identical query embeddings requested at the
+# same time are coalesced into one lookup; embed_queries embeds several
+# queries in one request.
+
+import os
+import sqlite3
+import hashlib
+import inspect
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter
+
+from tracing_utils import traced
+from singleflight import SingleFlight
+
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "embedding_cache.db")
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "20000"))
+# Vectors kept in the SQLite tier; the oldest written are pruned past this
+# (0 keeps them all)
+EMBEDDING_CACHE_DISK_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_ENTRIES", "200000"))
+
+EMBEDDING_CACHE_LOOKUPS = Counter("embedding_cache_lookups_total",
+                                  "Embedding cache lookups by the tier that answered them",
+                                  ["kind", "tier"])
+
+# SQLite caps the number of bound parameters per statement
+_SQL_BATCH = 500
+# Task type of query embeddings for models that take one (Google's)
+QUERY_TASK_TYPE = "retrieval_query"
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a memory LRU tier and a persistent SQLite tier.
+
+    ``namespace`` must change whenever the wrapped model does, since it is
+    part of every cache key.
+    """
+
+    def __init__(self, embeddings: Embeddings, namespace: str,
+                 db_path: str = EMBEDDING_CACHE_DB,
+                 memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES,
+                 disk_entries: int = EMBEDDING_CACHE_DISK_ENTRIES):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._query_flight = SingleFlight("embed.query")
+        # Every query embedding, single or batched, is requested with this
+        # task type; it is part of the cache key of query vectors
+        self._query_task_type = (QUERY_TASK_TYPE if "task_type" in
+                                 inspect.signature(embeddings.embed_documents).parameters else None)
+        self._get_connection()
+
+    # ───── storage ─────
+    def _get_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS embeddings
+                            (key TEXT PRIMARY KEY,
+                             vector BLOB)''')
+            self._local.conn = conn
+        return conn
+
+    def _key(self, kind, text):
+        if kind == "query" and self._query_task_type:
+            kind = f"query:{self._query_task_type}"
+        return hashlib.sha256(f"{self.namespace}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        with self._memory_lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _read_disk(self, keys):
+        found = {}
+        conn = self._get_connection()
+        for start in range(0, len(keys), _SQL_BATCH):
+            chunk = keys[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            for key, blob in conn.execute(f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', chunk):
+                found[key] = array("f", blob)
+        return found
+
+    def _write_disk(self, items):
+        conn = self._get_connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                             [(key, vector.tobytes()) for key, vector in items])
+            if self.disk_entries:
+                # Rows get increasing rowids as they are written, so the
+                # oldest are a rowid range; gaps only make it prune early
+                conn.execute('DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?',
+                             (self.disk_entries,))
+
+    # ───── lookup ─────
+    def _embed(self, kind, texts, embed_fn):
+        keys = [self._key(kind, text) for text in texts]
+        vectors = {}
+
+        with self._memory_lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    vectors[key] = self._memory[key]
+        memory_hits = len(vectors)
+
+        missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+        if missing:
+            for key, vector in self._read_disk(missing).items():
+                vectors[key] = vector
+                self._remember(key, vector)
+        disk_hits = len(vectors) - memory_hits
+
+        # Embed each distinct uncached text once
+        to_embed = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                to_embed.setdefault(key, text)
+        if to_embed:
+            new_vectors = embed_fn(list(to_embed.values()))
+            # Stored as float32 arrays: a quarter of the memory of float lists,
+            # and hits and misses return identical values
+            items = [(key, array("f", vector)) for key, vector in zip(to_embed.keys(), new_vectors)]
+            self._write_disk(items)
+            for key, vector in items:
+                vectors[key] = vector
+                self._remember(key, vector)
+
+        with self._memory_lock:
+            self._stats["memory_hits"] += memory_hits
+            self._stats["disk_hits"] += disk_hits
+            self._stats["misses"] += len(to_embed)
+        EMBEDDING_CACHE_LOOKUPS.labels(kind=kind, tier="memory").inc(memory_hits)
+        EMBEDDING_CACHE_LOOKUPS.labels(kind=kind, tier="disk").inc(disk_hits)
+        EMBEDDING_CACHE_LOOKUPS.labels(kind=kind, tier="miss").inc(len(to_embed))
+        return [vectors[key].tolist() for key in keys]
+
+    @traced("embed.documents")
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._embed("document", texts, self.embeddings.embed_documents)
+
+    @traced("embed.query")
+    def embed_query(self, text: str) -> List[float]:
+        return self._query_flight.run(
+            self._key("query", text),
+            lambda: self._embed("query", [text], self._embed_query_batch)[0])
+
+    @traced("embed.queries")
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Query embeddings for several texts, cached like embed_query.
+
+        Uncached texts go to the model in one batch request when it takes a
+        task type (Google's embed_documents does); otherwise one by one.
+        Either way each text gets the vector embed_query would return.
+        """
+        if not texts:
+            return []
+        return self._embed("query", texts, self._embed_query_batch)
+
+    def _embed_query_batch(self, texts):
+        # Google's embed_query does not pass its task type on to the API,
+        # so single queries go through embed_documents as well
+        if self._query_task_type:
+            return self.embeddings.embed_documents(texts, task_type=self._query_task_type)
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def stats(self):
+        """Hit and miss counts since start, plus the current memory tier size."""
+        lookups = sum(self._stats.values())
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        return {**self._stats,
+                "memory_entries": len(self._memory),
+                "hit_rate": hits / lookups if lookups else 0.0}
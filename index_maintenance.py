@@ -0,0 +1,298 @@
+# Vector index maintenance.
+# Reports the size and fragmentation of the stores, checks that the SQLite
+# catalog (document_store), the lexical index and the Chroma collection
+# agree, and compacts or rebuilds them. Chroma only marks deleted vectors
+# in its HNSW index, so after large deletes or replacements the persisted
+# index keeps growing until the collection is rebuilt.
+#
+#     python index_maintenance.py report
+#     python index_maintenance.py check [--repair]
+#     python index_maintenance.py compact
+#     python index_maintenance.py rebuild
+#
+# compact and rebuild need the API stopped: the embedded store must only be
+# opened by one process, and API workers keep a handle on the collection
+# that a rebuild replaces.
+
+import os
+import json
+import shutil
+import struct
+import sqlite3
+import argparse
+import subprocess
+from collections import Counter
+
+from db_utils import (init_db, get_document_ids, count_documents, count_lexical_chunks,
+                      get_lexical_chunk_ids, get_unfinished_ingestion_jobs, delete_lexical_chunks,
+                      upsert_lexical_chunks, compact_database, database_stats)
+from chroma_utils import (get_vector_store, reset_vector_store, iter_chunk_pages,
+                          _lexical_row, _bump_corpus_version, CHROMA_SERVER_HOST, CHROMA_PERSIST_DIR, CHROMA_COLLECTION,
+                          CHROMA_DELETE_BATCH, CHROMA_DELETE_FILES_BATCH)
+
+# Ids listed per problem in check results; the counts are always complete
+CHECK_SAMPLE_SIZE = int(os.getenv("CHECK_SAMPLE_SIZE", "20"))
+# Chunks copied per call when rebuilding the collection
+REBUILD_BATCH_SIZE = int(os.getenv("REBUILD_BATCH_SIZE", "1000"))
+
+# hnswlib index header as persisted by Chroma: a format version, then
+# offsetLevel0, max_elements and cur_element_count
+_HNSW_HEADER = struct.Struct("<iQQQ")
+
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def _hnsw_header(segment_dir):
+    path = os.path.join(segment_dir, "header.bin")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        _, _, capacity, elements = _HNSW_HEADER.unpack(f.read(_HNSW_HEADER.size))
+    return {"capacity": capacity, "elements": elements}
+
+
+def _persisted_store_report(collection_name, live_chunks):
+    """Size of the embedded store and how much of its HNSW index is deleted vectors."""
+    sqlite_path = os.path.join(CHROMA_PERSIST_DIR, "chroma.sqlite3")
+    conn = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        log_entries = conn.execute("SELECT count(*) FROM embeddings_queue").fetchone()[0]
+        segment = conn.execute("SELECT s.id FROM segments s JOIN collections c ON c.id = s.collection "
+                               "WHERE c.name = ? AND s.scope = 'VECTOR'", (collection_name,)).fetchone()
+    finally:
+        conn.close()
+    report = {
+        "path": os.path.abspath(CHROMA_PERSIST_DIR),
+        "bytes": _dir_bytes(CHROMA_PERSIST_DIR),
+        "sqlite": {"bytes": page_size * pages, "free_bytes": page_size * free_pages,
+                   "free_ratio": free_pages / pages if pages else 0.0,
+                   "log_entries": log_entries},
+    }
+    segment_dir = os.path.join(CHROMA_PERSIST_DIR, segment[0]) if segment else None
+    header = _hnsw_header(segment_dir) if segment_dir else None
+    if header:
+        # Deleted vectors keep their slots; vectors written since the index
+        # was last persisted are not counted in it yet
+        deleted = max(header["elements"] - live_chunks, 0)
+        report["hnsw"] = {"bytes": _dir_bytes(segment_dir), **header,
+                          "deleted_estimate": deleted,
+                          "fragmentation": deleted / header["elements"] if header["elements"] else 0.0}
+    return report
+
+
+def _remove_stale_segments():
+    """Delete vector segment directories no collection refers to any more.
+
+    Chroma drops a deleted collection's rows but leaves its HNSW files on
+    disk; returns the bytes freed.
+    """
+    conn = sqlite3.connect(os.path.join(CHROMA_PERSIST_DIR, "chroma.sqlite3"))
+    try:
+        segments = {row[0] for row in conn.execute("SELECT id FROM segments")}
+    finally:
+        conn.close()
+    freed = 0
+    for name in os.listdir(CHROMA_PERSIST_DIR):
+        path = os.path.join(CHROMA_PERSIST_DIR, name)
+        if (os.path.isdir(path) and name not in segments
+                and os.path.exists(os.path.join(path, "header.bin"))):
+            freed += _dir_bytes(path)
+            shutil.rmtree(path)
+    return freed
+
+
+def index_report():
+    """Chunk and document counts, plus on-disk size and fragmentation."""
+    collection = get_vector_store()._collection
+    chunks = collection.count()
+    report = {
+        "collection": collection.name,
+        "chunks": chunks,
+        "documents": count_documents(),
+        "lexical_chunks": count_lexical_chunks(),
+        "database": database_stats(),
+    }
+    if not CHROMA_SERVER_HOST:
+        report["store"] = _persisted_store_report(collection.name, chunks)
+    return report
+
+
+def consistency_check(repair=False):
+    """Compare the catalog, the lexical index and the Chroma collection.
+
+    Reports chunks of documents missing from the catalog (orphans), catalog
+    documents without chunks, and chunks missing from or left over in the
+    lexical index. Documents with an unfinished ingestion job are skipped.
+    With repair, orphans are deleted and the lexical index is brought in
+    line with Chroma; documents without chunks are only reported, since
+    they need their files uploaded again.
+    """
+    documents = get_document_ids()
+    ingesting = {job['file_id'] for job in get_unfinished_ingestion_jobs()}
+    lexical_ids = get_lexical_chunk_ids()
+
+    chunk_ids = set()
+    chunks_per_file = Counter()
+    unowned_ids = []
+    for page in iter_chunk_pages(["metadatas"]):
+        for chunk_id, metadata in zip(page['ids'], page['metadatas']):
+            chunk_ids.add(chunk_id)
+            file_id = (metadata or {}).get('file_id')
+            if file_id is None:
+                unowned_ids.append(chunk_id)
+            else:
+                chunks_per_file[file_id] += 1
+
+    orphan_files = sorted(set(chunks_per_file) - documents - ingesting)
+    empty_documents = sorted(documents - set(chunks_per_file) - ingesting)
+    missing_lexical = sorted(chunk_ids - lexical_ids)
+    stale_lexical = sorted(lexical_ids - chunk_ids)
+
+    def problem(ids, count=None):
+        return {"count": len(ids) if count is None else count, "sample": ids[:CHECK_SAMPLE_SIZE]}
+
+    result = {
+        "consistent": not (orphan_files or unowned_ids or empty_documents or missing_lexical or stale_lexical),
+        "chunks": len(chunk_ids),
+        "documents": len(documents),
+        "orphan_files": problem(orphan_files),
+        "orphan_chunks": problem(unowned_ids, len(unowned_ids) + sum(chunks_per_file[f] for f in orphan_files)),
+        "documents_without_chunks": problem(empty_documents),
+        "chunks_missing_from_lexical_index": problem(missing_lexical),
+        "lexical_chunks_not_in_chroma": problem(stale_lexical),
+    }
+    if repair:
+        result["repaired"] = _repair(orphan_files, unowned_ids, missing_lexical, stale_lexical)
+    return result
+
+
+def _repair(orphan_files, unowned_ids, missing_lexical, stale_lexical):
+    vector_store = get_vector_store()
+    for start in range(0, len(orphan_files), CHROMA_DELETE_FILES_BATCH):
+        batch = orphan_files[start:start + CHROMA_DELETE_FILES_BATCH]
+        vector_store.delete(where={"file_id": {"$in": batch}})
+        for file_id in batch:
+            delete_lexical_chunks(file_id=file_id)
+    for start in range(0, len(unowned_ids), CHROMA_DELETE_BATCH):
+        vector_store.delete(ids=unowned_ids[start:start + CHROMA_DELETE_BATCH])
+    # Chunks just deleted as orphans no longer need a lexical row
+    unowned = set(unowned_ids)
+    missing_lexical = [chunk_id for chunk_id in missing_lexical if chunk_id not in unowned]
+    restored = 0
+    for start in range(0, len(missing_lexical), CHROMA_DELETE_BATCH):
+        page = vector_store.get(ids=missing_lexical[start:start + CHROMA_DELETE_BATCH],
+                                include=["documents", "metadatas"])
+        rows = [_lexical_row(chunk_id, (metadata or {}).get('file_id'), text, metadata or {})
+                for chunk_id, text, metadata in zip(page['ids'], page['documents'], page['metadatas'])
+                if (metadata or {}).get('file_id') not in orphan_files]
+        upsert_lexical_chunks(rows)
+        restored += len(rows)
+    if stale_lexical:
+        delete_lexical_chunks(chunk_ids=stale_lexical)
+    if orphan_files or unowned_ids or restored or stale_lexical:
+        _bump_corpus_version()
+    return {"orphan_files_deleted": len(orphan_files), "unowned_chunks_deleted": len(unowned_ids),
+            "lexical_rows_restored": restored, "lexical_rows_removed": len(stale_lexical)}
+
+
+def compact():
+    """Compact the SQLite database (lexical index included) and, for the
+    embedded store, run Chroma's own vacuum on the persistence directory.
+
+    Vacuum purges Chroma's write log and frees unused pages; it does not
+    reclaim deleted HNSW slots, which takes a rebuild.
+    """
+    result = {}
+    if not CHROMA_SERVER_HOST:
+        before = _dir_bytes(CHROMA_PERSIST_DIR)
+        _remove_stale_segments()
+        chroma = shutil.which("chroma")
+        if chroma is None:
+            raise RuntimeError("The chroma command (installed with chromadb) is needed to vacuum the store")
+        subprocess.run([chroma, "vacuum", "--path", CHROMA_PERSIST_DIR, "--force"], check=True,
+                       stdout=subprocess.DEVNULL)
+        result["store"] = {"bytes_before": before, "bytes_after": _dir_bytes(CHROMA_PERSIST_DIR)}
+    else:
+        result["store"] = "vacuum the Chroma server's storage on its host (chroma vacuum --path ...)"
+    before = database_stats()["bytes"]
+    compact_database()
+    result["database"] = {"bytes_before": before, "bytes_after": database_stats()["bytes"]}
+    return result
+
+
+def rebuild_collection(batch_size=REBUILD_BATCH_SIZE):
+    """Copy every chunk, with its stored embedding, into a new collection
+    and swap it in under the same name, leaving out deleted vectors.
+
+    No embedding calls are made. If a run is interrupted after the old
+    collection was dropped, running it again finishes the swap.
+    """
+    vector_store = get_vector_store()
+    client = vector_store._client
+    collection = vector_store._collection
+    temp_name = f"{CHROMA_COLLECTION}-rebuild"
+    names = {existing.name for existing in client.list_collections()}
+
+    if temp_name in names:
+        if collection.count() == 0:
+            # The previous run dropped the old collection (get_vector_store
+            # has just created an empty one); its copy is complete
+            client.delete_collection(CHROMA_COLLECTION)
+            client.get_collection(temp_name).modify(name=CHROMA_COLLECTION)
+            return {"resumed": True, "chunks": client.get_collection(CHROMA_COLLECTION).count(),
+                    "stale_bytes_removed": 0 if CHROMA_SERVER_HOST else _remove_stale_segments()}
+        client.delete_collection(temp_name)
+
+    copy = client.create_collection(temp_name, metadata=collection.metadata,
+                                    configuration=collection.configuration, embedding_function=None)
+    copied = 0
+    for page in iter_chunk_pages(["embeddings", "documents", "metadatas"], batch_size, collection):
+        copy.add(ids=page['ids'], embeddings=page['embeddings'],
+                 documents=page['documents'], metadatas=page['metadatas'])
+        copied += len(page['ids'])
+    if copy.count() != collection.count():
+        client.delete_collection(temp_name)
+        raise RuntimeError("The collection changed during the rebuild; stop the API and run it again")
+
+    client.delete_collection(CHROMA_COLLECTION)
+    copy.modify(name=CHROMA_COLLECTION)
+    return {"resumed": False, "chunks": copied,
+            "stale_bytes_removed": 0 if CHROMA_SERVER_HOST else _remove_stale_segments()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector index maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="chunk counts, store size and fragmentation")
+    check = commands.add_parser("check", help="consistency between SQLite and Chroma")
+    check.add_argument("--repair", action="store_true",
+                       help="delete orphan chunks and resync the lexical index")
+    commands.add_parser("compact", help="vacuum the stores (API stopped)")
+    rebuild = commands.add_parser("rebuild", help="copy the collection into a fresh index (API stopped)")
+    rebuild.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "report":
+        result = index_report()
+    elif args.command == "check":
+        result = consistency_check(repair=args.repair)
+    elif args.command == "compact":
+        result = compact()
+        result["report"] = index_report()
+    else:
+        result = rebuild_collection(args.batch_size)
+        # Report on the new collection, not the dropped one
+        reset_vector_store()
+        result["report"] = index_report()
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# Background document ingestion.
+# /upload-document stores the file and a job row, then returns; jobs are
+# parsed in a process pool (PDF parsing is CPU bound and holds the GIL) and
+# indexed in batches from a small thread pool. Parsed splits stream back
+# from the parser process through a bounded queue, so neither process holds
+# the whole document. Job state lives in the ingestion_jobs table so
+# unfinished jobs are picked up again after a restart. With several API
+# workers, each runs its own queue; a job is claimed atomically before it
+# runs, and only one worker resumes interrupted jobs on startup.
+
+import os
+import fcntl
+import uuid
+import hashlib
+import logging
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from document_utils import iter_split_batches
+from chroma_utils import (index_splits_to_chroma, delete_documents_from_chroma, IngestionInterrupted,
+                          INDEX_BATCH_SIZE)
+from db_utils import (create_ingestion_job, update_ingestion_job, get_ingestion_job, claim_ingestion_job,
+                      cancel_queued_ingestion_jobs, get_unfinished_ingestion_jobs, delete_document_record,
+                      get_document_record, update_document_record)
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_PARSE_PROCESSES = int(os.getenv("INGESTION_PARSE_PROCESSES", "2"))
+# Parsed batches a parser process may run ahead of indexing
+INGESTION_PARSE_QUEUE_BATCHES = int(os.getenv("INGESTION_PARSE_QUEUE_BATCHES", "4"))
+# Held for its lifetime by the worker that resumed interrupted jobs
+INGESTION_RESUME_LOCK = os.getenv("INGESTION_RESUME_LOCK", os.path.join(UPLOAD_DIR, ".resume.lock"))
+# Seconds between attempts to start a job while another job of the same
+# document is running
+INGESTION_CLAIM_RETRY_SECONDS = float(os.getenv("INGESTION_CLAIM_RETRY_SECONDS", "1"))
+
+_END_OF_DOCUMENT = None
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def save_upload(file_obj, path):
+    """Copy an uploaded file to disk and return the sha256 of its content."""
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        while True:
+            chunk = file_obj.read(_COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def _parse_into_queue(file_path, batch_size, out_queue):
+    """Parser process entry point: stream split batches, then an end marker.
+
+    Errors are sent through the queue as well so the consumer can raise them.
+    """
+    try:
+        for batch in iter_split_batches(file_path, batch_size):
+            out_queue.put(batch)
+    except Exception as e:
+        out_queue.put(e)
+    out_queue.put(_END_OF_DOCUMENT)
+
+
+class IngestionQueue:
+    """Runs ingestion jobs in the background and records their progress.
+
+    ``on_finish(job, success)`` is called once per job when it completes or fails.
+    """
+
+    def __init__(self, workers=INGESTION_WORKERS,
+                 parse_processes=INGESTION_PARSE_PROCESSES, on_finish=None):
+        self.workers = workers
+        self.parse_processes = parse_processes
+        self.on_finish = on_finish
+        self._executor = None
+        self._parse_pool = None
+        self._manager = None
+        self._resume_lock = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix="ingestion")
+        # spawn, not fork: the server process already runs threads
+        mp_context = multiprocessing.get_context("spawn")
+        self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_processes,
+                                               mp_context=mp_context)
+        self._manager = mp_context.Manager()
+        if self._acquire_resume_lock():
+            self.resume()
+
+    def stop(self):
+        """Stop taking jobs; unfinished ones resume on the next start.
+
+        Running jobs stop after the batch they are indexing and stay
+        "running", queued ones stay "queued"; the parser processes and
+        their queues are only shut down once no job reads from them.
+        """
+        self._stopping.set()
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._manager:
+            self._manager.shutdown()
+        if self._parse_pool:
+            self._parse_pool.shutdown(wait=False, cancel_futures=True)
+        if self._resume_lock:
+            self._resume_lock.close()
+            self._resume_lock = None
+
+    def _acquire_resume_lock(self):
+        """True for the first worker to start; the "running" jobs other
+        workers see on startup belong to that worker and are still live."""
+        lock = open(INGESTION_RESUME_LOCK, "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._resume_lock = lock
+        return True
+
+    def upload_path(self, filename):
+        return os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+
+    def submit(self, file_id, filename, file_path, content_hash=None):
+        """Record a job for an already saved upload and queue it; returns the job id.
+
+        Jobs of the same document that have not started yet are cancelled,
+        since this one indexes a newer version.
+        """
+        job_id = str(uuid.uuid4())
+        create_ingestion_job(job_id, file_id, filename, file_path, content_hash)
+        for replaced_path in cancel_queued_ingestion_jobs(file_id, job_id):
+            if os.path.exists(replaced_path):
+                os.remove(replaced_path)
+        self._executor.submit(self._run_job, job_id)
+        return job_id
+
+    def resume(self):
+        """Queue jobs left unfinished by a previous process."""
+        for job in get_unfinished_ingestion_jobs():
+            if job['status'] == 'running':
+                # Indexing is idempotent per file: the rerun keeps what the
+                # interrupted run already wrote and removes what is stale
+                update_ingestion_job(job['id'], status='queued', indexed_chunks=0)
+            logging.info(f"Resuming ingestion job {job['id']} for {job['filename']}")
+            self._executor.submit(self._run_job, job['id'])
+
+    def _iter_parsed_splits(self, file_path):
+        """Yield splits parsed by a pool process as its batches arrive."""
+        batches = self._manager.Queue(maxsize=INGESTION_PARSE_QUEUE_BATCHES)
+        future = self._parse_pool.submit(_parse_into_queue, file_path, INDEX_BATCH_SIZE, batches)
+        while True:
+            if self._stopping.is_set():
+                raise IngestionInterrupted(file_path)
+            try:
+                item = batches.get(timeout=1)
+            except (EOFError, OSError) as e:
+                # The manager process went away under the queue
+                if self._stopping.is_set():
+                    raise IngestionInterrupted(file_path) from e
+                raise
+            except queue.Empty:
+                # A parser process that died never sends the end marker
+                if future.done() and batches.empty():
+                    future.result()
+                    raise RuntimeError(f"Parser stopped before finishing {file_path}")
+                continue
+            if item is _END_OF_DOCUMENT:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+
+    def _run_job(self, job_id):
+        # Two jobs of one document must not index it at once: each only
+        # removes the chunks its own run made stale
+        while not claim_ingestion_job(job_id):
+            job = get_ingestion_job(job_id)
+            if job is None or job['status'] != 'queued' or self._stopping.is_set():
+                return
+            self._stopping.wait(INGESTION_CLAIM_RETRY_SECONDS)
+        job = get_ingestion_job(job_id)
+        success = False
+        interrupted = False
+        try:
+            # The chunk count is only known once the stream ends
+            indexed = index_splits_to_chroma(self._iter_parsed_splits(job['file_path']), job['file_id'],
+                                             on_batch=lambda indexed: update_ingestion_job(job_id, indexed_chunks=indexed))
+            if job['content_hash']:
+                update_document_record(job['file_id'], job['filename'], job['content_hash'])
+            update_ingestion_job(job_id, status='completed', total_chunks=indexed)
+            logging.info(f"Successfully indexed {job['filename']} (job {job_id})")
+            success = True
+        except IngestionInterrupted:
+            # Left "running" with its upload kept; resume() queues it again
+            interrupted = True
+            logging.info(f"Ingestion job {job_id} for {job['filename']} stopped by shutdown")
+        except Exception as e:
+            logging.error(f"Error in ingestion job {job_id} for {job['filename']}: {e}")
+            update_ingestion_job(job_id, status='failed', error=str(e))
+            # A new document was recorded with this job's hash. An update of an
+            # existing one still carries the old hash and keeps its previous
+            # chunks, which the failed run has already restored.
+            document = get_document_record(job['file_id'])
+            if document is not None and document['content_hash'] == job['content_hash']:
+                delete_documents_from_chroma(job['file_id'])
+                delete_document_record(job['file_id'])
+        finally:
+            if not interrupted:
+                if os.path.exists(job['file_path']):
+                    os.remove(job['file_path'])
+                if self.on_finish:
+                    self.on_finish(job, success)
@@ -1,19 +1,90 @@
-from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain_core.runnables import RunnableMap, RunnableLambda
+from langchain_core.runnables import RunnableMap, RunnableLambda, RunnablePassthrough
 from typing import List
 from langchain_core.documents import Document
-from chroma_utils import vectore_store
-import os 
+from chroma_utils import get_vector_store
+from retrieval_utils import RetrievalMode, LexicalRetriever, HybridRetriever, routed_retriever
+from prompt_utils import budget_prompt_inputs
+from tracing_utils import tracing_callbacks
+from db_utils import get_session_summary, get_turns_to_summarize, upsert_session_summary, estimate_tokens
+from prometheus_client import Counter, Histogram
+from collections import namedtuple, OrderedDict
+from operator import itemgetter
+import hashlib
+import httpx
+import json
+import re
+import threading
+import time
+import os
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-retriever=vectore_store.as_retriever()
+# HTTP connection pool limits shared by every Groq client
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "10"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
+
+# Fold turns that fall out of the history window into a per-session summary
+CHAT_HISTORY_SUMMARY = os.getenv("CHAT_HISTORY_SUMMARY", "false").lower() == "true"
+
+# Question rewriting: skip the contextualize LLM call for follow-ups that
+# do not refer back to the conversation, and remember rewrites per turn
+REWRITE_HEURISTIC = os.getenv("REWRITE_HEURISTIC", "true").lower() == "true"
+REWRITE_MIN_WORDS = int(os.getenv("REWRITE_MIN_WORDS", "4"))
+REWRITE_MEMO_ENTRIES = int(os.getenv("REWRITE_MEMO_ENTRIES", "2048"))
+
+# Retriever per retrieval mode, built with the first chain since the vector
+# retriever opens the vector store
+_retrievers = None
+_retrievers_lock = threading.Lock()
+
+def get_retrievers():
+    global _retrievers
+    if _retrievers is None:
+        with _retrievers_lock:
+            if _retrievers is None:
+                retriever = get_vector_store().as_retriever()
+                lexical_retriever = LexicalRetriever()
+                _retrievers = {
+                    RetrievalMode.VECTOR: retriever,
+                    RetrievalMode.LEXICAL: lexical_retriever,
+                    RetrievalMode.HYBRID: HybridRetriever(vector_retriever=retriever,
+                                                          lexical_retriever=lexical_retriever),
+                }
+    return _retrievers
+
+def __getattr__(name):
+    # The module-level retrievers of earlier versions, now built lazily
+    modes = {"retriever": RetrievalMode.VECTOR, "lexical_retriever": RetrievalMode.LEXICAL,
+             "hybrid_retriever": RetrievalMode.HYBRID}
+    if name == "retrievers":
+        return get_retrievers()
+    if name in modes:
+        return get_retrievers()[modes[name]]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 output_parser= StrOutputParser()
 
+## ------- Chain registry metrics --------------
+CHAIN_BUILD_SECONDS = Histogram("rag_chain_build_seconds",
+                                "Time spent building a RAG chain", ["model"])
+CHAIN_CACHE_HITS = Counter("rag_chain_cache_hits_total",
+                           "RAG chain lookups served from the registry", ["model"])
+CHAIN_CACHE_MISSES = Counter("rag_chain_cache_misses_total",
+                             "RAG chain lookups that required a build", ["model"])
+
+## ------- Question rewrite metrics --------------
+REWRITE_LATENCY = Histogram("rag_rewrite_seconds",
+                            "Time spent in the contextualize LLM call", ["model"])
+REWRITE_SKIPPED = Counter("rag_rewrite_skipped_total",
+                          "Contextualize LLM calls avoided", ["model", "reason"])
+REWRITE_SAVED_SECONDS = Counter("rag_rewrite_saved_seconds_total",
+                                "Estimated contextualize latency avoided by skipped calls on turns with history", ["model"])
+
 # Set up prompts and chains
 contextualize_q_system_prompt = (
     "Given a chat history and the latest user question "
@@ -37,21 +108,233 @@ qa_prompt = ChatPromptTemplate.from_messages([
             ("human", "{input}")
         ])
 
-def get_rag_chain(model="llama-3.1-8b-instant"):
-    # import getpass
-    # import os
-    # if "GROQ_API_KEY" not in os.environ:
-    #     os.environ["GROQ_API_KEY"] = getpass.getpass("Enter your Groq API key: ")
-
-    llm= ChatGroq(model=model,
-                  groq_api_key=GROQ_API_KEY)
-    history_aware_retriever =create_history_aware_retriever(llm, retriever, contextualize_prompt)
-    qa_chain= create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain= create_retrieval_chain(history_aware_retriever, qa_chain)
+# Tokens the QA template itself adds to every prompt
+QA_PROMPT_TOKENS = estimate_tokens(qa_prompt.format(context="", chat_history=[], input=""))
+
+summary_prompt = ChatPromptTemplate.from_messages([
+            ("system", "Condense the conversation below into a short summary that keeps every fact, "
+                       "name and decision a later question might refer to. Reply with the summary only."),
+            ("human", "Existing summary:\n{summary}\n\nNew conversation turns:\n{turns}")
+        ])
+
+# ─────────────────────────────
+# Shared HTTP clients
+# ─────────────────────────────
+# One sync and one async pool are shared by every ChatGroq instance so that
+# keep-alive connections to Groq are reused across models and requests.
+_http_limits = httpx.Limits(max_connections=GROQ_MAX_CONNECTIONS,
+                            max_keepalive_connections=GROQ_MAX_KEEPALIVE)
+http_client = httpx.Client(limits=_http_limits, timeout=GROQ_TIMEOUT)
+http_async_client = httpx.AsyncClient(limits=_http_limits, timeout=GROQ_TIMEOUT)
+
+# ─────────────────────────────
+# Chain registry
+# ─────────────────────────────
+# model name -> (config fingerprint, RagChains)
+_chain_registry = {}
+_registry_lock = threading.Lock()
+
+# Compiled chains for one model: the full RAG chain, its question rewrite
+# step, and the shared-pool LLM client they use
+RagChains = namedtuple("RagChains", ["rag", "rewrite", "llm"])
+
+def _chain_config():
+    """Settings baked into a compiled chain; a change forces a rebuild."""
+    return (os.getenv("GROQ_API_KEY", GROQ_API_KEY), id(get_retrievers()[RetrievalMode.VECTOR]))
+
+def _build_llm(model):
+    from langchain_groq import ChatGroq
+    return ChatGroq(model=model,
+                    groq_api_key=os.getenv("GROQ_API_KEY", GROQ_API_KEY),
+                    http_client=http_client,
+                    http_async_client=http_async_client)
+
+# ─────────────────────────────
+# Question rewriting
+# ─────────────────────────────
+# Words that usually point back at an earlier turn
+_REFERENCE_WORDS = frozenset("""
+    it its it's itself they them their theirs themselves this that these those
+    he him his she her hers there then former latter above previous earlier
+    same such another other others else also too again more further instead
+    one ones
+""".split())
+_REFERENCE_PHRASES = ("what about", "how about", "and if", "why not", "tell me more",
+                      "go on", "the first", "the second", "the last")
+_WORD_PATTERN = re.compile(r"[a-z']+")
+
+def references_history(question):
+    """Cheap local check for whether a question leans on earlier turns.
+
+    Very short questions ("why?", "and the cost?") and questions with
+    pronouns or back-references are rewritten; anything else already stands
+    on its own.
+    """
+    text = question.lower()
+    words = _WORD_PATTERN.findall(text)
+    if len(words) < REWRITE_MIN_WORDS:
+        return True
+    if any(phrase in text for phrase in _REFERENCE_PHRASES):
+        return True
+    return any(word in _REFERENCE_WORDS for word in words)
+
+def _rewrite_skip_reason(question, chat_history):
+    if not chat_history:
+        return "no_history"
+    if REWRITE_HEURISTIC and not references_history(question):
+        return "no_reference"
+    return None
+
+def _route_standalone_question(rewrite_chain):
+    """Use a precomputed standalone question, the raw input when it needs no
+    rewriting, or the contextualize LLM call otherwise."""
+    def route(inputs):
+        if inputs.get("standalone_question"):
+            return inputs["standalone_question"]
+        if _rewrite_skip_reason(inputs["input"], inputs.get("chat_history")):
+            return inputs["input"]
+        return rewrite_chain
+    return RunnableLambda(route)
+
+# (session, turn fingerprint, model, question) -> (rewrite, seconds it took)
+_rewrite_memo = OrderedDict()
+_rewrite_memo_lock = threading.Lock()
+# model -> (rewrite calls, total seconds); the mean prices skipped calls
+_rewrite_timings = {}
+
+def _turn_key(session_id, chat_history, model, question):
+    """Identify a turn by its session and the history it was asked after."""
+    history = json.dumps(chat_history, sort_keys=True, default=str)
+    digest = hashlib.sha256(history.encode("utf-8")).hexdigest()
+    return (session_id, digest, model, question)
+
+def _mean_rewrite_seconds(model):
+    calls, seconds = _rewrite_timings.get(model, (0, 0.0))
+    return seconds / calls if calls else 0.0
+
+def _record_skip(model, reason, saved_seconds):
+    REWRITE_SKIPPED.labels(model=model, reason=reason).inc()
+    # A first turn was never rewritten, so skipping it saves nothing
+    if reason != "no_history":
+        REWRITE_SAVED_SECONDS.labels(model=model).inc(saved_seconds)
+
+def build_rag_chain(model="llama-3.1-8b-instant"):
+    """Build uncached RAG chains for the given model."""
+    llm= _build_llm(model)
+    # Stage tags name the LLM calls in traces and rag_stage_seconds
+    rewrite_chain = (contextualize_prompt | llm.with_config(tags=["stage:llm.rewrite"]) | output_parser
+                     ).with_config(callbacks=[tracing_callbacks])
+    qa_chain= create_stuff_documents_chain(llm.with_config(tags=["stage:llm.answer"]), qa_prompt)
+    # Same shape as create_retrieval_chain over create_history_aware_retriever,
+    # but the rewrite result is kept as standalone_question and can be passed
+    # in by callers that already computed it. inputs["retrieval_mode"] picks
+    # the retriever per request. The answer call sees context and history
+    # fitted to the model's prompt budget; "context" in the output keeps
+    # everything that was retrieved.
+    fit_to_budget = RunnableLambda(lambda inputs: budget_prompt_inputs(inputs, model, QA_PROMPT_TOKENS),
+                                   name="fit_prompt_budget")
+    rag_chain = (
+        RunnablePassthrough.assign(standalone_question=_route_standalone_question(rewrite_chain))
+        .assign(context=routed_retriever(get_retrievers()))
+        .assign(answer=fit_to_budget | qa_chain)
+    ).with_config(callbacks=[tracing_callbacks])
      # Step 4: Wrap with a RunnableMap to extract citations
     # rag_with_citations = RunnableMap({
     #     "answer": rag_chain,
     #     "documents": RunnableLambda(lambda x: history_aware_retriever.invoke(x)),
     # })
     # print("Answer with Citations : ", rag_with_citations)
-    return rag_chain
\ No newline at end of file
+    return RagChains(rag=rag_chain, rewrite=rewrite_chain, llm=llm)
+
+def _get_chains(model):
+    config = _chain_config()
+    entry = _chain_registry.get(model)
+    if entry is not None and entry[0] == config:
+        CHAIN_CACHE_HITS.labels(model=model).inc()
+        return entry[1]
+
+    with _registry_lock:
+        # Another thread may have built it while we waited for the lock
+        entry = _chain_registry.get(model)
+        if entry is not None and entry[0] == config:
+            CHAIN_CACHE_HITS.labels(model=model).inc()
+            return entry[1]
+
+        CHAIN_CACHE_MISSES.labels(model=model).inc()
+        start_time = time.perf_counter()
+        chains = build_rag_chain(model)
+        CHAIN_BUILD_SECONDS.labels(model=model).observe(time.perf_counter() - start_time)
+        _chain_registry[model] = (config, chains)
+        return chains
+
+def get_rag_chain(model="llama-3.1-8b-instant"):
+    """Return the compiled RAG chain for a model, building it on first use."""
+    return _get_chains(model).rag
+
+async def acontextualize_question(question, chat_history, model="llama-3.1-8b-instant", session_id=None):
+    """Return a standalone version of the question.
+
+    The LLM is only called when there is history and the question appears
+    to refer to it. With a session_id, rewrites are memoized per turn so a
+    retried or regenerated turn reuses the earlier result.
+    """
+    reason = _rewrite_skip_reason(question, chat_history)
+    if reason:
+        _record_skip(model, reason, _mean_rewrite_seconds(model))
+        return question
+
+    key = _turn_key(session_id, chat_history, model, question) if session_id else None
+    if key is not None:
+        with _rewrite_memo_lock:
+            memoized = _rewrite_memo.get(key)
+            if memoized is not None:
+                _rewrite_memo.move_to_end(key)
+        if memoized is not None:
+            _record_skip(model, "memoized", memoized[1])
+            return memoized[0]
+
+    start_time = time.perf_counter()
+    standalone = await _get_chains(model).rewrite.ainvoke({"input": question, "chat_history": chat_history})
+    elapsed = time.perf_counter() - start_time
+    REWRITE_LATENCY.labels(model=model).observe(elapsed)
+    with _rewrite_memo_lock:
+        calls, seconds = _rewrite_timings.get(model, (0, 0.0))
+        _rewrite_timings[model] = (calls + 1, seconds + elapsed)
+        if key is not None:
+            _rewrite_memo[key] = (standalone, elapsed)
+            while len(_rewrite_memo) > REWRITE_MEMO_ENTRIES:
+                _rewrite_memo.popitem(last=False)
+    return standalone
+
+def invalidate_rag_chains(model=None):
+    """Drop cached chains for one model, or all of them when model is None."""
+    with _registry_lock:
+        if model is None:
+            _chain_registry.clear()
+        else:
+            _chain_registry.pop(model, None)
+
+def warm_rag_chains(models):
+    """Build chains for the given models ahead of the first request."""
+    for model in models:
+        get_rag_chain(model)
+
+def built_models():
+    """Models whose chains are compiled and cached."""
+    return set(_chain_registry)
+
+def update_session_summary(session_id, model="llama-3.1-8b-instant"):
+    """Fold turns older than the history window into the session's rolling summary."""
+    if not CHAT_HISTORY_SUMMARY:
+        return
+    turns = get_turns_to_summarize(session_id)
+    if not turns:
+        return
+    previous = get_session_summary(session_id)
+    transcript = "\n".join(f"Human: {turn['user_query']}\nAI: {turn['gpt_response']}" for turn in turns)
+    summary_chain = summary_prompt | _get_chains(model).llm.with_config(tags=["stage:llm.summary"]) | output_parser
+    summary = summary_chain.invoke({
+        "summary": previous['summary'] if previous else "(none)",
+        "turns": transcript
+    }, config={"callbacks": [tracing_callbacks]})
+    upsert_session_summary(session_id, summary, turns[-1]['id'])
@@ -0,0 +1,161 @@
+# Write-behind writer for the application_logs table.
+# Chat handlers enqueue rows and return; a background thread commits them
+# in batched transactions so the response path never waits on an fsync.
+
+import os
+import queue
+import logging
+import threading
+import time
+from itertools import count
+from collections import OrderedDict
+
+from db_utils import get_recent_turns, build_chat_history, insert_application_logs_batch
+from tracing_utils import span
+
+LOG_WRITER_BATCH_SIZE = int(os.getenv("LOG_WRITER_BATCH_SIZE", "100"))
+LOG_WRITER_FLUSH_INTERVAL = float(os.getenv("LOG_WRITER_FLUSH_INTERVAL", "0.5"))
+LOG_WRITER_MAX_QUEUE = int(os.getenv("LOG_WRITER_MAX_QUEUE", "10000"))
+
+_STOP = object()
+
+
+class ApplicationLogWriter:
+    """Queue application log rows and flush them by batch size or age.
+
+    ``on_flush(rows, seconds)`` is called after every committed batch and is
+    how app2 feeds its Prometheus metrics.
+    """
+
+    def __init__(self, batch_size=LOG_WRITER_BATCH_SIZE,
+                 flush_interval=LOG_WRITER_FLUSH_INTERVAL,
+                 max_queue_size=LOG_WRITER_MAX_QUEUE, on_flush=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # Rows accepted but not yet committed, so history reads can see them
+        self._pending = {}
+        # seq -> application_logs id of recently written rows, so a history
+        # read can tell which of the pending rows it saw also came back from
+        # the database
+        self._written = OrderedDict()
+        self._max_written = max_queue_size
+        self._seq = count()
+        # Guards the two dicts above only; no database I/O runs under it
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Flush everything queued so far and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def submit(self, session_id, user_query, gpt_response, model):
+        """Queue a row without blocking; returns False when the queue is full.
+
+        A full queue means the writer cannot keep up, and the caller should
+        write the row itself so the backlog does not grow without bound.
+        """
+        seq = next(self._seq)
+        row = (session_id, user_query, gpt_response, model)
+        with self._lock:
+            self._pending[seq] = row
+        try:
+            self._queue.put_nowait((seq, row))
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(seq, None)
+            return False
+        return True
+
+    def get_chat_history(self, session_id, max_turns=None, max_tokens=None):
+        """db_utils.get_chat_history including this session's not yet flushed turns."""
+        with self._lock:
+            pending = [(seq, {"user_query": user_query, "gpt_response": gpt_response})
+                       for seq, (pending_session, user_query, gpt_response, _) in self._pending.items()
+                       if pending_session == session_id]
+        with span("db.chat_history"):
+            turns = get_recent_turns(session_id, max_turns, max_tokens)
+            if pending:
+                # A pending row may have been committed before the read above;
+                # keep the database copy then
+                read_ids = {turn['id'] for turn in turns}
+                with self._lock:
+                    written = {seq: self._written.get(seq) for seq, _ in pending}
+                turns += [turn for seq, turn in pending if written[seq] not in read_ids]
+            return build_chat_history(session_id, turns, max_turns)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch)
+
+        # Rows submitted after the stop marker still get written
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._flush(leftover)
+
+    def _record_written(self, batch, ids):
+        with self._lock:
+            for (seq, _), row_id in zip(batch, ids):
+                self._written[seq] = row_id
+            while len(self._written) > self._max_written:
+                self._written.popitem(last=False)
+
+    def _flush(self, batch):
+        start_time = time.perf_counter()
+        try:
+            # The ids are recorded before the commit makes the rows visible
+            insert_application_logs_batch([row for _, row in batch],
+                                          before_commit=lambda ids: self._record_written(batch, ids))
+        except Exception as e:
+            logging.error(f"Error flushing {len(batch)} application log rows: {e}")
+            with self._lock:
+                for seq, _ in batch:
+                    self._pending.pop(seq, None)
+                    self._written.pop(seq, None)
+            return
+        with self._lock:
+            for seq, _ in batch:
+                self._pending.pop(seq, None)
+        if self.on_flush:
+            self.on_flush(len(batch), time.perf_counter() - start_time)
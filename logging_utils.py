@@ -0,0 +1,223 @@
+# Application logging pipeline.
+# Request threads only put records on an in-memory queue (QueueHandler); a
+# background QueueListener thread formats them as JSON lines and writes
+# them to a file rotated by size and by age, flushing once per batch of
+# queued records rather than once per record. Long payload fields (questions,
+# answers) are truncated before they are queued, and the chat payload
+# logger can be sampled so busy servers keep a fraction of full turns.
+
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from prometheus_client import Counter
+
+from tracing_utils import current_request_id
+
+LOG_FILE = os.getenv("LOG_FILE", "application.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json | text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Rotation: whichever comes first; 0 disables that trigger
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Records waiting for the writer thread; beyond this new records are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# String fields longer than this are cut; 0 keeps them whole
+LOG_FIELD_MAX_CHARS = int(os.getenv("LOG_FIELD_MAX_CHARS", "1000"))
+# Fraction of chat payload records (full questions and answers) kept
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+
+# Loggers whose records carry request payloads and are subject to sampling
+PAYLOAD_LOGGERS = ("rag.chat",)
+
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total",
+                              "Log records not written", ["reason"])
+
+chat_logger = logging.getLogger("rag.chat")
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that also rolls over once the file is
+    ``interval_seconds`` old, keeping numbered backups (.1, .2, ...).
+
+    The file size is tracked as records are written (in characters, close
+    to bytes for log text), where the base class formats every record twice
+    and stats the file to decide.
+    """
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 interval_seconds=LOG_ROTATE_HOURS * 3600):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding="utf-8", delay=True)
+        self.interval_seconds = interval_seconds
+        self.rollover_at = self._next_rollover()
+        self.size = os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+
+    def _next_rollover(self):
+        return time.time() + self.interval_seconds if self.interval_seconds else None
+
+    def emit(self, record):
+        try:
+            message = self.format(record) + self.terminator
+            if ((self.rollover_at is not None and time.time() >= self.rollover_at)
+                    or (self.maxBytes and self.size and self.size + len(message) > self.maxBytes)):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(message)
+            self.size += len(message)
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover()
+        self.size = 0
+
+    def flush(self):
+        # emit() flushes after every record; the listener calls flush_now()
+        # once the queue is drained instead
+        pass
+
+    def flush_now(self):
+        super().flush()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Flushes its handlers whenever it has caught up with the queue."""
+
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                getattr(handler, "flush_now", handler.flush)()
+        return self.queue.get(block)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra={"fields": {...}}`` becomes top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text lines with structured fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={json.dumps(value, default=str, ensure_ascii=False)}"
+                                   for key, value in fields.items())
+        return line
+
+
+def truncate(value, max_chars=LOG_FIELD_MAX_CHARS):
+    """Cut a string to max_chars, noting how much was left out."""
+    if not max_chars or not isinstance(value, str) or len(value) <= max_chars:
+        return value
+    return f"{value[:max_chars]}... [+{len(value) - max_chars} chars]"
+
+
+class PayloadFilter(logging.Filter):
+    """Samples payload loggers and truncates long fields, before queueing."""
+
+    def __init__(self, sample_rate=LOG_PAYLOAD_SAMPLE_RATE, max_chars=LOG_FIELD_MAX_CHARS):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+
+    def filter(self, record):
+        if record.name in PAYLOAD_LOGGERS and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            LOG_RECORDS_DROPPED.labels(reason="sampled").inc()
+            return False
+        fields = getattr(record, "fields", None)
+        if fields and self.max_chars:
+            record.fields = {key: truncate(value, self.max_chars) for key, value in fields.items()}
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread and drops
+    records instead of blocking when the queue is full."""
+
+    def prepare(self, record):
+        # Resolve everything that may change or is costly to carry later;
+        # the JSON encoding itself happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = current_request_id()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+
+
+_listener = None
+_queue_handler = None
+
+
+def configure_logging(filename=LOG_FILE, level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Route the root logger through a queue to a rotating file.
+
+    ``filename`` may contain ``{pid}`` so that several worker processes do
+    not rotate the same file. Safe to call more than once.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    file_handler = SizeAndTimeRotatingFileHandler(filename.format(pid=os.getpid()))
+    file_handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(records)
+    _queue_handler.addFilter(PayloadFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+    _listener = BatchingQueueListener(records, file_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out queued records and stop the listener thread."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener.handlers[0].close()
+        _listener = None
+        _queue_handler = None
@@ -0,0 +1,140 @@
+# Metrics plumbing for the API process(es).
+# System gauges (CPU, memory, disk) are read from psutil when /metrics is
+# scraped, by a custom collector, instead of by a thread polling forever.
+# Per-process values (RSS, open fds, queue sizes) are sampled gauges: read
+# at scrape time in a single process, or refreshed by the process monitor
+# in every worker when PROMETHEUS_MULTIPROC_DIR enables multiprocess mode
+# (several uvicorn workers), since a scrape only reaches one worker there.
+
+import os
+import asyncio
+import logging
+
+import psutil
+from anyio.to_thread import current_default_thread_limiter
+from prometheus_client import (CollectorRegistry, Gauge, Histogram, REGISTRY,
+                               generate_latest, multiprocess, CONTENT_TYPE_LATEST)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+MULTIPROCESS = bool(PROMETHEUS_MULTIPROC_DIR)
+# Seconds between process monitor ticks (event-loop lag probe)
+PROCESS_MONITOR_INTERVAL = float(os.getenv("PROCESS_MONITOR_INTERVAL", "1.0"))
+DISK_USAGE_PATH = os.getenv("DISK_USAGE_PATH", "/")
+
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds",
+                           "How late the event loop ran a timer scheduled for now",
+                           buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+THREADPOOL_WAITING = Gauge("threadpool_tasks_waiting",
+                           "Sync endpoint / run_in_threadpool calls waiting for a worker thread",
+                           multiprocess_mode="livesum")
+THREADPOOL_BUSY = Gauge("threadpool_threads_busy",
+                        "Worker threads in use by sync endpoints and run_in_threadpool",
+                        multiprocess_mode="livesum")
+
+
+class SystemMetricsCollector(Collector):
+    """Host CPU, memory and disk usage, read from psutil on every scrape."""
+
+    def collect(self):
+        # cpu_percent(None) covers the time since the previous call, i.e.
+        # since the previous scrape
+        yield GaugeMetricFamily("cpu_usage_percent", "CPU usage percentage",
+                                value=psutil.cpu_percent(interval=None))
+        yield GaugeMetricFamily("memory_usage_percent", "Memory usage percentage",
+                                value=psutil.virtual_memory().percent)
+        yield GaugeMetricFamily("disk_usage_percent", "Disk usage percentage",
+                                value=psutil.disk_usage(DISK_USAGE_PATH).percent)
+
+
+system_collector = SystemMetricsCollector()
+if not MULTIPROCESS:
+    REGISTRY.register(system_collector)
+
+# (gauge, fn) pairs the process monitor refreshes in multiprocess mode
+_sampled_gauges = []
+
+
+def sampled_gauge(name, documentation, fn, multiprocess_mode="livesum"):
+    """Gauge whose value is fn(), read at scrape time.
+
+    In multiprocess mode the process monitor stores fn() every tick instead,
+    and the values of all live workers are combined per multiprocess_mode.
+    """
+    gauge = Gauge(name, documentation, multiprocess_mode=multiprocess_mode)
+    if MULTIPROCESS:
+        _sampled_gauges.append((gauge, fn))
+    else:
+        gauge.set_function(fn)
+    return gauge
+
+
+_process = psutil.Process()
+PROCESS_RSS = sampled_gauge("app_process_resident_memory_bytes",
+                            "Resident memory of the API process(es)",
+                            lambda: _process.memory_info().rss, multiprocess_mode="all")
+PROCESS_OPEN_FDS = sampled_gauge("app_process_open_fds",
+                                 "Open file descriptors of the API process(es)",
+                                 lambda: _process.num_fds(), multiprocess_mode="all")
+
+
+def route_label(request):
+    """Route template of the matched endpoint (e.g. /jobs/{job_id}).
+
+    Raw paths would create a label value per id and per probe of an
+    unknown URL.
+    """
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def metrics_payload():
+    """Return (body, content type) for the /metrics endpoint."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(system_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class ProcessMonitor:
+    """Asyncio task measuring event-loop lag and thread pool pressure, and
+    refreshing sampled gauges in multiprocess mode."""
+
+    def __init__(self, interval=PROCESS_MONITOR_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if MULTIPROCESS:
+            # Drops this worker's live gauges from the combined view
+            multiprocess.mark_process_dead(os.getpid())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(loop.time() - scheduled, 0.0))
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(f"Error sampling process metrics: {e}")
+
+    def sample(self):
+        stats = current_default_thread_limiter().statistics()
+        THREADPOOL_WAITING.set(stats.tasks_waiting)
+        THREADPOOL_BUSY.set(stats.borrowed_tokens)
+        for gauge, fn in _sampled_gauges:
+            gauge.set(fn())
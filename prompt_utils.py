@@ -0,0 +1,184 @@
+# Token-budgeted prompt assembly.
+# Retrieved chunks and chat history are fitted into a per-model prompt
+# budget before the answer LLM call: overlapping chunks (the splitter
+# repeats 200 characters between neighbours) are merged away, history keeps
+# its newest turns within its share, and chunks that do not fit whole are
+# cut down to the sentences that share terms with the question.
+
+import os
+import re
+from typing import List
+
+from langchain_core.documents import Document
+from prometheus_client import Counter, Histogram
+
+from db_utils import estimate_tokens
+from tracing_utils import traced
+
+# Prompt token budget per model; other models use PROMPT_TOKEN_BUDGET
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+MODEL_PROMPT_BUDGETS = {
+    "llama-3.1-8b-instant": int(os.getenv("PROMPT_TOKEN_BUDGET_LLAMA_8B", str(PROMPT_TOKEN_BUDGET))),
+    "gemma2-9b-it": int(os.getenv("PROMPT_TOKEN_BUDGET_GEMMA", str(PROMPT_TOKEN_BUDGET))),
+}
+# Largest share of the budget left after the fixed prompt that history may use
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.3"))
+
+# Shortest shared prefix/suffix treated as splitter overlap rather than chance
+_MIN_OVERLAP_CHARS = 30
+# Splitter chunk_overlap plus slack for whitespace differences
+_MAX_OVERLAP_CHARS = 250
+# Smallest remaining budget worth filling with a trimmed chunk
+_MIN_TRIMMED_TOKENS = 32
+
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+_TERM_PATTERN = re.compile(r"\w+")
+# Question words that say nothing about which sentences are relevant
+_STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from how i in is it of on or
+    the to was what when where which who why with you your about me my
+""".split())
+
+PROMPT_TOKENS = Histogram("rag_prompt_tokens",
+                          "Estimated prompt tokens per answer call by prompt part", ["model", "part"],
+                          buckets=(100, 250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000, 32000))
+PROMPT_CHUNKS_DROPPED = Counter("rag_prompt_chunks_dropped_total",
+                                "Retrieved chunks left out of the prompt", ["model", "reason"])
+PROMPT_CHUNKS_TRIMMED = Counter("rag_prompt_chunks_trimmed_total",
+                                "Retrieved chunks cut down to their relevant sentences", ["model"])
+
+
+def prompt_budget(model):
+    return MODEL_PROMPT_BUDGETS.get(model, PROMPT_TOKEN_BUDGET)
+
+
+def _overlap(first, second):
+    """Length of the longest suffix of first that is a prefix of second."""
+    tail = first[-_MAX_OVERLAP_CHARS:]
+    position = tail.find(second[:_MIN_OVERLAP_CHARS])
+    while position != -1:
+        if second.startswith(tail[position:]):
+            return len(tail) - position
+        position = tail.find(second[:_MIN_OVERLAP_CHARS], position + 1)
+    return 0
+
+
+def dedupe_chunks(documents: List[Document]):
+    """Drop repeated or contained chunks and strip text a chunk shares with
+    one already kept. Returns (kept documents, number dropped)."""
+    kept = []
+    originals = []
+    dropped = 0
+    for doc in documents:
+        text = doc.page_content
+        if not text.strip() or any(text in original for original in originals):
+            dropped += 1
+            continue
+        originals.append(text)
+        for other in kept:
+            if len(text) < _MIN_OVERLAP_CHARS:
+                break
+            # Neighbouring chunks share the splitter overlap in either order
+            head = _overlap(other.page_content, text)
+            if head >= _MIN_OVERLAP_CHARS:
+                text = text[head:]
+            tail = _overlap(text, other.page_content)
+            if tail >= _MIN_OVERLAP_CHARS:
+                text = text[:-tail]
+        if not text.strip():
+            dropped += 1
+            continue
+        kept.append(doc if text == doc.page_content
+                    else Document(id=doc.id, page_content=text.strip(), metadata=doc.metadata))
+    return kept, dropped
+
+
+def trim_to_relevant(text, query, max_tokens):
+    """Keep the sentences sharing the most terms with the query, in their
+    original order, within max_tokens. Returns "" if none are relevant."""
+    terms = set(_TERM_PATTERN.findall(query.lower())) - _STOPWORDS
+    sentences = [s for s in _SENTENCE_PATTERN.split(text) if s.strip()]
+    scored = []
+    for index, sentence in enumerate(sentences):
+        score = len(terms.intersection(_TERM_PATTERN.findall(sentence.lower())))
+        if score:
+            scored.append((score, index))
+    chosen = set()
+    used = 0
+    for score, index in sorted(scored, key=lambda item: (-item[0], item[1])):
+        cost = estimate_tokens(sentences[index])
+        if used + cost > max_tokens:
+            continue
+        chosen.add(index)
+        used += cost
+    return " ".join(sentences[index].strip() for index in sorted(chosen))
+
+
+def fit_history(chat_history, max_tokens):
+    """Keep the newest messages within max_tokens, whole turns at a time.
+
+    A leading system message (the session summary) is kept when it fits.
+    """
+    summary = []
+    messages = list(chat_history or [])
+    if messages and messages[0].get("role") == "system":
+        summary = [messages.pop(0)]
+    kept = []
+    used = 0
+    # Walk back over (human, ai) pairs so a turn is never split
+    for end in range(len(messages), 0, -2):
+        turn = messages[max(end - 2, 0):end]
+        cost = sum(estimate_tokens(message["content"]) for message in turn)
+        if used + cost > max_tokens:
+            break
+        kept[:0] = turn
+        used += cost
+    if summary and used + estimate_tokens(summary[0]["content"]) <= max_tokens:
+        kept[:0] = summary
+        used += estimate_tokens(summary[0]["content"])
+    return kept, used
+
+
+def fit_context(documents, query, max_tokens, model):
+    """Pack documents in rank order into max_tokens, trimming the ones that
+    do not fit whole to their relevant sentences."""
+    documents, duplicates = dedupe_chunks(documents)
+    PROMPT_CHUNKS_DROPPED.labels(model=model, reason="duplicate").inc(duplicates)
+    kept = []
+    used = 0
+    for doc in documents:
+        cost = estimate_tokens(doc.page_content)
+        remaining = max_tokens - used
+        if cost <= remaining:
+            kept.append(doc)
+            used += cost
+            continue
+        text = trim_to_relevant(doc.page_content, query, remaining) if remaining >= _MIN_TRIMMED_TOKENS else ""
+        if not text:
+            PROMPT_CHUNKS_DROPPED.labels(model=model, reason="budget").inc()
+            continue
+        PROMPT_CHUNKS_TRIMMED.labels(model=model).inc()
+        kept.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+        used += estimate_tokens(text)
+    return kept, used
+
+
+@traced("prompt.assemble")
+def budget_prompt_inputs(inputs, model, fixed_tokens=0):
+    """Return chain inputs whose context and chat_history fit the model's budget.
+
+    ``fixed_tokens`` is the size of the prompt template itself. History gets
+    at most PROMPT_HISTORY_SHARE of what is left after it and the question;
+    context gets the rest.
+    """
+    question = inputs["input"]
+    available = max(prompt_budget(model) - fixed_tokens - estimate_tokens(question), 0)
+    history, history_tokens = fit_history(inputs.get("chat_history"), int(available * PROMPT_HISTORY_SHARE))
+    query = inputs.get("standalone_question") or question
+    context, context_tokens = fit_context(inputs.get("context") or [], query,
+                                          available - history_tokens, model)
+    PROMPT_TOKENS.labels(model=model, part="history").observe(history_tokens)
+    PROMPT_TOKENS.labels(model=model, part="context").observe(context_tokens)
+    PROMPT_TOKENS.labels(model=model, part="total").observe(
+        fixed_tokens + estimate_tokens(question) + history_tokens + context_tokens)
+    return {**inputs, "chat_history": history, "context": context}
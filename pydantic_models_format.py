@@ -1,20 +1,55 @@
 # This file will contain the data type restriction classes
 # Certain parameters or arguments should follow the mentioned datatype
 
-from pydantic import Field, BaseModel
+import os
+from pydantic import Field, BaseModel, model_validator
 from enum import Enum
 from datetime import datetime
+from typing import List, Optional
+from retrieval_utils import RetrievalMode, RETRIEVAL_K, HYBRID_FETCH_K
+
+# Questions accepted by one /chat/batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "256"))
+# File ids accepted by one bulk delete or replace request
+BULK_MAX_FILE_IDS = int(os.getenv("BULK_MAX_FILE_IDS", "10000"))
 
 # Enum class for model names
 class ModelName(str, Enum):
     LLAMA_8BINSTANT = "llama-3.1-8b-instant"
     GEMMA = "gemma2-9b-it"
 
+# Enum class for vector search strategies
+class SearchType(str, Enum):
+    SIMILARITY = "similarity"
+    MMR = "mmr"
+
+# Pydantic model for per-request retrieval options
+class RetrievalOptions(BaseModel):
+    k: int = Field(default=RETRIEVAL_K, ge=1, le=50)
+    search_type: SearchType = Field(default=SearchType.SIMILARITY)
+    # Minimum relevance score in [0, 1] for vector similarity search
+    score_threshold: Optional[float] = Field(default=None, ge=0, le=1)
+    # MMR: candidates fetched before re-ranking, and relevance/diversity trade-off
+    fetch_k: int = Field(default=HYBRID_FETCH_K, ge=1, le=200)
+    lambda_mult: float = Field(default=0.5, ge=0, le=1)
+    # Restrict retrieval to these documents
+    file_ids: Optional[List[int]] = None
+    # Rerank over-fetched candidates; None uses the server's RERANKER setting
+    rerank: Optional[bool] = None
+
+    @model_validator(mode="after")
+    def check_search_type(self):
+        if self.search_type == SearchType.MMR and self.score_threshold is not None:
+            raise ValueError("score_threshold is not supported with mmr search")
+        return self
+
 # Pydantic model for query input
 class QueryInput(BaseModel):
     question: str
     session_id: str = Field(default=None)
     model: ModelName = Field(default=ModelName.LLAMA_8BINSTANT)
+    retrieval_mode: RetrievalMode = Field(default=RetrievalMode.HYBRID)
+    retrieval: RetrievalOptions = Field(default_factory=RetrievalOptions)
 
 # Pydantic model for query response
 class QueryResponse(BaseModel):
@@ -23,6 +58,24 @@ class QueryResponse(BaseModel):
     model: ModelName
     # citations: ReferenceDocs
 
+# Pydantic model for a batch of questions; limits default to the server's
+# BATCH_MAX_CONCURRENCY and BATCH_ITEM_TIMEOUT and can only be lowered
+class BatchQueryInput(BaseModel):
+    items: List[QueryInput] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+    item_timeout: Optional[float] = Field(default=None, gt=0)
+
+# Pydantic model for one line of the batch response, sent as it completes
+class BatchItemResult(BaseModel):
+    index: int
+    status: str  # ok | error | timeout
+    answer: Optional[str] = None
+    session_id: str
+    model: ModelName
+    cached: bool = False
+    error: Optional[str] = None
+    seconds: float
+
 # Pydantic model for document information
 class DocumentInfo(BaseModel):
     id: int
@@ -31,4 +84,39 @@ class DocumentInfo(BaseModel):
 
 # Pydantic model for delete file request
 class DeleteFileRequest(BaseModel):
-    file_id: int
\ No newline at end of file
+    file_id: int
+
+# Pydantic model for the upload response
+class UploadResponse(BaseModel):
+    message: str
+    file_id: int
+    job_id: Optional[str] = None
+    duplicate: bool = False
+
+# Pydantic model for deleting many documents at once
+class BulkDeleteRequest(BaseModel):
+    file_ids: List[int] = Field(min_length=1, max_length=BULK_MAX_FILE_IDS)
+
+# Pydantic model for the outcome of a bulk delete
+class BulkDeleteResponse(BaseModel):
+    deleted: List[int] = []
+    not_found: List[int] = []
+    # Still being indexed; delete them once their jobs finish
+    in_progress: List[int] = []
+
+# Pydantic model for the outcome of a bulk replace
+class BulkReplaceResponse(BaseModel):
+    uploads: List[UploadResponse] = []
+    removed: BulkDeleteResponse = Field(default_factory=BulkDeleteResponse)
+
+# Pydantic model for ingestion job status
+class IngestionJobStatus(BaseModel):
+    job_id: str
+    file_id: int
+    filename: str
+    status: str
+    total_chunks: Optional[int] = None
+    indexed_chunks: int = 0
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
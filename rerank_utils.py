@@ -0,0 +1,119 @@
+# Reranking of retrieved chunks.
+# Retrieval over-fetches candidates, a local CPU-only scorer orders them
+# by relevance to the question and only the best few go on to the prompt.
+# Scorers are pluggable: anything with score(query, texts) -> list of
+# floats works. RERANKER picks the server default.
+
+import os
+import re
+import math
+import time
+import logging
+import threading
+from collections import Counter as TermCounter
+from typing import List
+
+from langchain_core.documents import Document
+from prometheus_client import Histogram
+
+from tracing_utils import span
+
+# none | lexical | cross-encoder
+RERANKER = os.getenv("RERANKER", "none").lower()
+# Candidates retrieved per chunk kept when reranking
+RERANK_OVERFETCH = int(os.getenv("RERANK_OVERFETCH", "4"))
+RERANK_CROSS_ENCODER_MODEL = os.getenv("RERANK_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+RERANK_SECONDS = Histogram("rag_rerank_seconds",
+                           "Time spent reranking retrieved candidates", ["scorer"])
+
+_TERM_PATTERN = re.compile(r"\w+")
+
+
+class LexicalOverlapScorer:
+    """BM25 over the candidate set itself: query terms that are rare among
+    the candidates count most. Needs no model and no index."""
+
+    name = "lexical"
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        terms = set(_TERM_PATTERN.findall(query.lower()))
+        documents = [TermCounter(_TERM_PATTERN.findall(text.lower())) for text in texts]
+        if not terms or not documents:
+            return [0.0] * len(texts)
+        lengths = [sum(counts.values()) for counts in documents]
+        average_length = sum(lengths) / len(lengths) or 1
+        idf = {}
+        for term in terms:
+            containing = sum(1 for counts in documents if term in counts)
+            idf[term] = math.log(1 + (len(documents) - containing + 0.5) / (containing + 0.5))
+        scores = []
+        for counts, length in zip(documents, lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / average_length)
+            scores.append(sum(idf[term] * counts[term] * (self.k1 + 1) / (counts[term] + norm)
+                              for term in terms if term in counts))
+        return scores
+
+
+class CrossEncoderScorer:
+    """Small cross-encoder (sentence-transformers) scoring each
+    (query, chunk) pair; runs on CPU. Requires sentence-transformers."""
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name=RERANK_CROSS_ENCODER_MODEL):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        return [float(score) for score in self.model.predict([(query, text) for text in texts])]
+
+
+_SCORERS = {
+    "lexical": LexicalOverlapScorer,
+    "cross-encoder": CrossEncoderScorer,
+}
+_scorer_instances = {}
+_scorer_lock = threading.Lock()
+
+
+def get_scorer(name):
+    """Return the shared scorer instance for a name.
+
+    A cross-encoder that cannot be loaded (e.g. sentence-transformers not
+    installed) falls back to the lexical scorer.
+    """
+    with _scorer_lock:
+        if name not in _scorer_instances:
+            try:
+                _scorer_instances[name] = _SCORERS[name]()
+            except ImportError as e:
+                logging.warning(f"Reranker '{name}' unavailable ({e}), using lexical scorer")
+                _scorer_instances[name] = _scorer_instances.get("lexical") or LexicalOverlapScorer()
+        return _scorer_instances[name]
+
+
+def get_reranker(requested=None):
+    """Scorer for a request: ``requested`` True/False overrides the RERANKER
+    default; True with no server default uses the lexical scorer."""
+    if requested is False or (requested is None and RERANKER == "none"):
+        return None
+    return get_scorer(RERANKER if RERANKER != "none" else "lexical")
+
+
+def rerank(query: str, documents: List[Document], top_n: int, scorer) -> List[Document]:
+    """Return the top_n documents by scorer relevance; ties keep retrieval order."""
+    if not documents:
+        return documents
+    start_time = time.perf_counter()
+    with span("rerank"):
+        scores = scorer.score(query, [doc.page_content for doc in documents])
+    order = sorted(range(len(documents)), key=lambda index: -scores[index])
+    RERANK_SECONDS.labels(scorer=scorer.name).observe(time.perf_counter() - start_time)
+    return [documents[index] for index in order[:top_n]]
@@ -0,0 +1,335 @@
+# Lexical and hybrid retrieval.
+# Dense embeddings miss exact identifiers (error codes, config keys, product
+# names) that keyword search finds trivially, so chunks are also kept in a
+# local SQLite FTS5 index (lexical_chunks, maintained by chroma_utils) and
+# ranked with BM25. Hybrid retrieval fuses both rankings with reciprocal
+# rank fusion.
+
+import os
+import re
+import json
+import time
+import asyncio
+import unicodedata
+from enum import Enum
+from typing import List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+from langchain_core.vectorstores import VectorStoreRetriever
+from prometheus_client import Histogram
+
+from db_utils import (search_lexical_chunks, lexical_document_frequencies, count_lexical_chunks,
+                      estimate_tokens)
+from rerank_utils import get_reranker, rerank, RERANK_OVERFETCH
+from tracing_utils import record_stage
+
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+# Candidates taken from each retriever before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+# RRF damping constant; 60 is the value from the original RRF paper
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Lexical queries leave out terms found in more than LEXICAL_MAX_DF of the
+# chunks: they barely change BM25 scores but make FTS5 read long posting
+# lists. Terms in at most LEXICAL_DF_FLOOR chunks are always kept, so small
+# corpora stay searchable. At most LEXICAL_MAX_TERMS of the rarest terms
+# are searched for.
+LEXICAL_MAX_DF = float(os.getenv("LEXICAL_MAX_DF", "0.05"))
+LEXICAL_DF_FLOOR = int(os.getenv("LEXICAL_DF_FLOOR", "100"))
+LEXICAL_MAX_TERMS = int(os.getenv("LEXICAL_MAX_TERMS", "8"))
+# Counting the chunks of a term reads its whole posting list, so the counts
+# (and the total) are cached for this many seconds, up to this many terms
+LEXICAL_STATS_TTL = float(os.getenv("LEXICAL_STATS_TTL", "300"))
+LEXICAL_STATS_MAX_TERMS = int(os.getenv("LEXICAL_STATS_MAX_TERMS", "50000"))
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she should
+so some such than that the their theirs them themselves then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you
+your yours yourself yourselves
+""".split())
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+RETRIEVAL_LATENCY = Histogram("rag_retrieval_seconds",
+                              "Time spent retrieving context for one request", ["mode"])
+RETRIEVED_TOKENS = Histogram("rag_retrieved_tokens",
+                             "Estimated tokens of context retrieved for one request", ["mode"],
+                             buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+
+
+class RetrievalMode(str, Enum):
+    VECTOR = "vector"
+    LEXICAL = "lexical"
+    HYBRID = "hybrid"
+
+
+def query_terms(text):
+    """Distinct terms of the text in the form the FTS5 tokenizer indexes
+    them (lower case, without diacritics), stopwords left out."""
+    folded = "".join(char for char in unicodedata.normalize("NFKD", text.lower())
+                     if not unicodedata.combining(char))
+    return [term for term in dict.fromkeys(_TOKEN_PATTERN.findall(folded)) if term not in STOPWORDS]
+
+
+# (time taken, chunk count, {term: chunks containing it})
+_lexical_stats = (0.0, 0, {})
+
+
+def lexical_term_statistics(terms):
+    """(chunks in the lexical index, {term: chunks containing it}), from
+    the cache where possible."""
+    global _lexical_stats
+    taken_at, total, frequencies = _lexical_stats
+    if time.monotonic() - taken_at > LEXICAL_STATS_TTL or not total or len(frequencies) > LEXICAL_STATS_MAX_TERMS:
+        _lexical_stats = taken_at, total, frequencies = time.monotonic(), count_lexical_chunks(), {}
+    missing = [term for term in terms if term not in frequencies]
+    counted = lexical_document_frequencies(missing) if missing else {}
+    # Absent terms are not cached: a document containing them may be
+    # indexed before the entry would expire
+    frequencies.update((term, count) for term, count in counted.items() if count)
+    return total, {term: frequencies.get(term, counted.get(term, 0)) for term in terms}
+
+
+def select_terms(terms, frequencies, total, max_df=LEXICAL_MAX_DF, max_terms=LEXICAL_MAX_TERMS):
+    """The terms worth searching for: present in the index and not too
+    common (see LEXICAL_MAX_DF), the rarest max_terms of them."""
+    cutoff = max(max_df * total, LEXICAL_DF_FLOOR)
+    selective = sorted((term for term in terms if 0 < frequencies.get(term, 0) <= cutoff),
+                       key=lambda term: frequencies[term])
+    return selective[:max_terms]
+
+
+def build_match_query(terms):
+    """Turn terms into an FTS5 expression matching any of them.
+
+    Every term is quoted so FTS5 operators and punctuation in the question
+    are taken literally. Returns None when there are no terms.
+    """
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = RRF_K) -> List[Document]:
+    """Merge ranked lists, scoring each document by sum(1 / (k + rank)).
+
+    Documents are identified by id, falling back to their text.
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ordered]
+
+
+class LexicalRetriever(BaseRetriever):
+    """BM25 retriever over the local FTS5 chunk index; makes no embedding calls."""
+
+    k: int = RETRIEVAL_K
+    file_ids: Optional[List[int]] = None
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        terms = query_terms(query)
+        if terms:
+            total, frequencies = lexical_term_statistics(terms)
+            terms = select_terms(terms, frequencies, total)
+        match_query = build_match_query(terms)
+        if match_query is None:
+            return []
+        return [Document(id=row['chunk_id'], page_content=row['content'],
+                         metadata=json.loads(row['metadata']) if row['metadata'] else {})
+                for row in search_lexical_chunks(match_query, self.k, self.file_ids)]
+
+
+class PrefetchedRetriever(BaseRetriever):
+    """Returns documents that were already retrieved, e.g. by a batched
+    vector search over many questions (see routed_retriever)."""
+
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.documents
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        return self.documents
+
+
+class HybridRetriever(BaseRetriever):
+    """Vector and lexical retrieval fused with reciprocal rank fusion.
+
+    Each retriever is asked for ``fetch_k`` candidates; the best ``k`` fused
+    documents are returned.
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_retriever: LexicalRetriever
+    k: int = RETRIEVAL_K
+    fetch_k: int = HYBRID_FETCH_K
+
+    def _candidates(self):
+        fetch_k = max(self.fetch_k, self.k)
+        vector = self.vector_retriever
+        if isinstance(vector, VectorStoreRetriever):
+            search_kwargs = {**vector.search_kwargs, "k": fetch_k}
+            if "fetch_k" in search_kwargs:
+                search_kwargs["fetch_k"] = max(search_kwargs["fetch_k"], fetch_k)
+            vector = vector.model_copy(update={"search_kwargs": search_kwargs})
+        return vector, self.lexical_retriever.model_copy(update={"k": fetch_k})
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector, lexical = self._candidates()
+        config = {"callbacks": run_manager.get_child()}
+        rankings = [vector.invoke(query, config), lexical.invoke(query, config)]
+        return reciprocal_rank_fusion(rankings)[:self.k]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        vector, lexical = self._candidates()
+        config = {"callbacks": run_manager.get_child()}
+        rankings = await asyncio.gather(vector.ainvoke(query, config), lexical.ainvoke(query, config))
+        return reciprocal_rank_fusion(rankings)[:self.k]
+
+
+def configure_retriever(retriever, options=None):
+    """Return a per-request copy of a retriever with retrieval options applied.
+
+    ``options`` may hold k, search_type ("similarity" or "mmr"),
+    score_threshold, fetch_k and lambda_mult (MMR only), file_ids and
+    rerank (applied by routed_retriever). The
+    score threshold and search type only apply to vector search; file_ids
+    and k apply everywhere. Copies are cheap, so compiled chains never need
+    rebuilding for a different set of options.
+    """
+    if not options:
+        return retriever
+    k = options.get("k") or RETRIEVAL_K
+    file_ids = options.get("file_ids") or None
+
+    if isinstance(retriever, HybridRetriever):
+        return retriever.model_copy(update={
+            "k": k,
+            "vector_retriever": configure_retriever(retriever.vector_retriever, options),
+            "lexical_retriever": configure_retriever(retriever.lexical_retriever, options),
+        })
+    if isinstance(retriever, LexicalRetriever):
+        return retriever.model_copy(update={"k": k, "file_ids": file_ids})
+    if isinstance(retriever, VectorStoreRetriever):
+        search_type = options.get("search_type") or "similarity"
+        search_kwargs = {"k": k}
+        if file_ids:
+            search_kwargs["filter"] = file_filter(file_ids)
+        if search_type == "mmr":
+            search_kwargs["fetch_k"] = max(options.get("fetch_k") or HYBRID_FETCH_K, k)
+            if options.get("lambda_mult") is not None:
+                search_kwargs["lambda_mult"] = options["lambda_mult"]
+        elif options.get("score_threshold") is not None:
+            search_type = "similarity_score_threshold"
+            search_kwargs["score_threshold"] = options["score_threshold"]
+        return retriever.model_copy(update={"search_type": search_type, "search_kwargs": search_kwargs})
+    return retriever
+
+
+def file_filter(file_ids):
+    """Chroma metadata filter restricting a search to the given documents."""
+    if not file_ids:
+        return None
+    return {"file_id": file_ids[0]} if len(file_ids) == 1 else {"file_id": {"$in": file_ids}}
+
+
+def _retrieval_k(options):
+    """(documents returned, scorer): with reranking on, RERANK_OVERFETCH
+    times k candidates are retrieved and the scorer keeps the best k."""
+    k = options.get("k") or RETRIEVAL_K
+    return k, get_reranker(options.get("rerank"))
+
+
+def vector_search_plan(mode, options=None):
+    """(k, filter) of the plain similarity search that retrieval for this
+    mode and these options starts with, or None when it does something else
+    (lexical only, MMR, a score threshold).
+
+    Callers answering many questions run these searches together and pass
+    each result in as inputs["vector_documents"] (see routed_retriever).
+    """
+    mode = RetrievalMode(mode)
+    options = options or {}
+    if (mode == RetrievalMode.LEXICAL or (options.get("search_type") or "similarity") != "similarity"
+            or options.get("score_threshold") is not None):
+        return None
+    k, scorer = _retrieval_k(options)
+    if scorer:
+        k *= RERANK_OVERFETCH
+    if mode == RetrievalMode.HYBRID:
+        k = max(HYBRID_FETCH_K, k)
+    return k, file_filter(options.get("file_ids"))
+
+
+def _with_prefetched_vector(retriever, documents):
+    if isinstance(retriever, HybridRetriever):
+        return retriever.model_copy(update={"vector_retriever": PrefetchedRetriever(documents=documents)})
+    if isinstance(retriever, VectorStoreRetriever):
+        return PrefetchedRetriever(documents=documents)
+    return retriever
+
+
+def _observe_retrieval(mode, started, documents):
+    elapsed = time.perf_counter() - started
+    RETRIEVAL_LATENCY.labels(mode=mode.value).observe(elapsed)
+    record_stage("retrieve", started, elapsed)
+    RETRIEVED_TOKENS.labels(mode=mode.value).observe(
+        sum(estimate_tokens(doc.page_content) for doc in documents))
+
+
+def routed_retriever(retrievers, default=RetrievalMode.HYBRID):
+    """Runnable that retrieves for inputs["standalone_question"] with the
+    retriever picked by inputs["retrieval_mode"], configured with
+    inputs["retrieval_options"], so one compiled chain serves every request.
+
+    With reranking on, RERANK_OVERFETCH times k candidates are retrieved
+    and the reranker keeps the best k. inputs["vector_documents"], when
+    present, is the result of the vector search planned by
+    vector_search_plan and is used instead of searching again.
+    """
+    def pick(inputs):
+        mode = RetrievalMode(inputs.get("retrieval_mode") or default)
+        options = dict(inputs.get("retrieval_options") or {})
+        k, scorer = _retrieval_k(options)
+        if scorer:
+            options["k"] = k * RERANK_OVERFETCH
+        retriever = configure_retriever(retrievers[mode], options)
+        if inputs.get("vector_documents") is not None:
+            retriever = _with_prefetched_vector(retriever, inputs["vector_documents"])
+        return mode, retriever, scorer, k
+
+    def retrieve(inputs, config):
+        mode, retriever, scorer, k = pick(inputs)
+        started = time.perf_counter()
+        documents = retriever.invoke(inputs["standalone_question"], config)
+        if scorer:
+            documents = rerank(inputs["standalone_question"], documents, k, scorer)
+        _observe_retrieval(mode, started, documents)
+        return documents
+
+    async def aretrieve(inputs, config):
+        mode, retriever, scorer, k = pick(inputs)
+        started = time.perf_counter()
+        documents = await retriever.ainvoke(inputs["standalone_question"], config)
+        if scorer:
+            # Scoring is CPU work, keep it off the event loop
+            documents = await asyncio.to_thread(rerank, inputs["standalone_question"], documents, k, scorer)
+        _observe_retrieval(mode, started, documents)
+        return documents
+
+    return RunnableLambda(retrieve, afunc=aretrieve, name="retrieve")
@@ -0,0 +1,94 @@
+# Semantic answer cache.
+# Answers are stored against the embedding of the standalone question and
+# served again for any later question whose embedding is close enough,
+# scoped by model and corpus version so a changed corpus never serves an
+# answer built from documents that are gone.
+
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from itertools import count
+
+import numpy as np
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+
+# What a hit returns: the cached answer, how similar the question was and how
+# long the original computation took (i.e. the latency the hit saved)
+CacheHit = namedtuple("CacheHit", ["answer", "similarity", "latency"])
+
+_Entry = namedtuple("_Entry", ["model", "corpus_version", "question", "vector",
+                               "answer", "latency", "created_at"])
+
+
+class SemanticAnswerCache:
+    """Similarity-keyed answer cache with TTL and LRU eviction.
+
+    ``embed_fn`` maps a question to its embedding vector.
+    """
+
+    def __init__(self, embed_fn, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._keys = count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def embed(self, question):
+        vector = np.asarray(self.embed_fn(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, model, corpus_version, question, vector=None):
+        """Return a CacheHit for the closest fresh entry above the threshold, else None."""
+        if vector is None:
+            vector = self.embed(question)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            keys = [key for key, entry in self._entries.items()
+                    if entry.model == model and entry.corpus_version == corpus_version]
+            if not keys:
+                return None
+            matrix = np.stack([self._entries[key].vector for key in keys])
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            key = keys[best]
+            self._entries.move_to_end(key)
+            entry = self._entries[key]
+            return CacheHit(entry.answer, float(similarities[best]), entry.latency)
+
+    def store(self, model, corpus_version, question, answer, latency, vector=None):
+        if vector is None:
+            vector = self.embed(question)
+        entry = _Entry(model, corpus_version, question, vector, answer, latency, time.monotonic())
+        with self._lock:
+            self._entries[next(self._keys)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *_):
+        """Drop every entry; registered as a corpus change listener."""
+        with self._lock:
+            self._entries.clear()
+
+    def _evict_expired(self, now):
+        if not self.ttl_seconds:
+            return
+        expired = [key for key, entry in self._entries.items()
+                   if now - entry.created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
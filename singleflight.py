@@ -0,0 +1,90 @@
+# Single-flight request coalescing.
+# Concurrent calls with the same key share one execution: the first caller
+# runs the work and every caller that arrives while it is still in flight
+# waits for that result instead of repeating it. Nothing is kept once the
+# call finishes; repeated work over time is the caches' job.
+
+import os
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from prometheus_client import Counter
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+SINGLE_FLIGHT_CALLS = Counter("singleflight_calls_total",
+                              "Calls that ran their work (one per group of coalesced callers)", ["layer"])
+SINGLE_FLIGHT_COALESCED = Counter("singleflight_coalesced_total",
+                                  "Calls that shared the result of an identical in-flight call", ["layer"])
+
+
+class SingleFlight:
+    """Coalescing for blocking calls made from several threads."""
+
+    def __init__(self, layer, enabled=SINGLE_FLIGHT_ENABLED):
+        self.layer = layer
+        self.enabled = enabled
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        """Return fn(), or the result of the in-flight call with the same key."""
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            SINGLE_FLIGHT_COALESCED.labels(layer=self.layer).inc()
+            return future.result()
+
+        SINGLE_FLIGHT_CALLS.labels(layer=self.layer).inc()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """Coalescing for coroutines on one event loop.
+
+    The work runs in its own task, so a caller that is cancelled (e.g. its
+    client disconnected) does not cancel it for the others.
+    """
+
+    def __init__(self, layer, enabled=SINGLE_FLIGHT_ENABLED):
+        self.layer = layer
+        self.enabled = enabled
+        self._calls = {}
+
+    async def run(self, key, coro_fn):
+        """Await coro_fn(), or the in-flight call with the same key."""
+        if not self.enabled:
+            return await coro_fn()
+        task = self._calls.get(key)
+        if task is None:
+            SINGLE_FLIGHT_CALLS.labels(layer=self.layer).inc()
+            task = asyncio.ensure_future(coro_fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            SINGLE_FLIGHT_COALESCED.labels(layer=self.layer).inc()
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieve the exception so a call nobody waits for any more is not
+        # reported as "never retrieved"
+        if not task.cancelled():
+            task.exception()
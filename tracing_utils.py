@@ -0,0 +1,216 @@
+# Per-stage request tracing.
+# Each request carries a Trace in a context variable (set by the tracing
+# middleware in app2). Pipeline stages are timed with span() / @traced, or
+# through TracingCallbackHandler for LangChain LLM and retriever runs, and
+# every timing goes both to the rag_stage_seconds histogram and to the
+# request's trace, which is logged as one JSON line when the request ends.
+
+import time
+import uuid
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Histogram
+
+STAGE_SECONDS = Histogram("rag_stage_seconds",
+                          "Time spent in each stage of the RAG pipeline", ["stage", "model"],
+                          buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+LLM_TOKENS = Counter("llm_tokens_total",
+                     "Tokens used by LLM calls", ["model", "stage", "kind"])
+
+trace_logger = logging.getLogger("rag.trace")
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+
+# LangChain retriever class -> stage name
+_RETRIEVER_STAGES = {
+    "VectorStoreRetriever": "chroma.vector_search",
+    "LexicalRetriever": "db.lexical_search",
+    "HybridRetriever": "retrieve.hybrid",
+}
+
+
+class Trace:
+    """Timings and token usage collected for one request."""
+
+    def __init__(self, request_id, method=None, path=None):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.model = None
+        self.started = time.perf_counter()
+        self.spans = []
+        self.tokens = {}
+        # Streaming responses finish their trace when the stream ends
+        self.deferred = False
+
+    def add_span(self, stage, started, duration):
+        self.spans.append({"stage": stage,
+                           "start_ms": round((started - self.started) * 1000, 2),
+                           "duration_ms": round(duration * 1000, 2)})
+
+    def add_tokens(self, stage, kind, count):
+        key = f"{stage}.{kind}"
+        self.tokens[key] = self.tokens.get(key, 0) + count
+
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+
+def start_trace(request_id=None, method=None, path=None):
+    trace = Trace(request_id or new_request_id(), method, path)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+def set_trace_model(model):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.model = model
+
+
+def defer_trace():
+    """Leave the current trace open after the response starts (streaming)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.deferred = True
+    return trace
+
+
+def finish_trace(trace, status=None):
+    """Log a trace as one structured record."""
+    if trace is None:
+        return
+    trace_logger.info("Request trace", extra={"fields": {
+        "request_id": trace.request_id,
+        "method": trace.method,
+        "path": trace.path,
+        "status": status,
+        "model": trace.model,
+        "duration_ms": round((time.perf_counter() - trace.started) * 1000, 2),
+        "spans": trace.spans,
+        "tokens": trace.tokens,
+    }})
+
+
+def record_stage(stage, started, duration, model=None):
+    trace = _current_trace.get()
+    model = model or (trace.model if trace else None) or "none"
+    STAGE_SECONDS.labels(stage=stage, model=model).observe(duration)
+    if trace is not None:
+        trace.add_span(stage, started, duration)
+
+
+@contextmanager
+def span(stage, model=None):
+    """Time a block as one pipeline stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, started, time.perf_counter() - started, model)
+
+
+def traced(stage):
+    """Decorator timing every call of a function as a pipeline stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _stage_from_tags(tags, default):
+    for tag in tags or ():
+        if tag.startswith("stage:"):
+            return tag[len("stage:"):]
+    return default
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Times LangChain LLM and retriever runs and records LLM token usage.
+
+    LLM runs are named by a "stage:<name>" tag (e.g. stage:llm.answer).
+    """
+
+    # Only bookkeeping happens here; avoid an executor hop in async runs
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> (stage, model, started)
+        self._runs = {}
+
+    def _start(self, run_id, stage, model=None):
+        self._runs[run_id] = (stage, model, time.perf_counter())
+
+    def _end(self, run_id):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            stage, model, started = run
+            record_stage(stage, started, time.perf_counter() - started, model)
+        return run
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, metadata=None, **kwargs):
+        self._start(run_id, _stage_from_tags(tags, "llm"), (metadata or {}).get("ls_model_name"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, metadata=None, **kwargs):
+        self._start(run_id, _stage_from_tags(tags, "llm"), (metadata or {}).get("ls_model_name"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._end(run_id)
+        if run is None:
+            return
+        stage, model, _ = run
+        trace = _current_trace.get()
+        model = model or (trace.model if trace else None) or "none"
+        for kind, count in _token_usage(response).items():
+            LLM_TOKENS.labels(model=model, stage=stage, kind=kind).inc(count)
+            if trace is not None:
+                trace.add_tokens(stage, kind, count)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, name=None, **kwargs):
+        stage = _RETRIEVER_STAGES.get(name)
+        if stage:
+            self._start(run_id, stage)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+
+def _token_usage(response):
+    """Prompt/completion token counts from an LLMResult, if the provider sent them."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return {"prompt": usage.get("prompt_tokens", 0), "completion": usage.get("completion_tokens", 0)}
+    totals = {}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                totals["prompt"] = totals.get("prompt", 0) + metadata.get("input_tokens", 0)
+                totals["completion"] = totals.get("completion", 0) + metadata.get("output_tokens", 0)
+    return totals
+
+
+tracing_callbacks = TracingCallbackHandler()